@@ -0,0 +1,30 @@
+"""
+ASGI config for portal project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Served this way, the async chatbot endpoints (/api/async/...) await Ollama without
+holding a worker, while the rest of the Wagtail site runs in Django's sync-to-async
+thread pool. For example:
+
+    uvicorn bakerydemo.asgi:application --host 0.0.0.0 --port 8000 --workers 2
+
+Streaming responses are the exception: Django reads a sync response body to the
+end before sending any of it. Under ASGI, stream from /api/async/chatbot/stream/
+and /api/async/chatbot/batch/ (the chat UI switches by itself); the sync
+/api/chatbot/stream/ and /api/chatbot/batch/ only stream when served by WSGI
+(bakerydemo.wsgi, e.g. gunicorn).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/stable/howto/deployment/asgi/
+"""
+
+import os
+
+import dotenv
+from django.core.asgi import get_asgi_application
+
+dotenv.read_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bakerydemo.settings.dev")
+
+application = get_asgi_application()
@@ -4,8 +4,8 @@ from .models import ChatLog
 
 @admin.register(ChatLog)
 class ChatLogAdmin(admin.ModelAdmin):
-    list_display = ('id', 'created_at', 'truncated_prompt', 'truncated_response', 'model_name', 'user')
-    list_filter = ('created_at', 'model_name', 'user')
+    list_display = ('id', 'created_at', 'truncated_prompt', 'truncated_response', 'model_name', 'user', 'cancelled')
+    list_filter = ('created_at', 'model_name', 'user', 'cancelled')
     search_fields = ('user_prompt', 'ai_response', 'user__username')
     readonly_fields = ('created_at', 'updated_at', 'messages_formatted', 'user_prompt', 'ai_response')
     date_hierarchy = 'created_at'
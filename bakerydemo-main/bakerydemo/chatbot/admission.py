@@ -0,0 +1,347 @@
+"""
+Admission control in front of Ollama.
+A single Ollama host degrades badly when many generations run at once, so at most
+OLLAMA_MAX_CONCURRENT generations are let through. Further requests wait in a
+bounded FIFO queue until their deadline. Requests that find the queue full, or
+whose deadline passes while queued, are rejected straight away with a Retry-After
+hint instead of timing out together.
+"""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Optional
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted to Ollama."""
+
+    status = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(Overloaded):
+    """The wait queue is full; the client should back off."""
+
+    status = 429
+
+
+class QueueTimeout(Overloaded):
+    """The request's queue deadline passed before a slot became free."""
+
+    status = 503
+
+
+class _Waiter:
+    """A queued request, woken either through a threading.Event or an asyncio Future."""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.granted = False
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdmissionController:
+    """
+    A concurrency limiter with a bounded FIFO wait queue.
+
+    Sync and async callers share the same slots: a released slot is handed
+    directly to the oldest waiter, whichever kind it is.
+    """
+
+    def __init__(self, max_concurrent: int = 4, max_queue: int = 32, queue_timeout: float = 30, window: int = 1000):
+        """
+        Initialize the AdmissionController class.
+
+        Args:
+            max_concurrent: Generations allowed to run at once
+            max_queue: Requests allowed to wait for a slot
+            queue_timeout: Default seconds a request may wait in the queue
+            window: Number of recent wait and service times kept for metrics
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._queue: Deque[_Waiter] = deque()
+        self.active = 0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queue_depth = 0
+        self._wait_times: Deque[float] = deque(maxlen=window)
+        self._service_times: Deque[float] = deque(maxlen=window)
+
+    # -- bookkeeping ------------------------------------------------------
+
+    def _retry_after(self) -> int:
+        """Estimate how long until the queue drains enough to take a new request."""
+        service_time = sum(self._service_times) / len(self._service_times) if self._service_times else 5.0
+        rounds = (len(self._queue) + 1) / self.max_concurrent
+        return max(1, math.ceil(service_time * rounds))
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        # Called with the lock held
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull("Too many chat requests are waiting for the model", self._retry_after())
+        self._queue.append(waiter)
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+
+    def _try_fast_path(self) -> bool:
+        # Called with the lock held; queued requests go first
+        if self.active < self.max_concurrent and not self._queue:
+            self.active += 1
+            self.admitted += 1
+            self._wait_times.append(0.0)
+            return True
+        return False
+
+    def _abandon(self, waiter: _Waiter, started_at: float) -> bool:
+        """
+        Take a waiter that gave up out of the queue.
+
+        Returns:
+            True if the slot had already been granted, so the caller owns it anyway
+        """
+        with self._lock:
+            if waiter.granted:
+                self._admit(started_at)
+                return True
+            self._queue.remove(waiter)
+            self.timed_out += 1
+            return False
+
+    def _admit(self, started_at: float) -> None:
+        # Called with the lock held; the slot itself was transferred by release()
+        self.admitted += 1
+        self._wait_times.append(time.monotonic() - started_at)
+
+    def _timeout_error(self) -> QueueTimeout:
+        with self._lock:
+            retry_after = self._retry_after()
+        return QueueTimeout("Timed out waiting for a free model slot", retry_after)
+
+    # -- acquire / release ------------------------------------------------
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """
+        Block until a slot is free.
+
+        Args:
+            timeout: Seconds this request may wait (default: the controller's queue_timeout)
+
+        Raises:
+            QueueFull: If the wait queue is full
+            QueueTimeout: If no slot became free before the deadline
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        started_at = time.monotonic()
+        with self._lock:
+            if self._try_fast_path():
+                return
+            waiter = _Waiter()
+            self._enqueue(waiter)
+
+        if waiter.event.wait(max(timeout, 0)):
+            with self._lock:
+                self._admit(started_at)
+            return
+        if not self._abandon(waiter, started_at):
+            raise self._timeout_error()
+
+    async def aacquire(self, timeout: Optional[float] = None) -> None:
+        """Async counterpart of acquire(); waiting does not block the event loop."""
+        timeout = self.queue_timeout if timeout is None else timeout
+        started_at = time.monotonic()
+        with self._lock:
+            if self._try_fast_path():
+                return
+            waiter = _Waiter(asyncio.get_running_loop())
+            self._enqueue(waiter)
+
+        try:
+            await asyncio.wait_for(waiter.future, max(timeout, 0))
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter, started_at):
+                raise self._timeout_error()
+            return
+        except asyncio.CancelledError:
+            # The client went away while queued; pass on a slot we may have been given
+            if self._abandon(waiter, started_at):
+                self.release()
+            raise
+        with self._lock:
+            self._admit(started_at)
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        """Free a slot, handing it straight to the oldest waiter if there is one."""
+        with self._lock:
+            if service_time is not None:
+                self._service_times.append(service_time)
+            if self._queue:
+                self._queue.popleft().grant()
+            else:
+                self.active -= 1
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None):
+        """Hold a slot for the duration of a with block."""
+        self.acquire(timeout)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started_at)
+
+    @asynccontextmanager
+    async def aslot(self, timeout: Optional[float] = None):
+        """Async counterpart of slot()."""
+        await self.aacquire(timeout)
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started_at)
+
+    # -- metrics ----------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue depth and wait-time metrics."""
+        with self._lock:
+            waits = sorted(self._wait_times)
+            queue_depth = len(self._queue)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 1) if waits else 0.0
+
+        return {
+            "active": self.active,
+            "queue_depth": queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_ms_p50": percentile(0.50),
+            "wait_ms_p95": percentile(0.95),
+        }
+
+
+class ReleasingIterator:
+    """
+    Wraps a streaming response body so its admission slot is released when the
+    response is closed, even if the body was never iterated.
+    """
+
+    def __init__(self, iterable, controller: AdmissionController):
+        self._iterator = iter(iterable)
+        self._controller = controller
+        self._started_at = time.monotonic()
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        try:
+            close = getattr(self._iterator, "close", None)
+            if close is not None:
+                close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._controller.release(time.monotonic() - self._started_at)
+
+
+class AsyncReleasingIterator:
+    """
+    Async counterpart of ReleasingIterator, for streaming responses served through
+    ASGI. Django does not close a response whose client disconnected, so the slot
+    is also released when the body ends or fails (a disconnect cancels it), and
+    as a last resort when a response that was never read is dropped.
+    """
+
+    def __init__(self, iterable, controller: AdmissionController):
+        self._iterator = iterable.__aiter__()
+        self._controller = controller
+        self._started_at = time.monotonic()
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            # StopAsyncIteration, an error of the body or the cancellation of a disconnect
+            self.close()
+            raise
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._controller.release(time.monotonic() - self._started_at)
+
+    __del__ = close
+
+
+_controller: Optional[AdmissionController] = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide AdmissionController configured from Django settings."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                from django.conf import settings
+
+                _controller = AdmissionController(
+                    max_concurrent=getattr(settings, "OLLAMA_MAX_CONCURRENT", 4),
+                    max_queue=getattr(settings, "OLLAMA_MAX_QUEUE", 32),
+                    queue_timeout=getattr(settings, "OLLAMA_QUEUE_TIMEOUT", 30),
+                )
+    return _controller
+
+
+def overloaded_response(error: Overloaded):
+    """Build the fast 429/503 JSON response for a rejected request."""
+    from django.http import JsonResponse
+
+    response = JsonResponse({"error": str(error), "retry_after": error.retry_after}, status=error.status)
+    response["Retry-After"] = str(error.retry_after)
+    return response
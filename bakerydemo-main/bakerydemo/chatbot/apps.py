@@ -1,6 +1,34 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
+SERVER_COMMANDS = ("uwsgi", "uvicorn", "gunicorn", "daphne", "hypercorn")
+
+
+def serves_requests():
+    """
+    Whether this process serves HTTP requests (uWSGI, uvicorn, runserver) rather than
+    running a management command such as migrate, or a script such as a benchmark.
+    """
+    # uWSGI exposes its API as a module inside the processes it runs
+    if "uwsgi" in sys.modules:
+        return True
+    command = os.path.basename(sys.argv[0]) if sys.argv else ""
+    if command in ("manage.py", "django-admin"):
+        # The autoreloader's parent process only watches files
+        return "runserver" in sys.argv and (os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv)
+    return command in SERVER_COMMANDS
+
 
 class ChatbotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bakerydemo.chatbot'
+
+    def ready(self):
+        # Load the Ollama models before the first chat request needs them
+        # (uWSGI runs with lazy-apps, so every worker starts its own keeper)
+        if serves_requests():
+            from .model_keeper import start_model_keeper
+
+            start_model_keeper()
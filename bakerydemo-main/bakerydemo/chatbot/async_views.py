@@ -0,0 +1,529 @@
+"""
+Async versions of the chatbot endpoints.
+Served through bakerydemo.asgi, these views await Ollama instead of blocking a
+worker thread, so one process can hold hundreds of generations in flight. Their
+streaming bodies are async iterators, which is what ASGI needs to send each
+token or batch result as soon as it is ready.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from . import embedding_store, response_cache, semantic_cache
+from .admission import (
+    AsyncReleasingIterator,
+    Overloaded,
+    get_admission_controller,
+    overloaded_response,
+)
+from .batch import BatchRunner, get_batch_concurrency, parse_batch
+from .chatlog_writer import apersist_chat_log
+from .conversation import aprepare_conversation
+from .deadline import acollect_stream, get_request_deadline, with_budget
+from .metrics import get_metrics, get_stage_timer, timed_view
+from .model_keeper import get_model_keeper
+from .ollama_client import get_async_ollama_client
+from .prompt_embeddings import astart_prompt_embedding, get_lookup_wait
+from .singleflight import FlightTimeout, acoalesce
+from .views import MODEL_NAME, SYSTEM_PROMPT, sse_event
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+async def astore_prompt_embedding_key(request, pending_embedding):
+    """Async counterpart of views.store_prompt_embedding_key."""
+    await request.session.apop(embedding_store.LEGACY_SESSION_KEY, None)
+    if pending_embedding is not None and pending_embedding.store:
+        await request.session.aset(embedding_store.SESSION_KEY, pending_embedding.key)
+
+
+async def asave_chat_log(request, messages, model_name, **fields):
+    """Async counterpart of views.save_chat_log."""
+    user = await request.auser()
+    return await apersist_chat_log(
+        messages=messages,
+        model_name=model_name,
+        user=user if user.is_authenticated else None,
+        session_key=request.session.session_key,
+        **fields
+    )
+
+
+@csrf_exempt
+@timed_view
+async def chatbot_api_async(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+    try:
+        # Make sure we have a session key for anonymous users
+        if not request.session.session_key:
+            await request.session.asave()
+
+        timer = get_stage_timer(request)
+        data = json.loads(request.body)
+        user_prompt = data.get('message', '').strip()
+        use_bedrock_embeddings = data.get('use_bedrock_embeddings', True)
+        use_history = data.get('use_history', True)
+        deadline = get_request_deadline(data)
+        logger.info(f"Received async user prompt: {user_prompt}")
+
+        # Build the conversation array (this turn only; earlier turns are in their own ChatLogs)
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+        model_name = MODEL_NAME
+
+        # Earlier turns of the session, trimmed to the history token budget
+        with timer.stage("history"):
+            conversation = await aprepare_conversation(
+                request.session.session_key, SYSTEM_PROMPT, user_prompt, model_name, use_history
+            )
+
+        # Answer repeated questions from the response cache without calling Ollama.
+        # Answers that depend on earlier turns are neither looked up nor cached.
+        cached_content = None
+        if not conversation.has_history:
+            with timer.stage("cache"):
+                cached_content = await response_cache.aget_cached_response(model_name, SYSTEM_PROMPT, user_prompt)
+        if cached_content is not None:
+            logger.info("Answering from the response cache")
+            messages.append({"role": "assistant", "content": cached_content})
+            with timer.stage("chatlog"):
+                await asave_chat_log(request, messages, model_name)
+            return JsonResponse({
+                "response": cached_content,
+                "cache_hit": True,
+                "embeddings_generated": False,
+                "timings": timer.as_dict()
+            })
+
+        # boto3 is blocking, so the Bedrock call runs on the embedding thread pool,
+        # alongside the generation
+        pending_embedding = await astart_prompt_embedding(user_prompt) if use_bedrock_embeddings else None
+        await astore_prompt_embedding_key(request, pending_embedding)
+
+        # Reuse the answer to a near-duplicate prompt when one is cached
+        embeddings = match = None
+        if pending_embedding is not None and not conversation.has_history:
+            with timer.stage("embedding_wait"):
+                embeddings = await pending_embedding.apeek(deadline.within(get_lookup_wait()))
+            with timer.stage("semantic"):
+                match = await semantic_cache.alookup_answer(embeddings, model_name, SYSTEM_PROMPT)
+        if match is not None:
+            logger.info(f"Answering from the semantic cache (similarity {match.similarity:.3f})")
+            timer.record("embedding", pending_embedding.seconds)
+            messages.append({"role": "assistant", "content": match.response})
+            with timer.stage("chatlog"):
+                await asave_chat_log(request, messages, model_name)
+            return JsonResponse({
+                "response": match.response,
+                "cache_hit": True,
+                "semantic_cache_hit": True,
+                "similarity": round(match.similarity, 4),
+                "embeddings_generated": True,
+                "embeddings_length": len(embeddings),
+                "timings": timer.as_dict()
+            })
+
+        payload = conversation.payload(model_name)
+
+        try:
+            # Identical prompts already in flight share one generation
+            flight_key = response_cache.make_cache_key(model_name, SYSTEM_PROMPT, user_prompt)
+            # The answer so far, kept in case the client disconnects halfway
+            pieces = []
+
+            async def generate():
+                # Only the leader of a coalesced prompt waits for a model slot
+                queued_at = time.perf_counter()
+                admission = get_admission_controller()
+                async with admission.aslot(deadline.within(admission.queue_timeout)):
+                    timer.record("queue", time.perf_counter() - queued_at)
+                    with timer.stage("ollama"):
+                        client = get_async_ollama_client()
+                        budgeted = with_budget(payload, deadline)
+                        if conversation.use_context:
+                            stream = client.generate_stream(budgeted, timeout=deadline.within())
+                        else:
+                            stream = client.chat_stream(budgeted, timeout=deadline.within())
+                        return await acollect_stream(stream, deadline, chat=not conversation.use_context, pieces=pieces)
+
+            generation_started_at = time.perf_counter()
+            if conversation.has_history:
+                result, coalesced = await generate(), False
+            else:
+                # A follower waits no longer than this request's deadline
+                result, coalesced = await acoalesce(flight_key, generate, deadline.within(), reusable=deadline.can_reuse)
+            generation_time = time.perf_counter() - generation_started_at
+            timer.record("generation", generation_time)
+            timer.record_ollama(result)
+            ai_content = conversation.answer(result)
+            truncated = result.get("truncated", False)
+            conversation.remember(request.session.session_key, model_name, result, ai_content)
+
+            # Join the embedding, which has usually finished during the generation
+            if pending_embedding is not None:
+                with timer.stage("embedding_wait"):
+                    embeddings = await pending_embedding.apeek(deadline.within())
+                timer.record("embedding", pending_embedding.seconds)
+    
+            # Append AI response to messages
+            messages.append({"role": "assistant", "content": ai_content})
+
+            # Persist to AWS RDS via Django model
+            with timer.stage("chatlog"):
+                await asave_chat_log(request, messages, model_name)
+            if not coalesced and not truncated and not conversation.has_history:
+                with timer.stage("cache_store"):
+                    await response_cache.acache_response(model_name, SYSTEM_PROMPT, user_prompt, ai_content)
+                    # May write through to Redis, so keep it off the event loop
+                    await sync_to_async(semantic_cache.remember_answer, thread_sensitive=False)(
+                        embeddings, model_name, SYSTEM_PROMPT, user_prompt, ai_content, generation_time
+                    )
+
+            response_data = {
+                "response": ai_content,
+                "cache_hit": False,
+                "coalesced": coalesced,
+                "truncated": truncated,
+                "embeddings_generated": use_bedrock_embeddings,
+                "history": conversation.stats()
+            }
+            if embeddings is not None:
+                response_data["embeddings_length"] = len(embeddings)
+            response_data["timings"] = timer.as_dict()
+
+            return JsonResponse(response_data)
+
+        except asyncio.CancelledError:
+            # Django cancels the view when the client disconnects; acollect_stream closed
+            # the upstream stream on the way out, which made Ollama stop generating
+            if messages[-1]["role"] != "assistant":
+                logger.info(f"Client disconnected after {len(pieces)} chunks; saving the partial answer")
+                get_metrics().observe("cancelled", "async", time.perf_counter() - generation_started_at)
+                messages.append({"role": "assistant", "content": "".join(pieces)})
+                await asave_chat_log(request, messages, model_name, cancelled=True)
+            raise
+        except Overloaded as e:
+            logger.warning(f"Rejected chat request: {str(e)}")
+            return overloaded_response(e)
+        except FlightTimeout as e:
+            logger.warning(str(e))
+            return JsonResponse({"error": "Timed out waiting for the answer to an identical request"}, status=504)
+        except httpx.TimeoutException:
+            logger.error("Request to Ollama API timed out")
+            return JsonResponse({"error": "Request to Ollama API timed out. Please try again later."}, status=504)
+        except httpx.ConnectError:
+            logger.error(f"Connection error to Ollama API at {settings.OLLAMA_API_URL}")
+            return JsonResponse({"error": f"Could not connect to Ollama API at {settings.OLLAMA_API_URL}. Please check if the service is running."}, status=503)
+        except ValueError:
+            logger.error("Failed to parse JSON response from Ollama")
+            return JsonResponse({"error": "Invalid JSON response from Ollama API"}, status=502)
+        except httpx.HTTPError as req_err:
+            logger.error(f"Request error: {str(req_err)}")
+            return JsonResponse({"error": f"Request error: {str(req_err)}"}, status=500)
+
+    except Exception as e:
+        logger.exception(f"Unexpected error in chatbot_api_async: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+async def aevents(events):
+    """Serve already generated events as an async iterator, which ASGI sends without a thread."""
+    for event in events:
+        yield event
+
+
+def event_stream_response(events, content_type='text/event-stream'):
+    response = StreamingHttpResponse(events, content_type=content_type)
+    # Stop proxies (nginx, Heroku router) from buffering the stream
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@csrf_exempt
+@timed_view
+async def chatbot_stream_api_async(request):
+    """
+    Async version of views.chatbot_stream_api.
+    Under ASGI a response body has to be an async iterator to be streamed: Django
+    reads a sync one to the end before sending anything. Tokens are relayed from
+    Ollama as they arrive, and a client that disconnects cancels the generation.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+    try:
+        # Make sure we have a session key for anonymous users
+        if not request.session.session_key:
+            await request.session.asave()
+
+        timer = get_stage_timer(request)
+        data = json.loads(request.body)
+        user_prompt = data.get('message', '').strip()
+        use_bedrock_embeddings = data.get('use_bedrock_embeddings', True)
+        use_history = data.get('use_history', True)
+        deadline = get_request_deadline(data)
+        logger.info(f"Received async streaming user prompt: {user_prompt}")
+
+        model_name = MODEL_NAME
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+        with timer.stage("history"):
+            conversation = await aprepare_conversation(
+                request.session.session_key, SYSTEM_PROMPT, user_prompt, model_name, use_history
+            )
+
+        # A cached answer is sent as a single token event
+        cached_content = None
+        if not conversation.has_history:
+            with timer.stage("cache"):
+                cached_content = await response_cache.aget_cached_response(model_name, SYSTEM_PROMPT, user_prompt)
+        if cached_content is not None:
+            logger.info("Answering async streaming request from the response cache")
+            messages.append({"role": "assistant", "content": cached_content})
+            with timer.stage("chatlog"):
+                await asave_chat_log(request, messages, model_name)
+            return event_stream_response(aevents([
+                sse_event({"token": cached_content}),
+                sse_event({
+                    "cache_hit": True,
+                    "embeddings_generated": False,
+                    "timings": timer.as_dict(),
+                }, event="done"),
+            ]))
+
+        # The embedding runs in the background while tokens stream
+        pending_embedding = await astart_prompt_embedding(user_prompt) if use_bedrock_embeddings else None
+        await astore_prompt_embedding_key(request, pending_embedding)
+        embeddings = match = None
+        if pending_embedding is not None and not conversation.has_history:
+            with timer.stage("embedding_wait"):
+                embeddings = await pending_embedding.apeek(deadline.within(get_lookup_wait()))
+            with timer.stage("semantic"):
+                match = await semantic_cache.alookup_answer(embeddings, model_name, SYSTEM_PROMPT)
+        if match is not None:
+            logger.info(f"Answering async streaming request from the semantic cache (similarity {match.similarity:.3f})")
+            timer.record("embedding", pending_embedding.seconds)
+            messages.append({"role": "assistant", "content": match.response})
+            with timer.stage("chatlog"):
+                await asave_chat_log(request, messages, model_name)
+            return event_stream_response(aevents([
+                sse_event({"token": match.response}),
+                sse_event({
+                    "cache_hit": True,
+                    "semantic_cache_hit": True,
+                    "similarity": round(match.similarity, 4),
+                    "embeddings_generated": True,
+                    "embeddings_length": len(embeddings),
+                    "timings": timer.as_dict(),
+                }, event="done"),
+            ]))
+
+        # Take a model slot before streaming starts so an overloaded server can still answer 429/503
+        admission = get_admission_controller()
+        with timer.stage("queue"):
+            await admission.aacquire(deadline.within(admission.queue_timeout))
+    except Overloaded as e:
+        logger.warning(f"Rejected async streaming chat request: {str(e)}")
+        return overloaded_response(e)
+    except Exception as e:
+        logger.exception(f"Unexpected error in chatbot_stream_api_async: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+    try:
+        payload = with_budget(conversation.payload(model_name), deadline)
+        # Resolve these now: the generator below runs after the view has returned
+        user = await request.auser()
+        user = user if user.is_authenticated else None
+        session_key = request.session.session_key
+    except BaseException:
+        # Nothing else gives the slot back until the stream is wrapped below; this
+        # includes the cancellation of a client that disconnects meanwhile
+        admission.release()
+        raise
+
+    async def event_stream():
+        tokens = []
+        chat_log = None
+        generation_started_at = time.perf_counter()
+        try:
+            client = get_async_ollama_client()
+            if conversation.use_context:
+                stream = client.generate_stream(payload, timeout=deadline.within())
+            else:
+                stream = client.chat_stream(payload, timeout=deadline.within())
+            final_chunk = {}
+            truncated = False
+            try:
+                async for chunk in stream:
+                    token = conversation.answer(chunk)
+                    if token:
+                        if not tokens:
+                            timer.record("first_token", time.perf_counter() - generation_started_at)
+                        tokens.append(token)
+                        yield sse_event({"token": token})
+                    if chunk.get('done'):
+                        final_chunk = chunk
+                        timer.record_ollama(chunk)
+                        break
+                    if deadline.expired():
+                        logger.warning("Deadline reached while streaming; ending with a partial answer")
+                        truncated = True
+                        break
+            except httpx.TimeoutException:
+                # A read that timed out at the deadline ends the answer like the check above
+                if not tokens or not deadline.expired():
+                    raise
+                truncated = True
+            finally:
+                # Closing the stream closes the connection, which stops the generation
+                await stream.aclose()
+            truncated = truncated or final_chunk.get("done_reason") == "length"
+
+            ai_content = ''.join(tokens)
+            conversation.remember(session_key, model_name, final_chunk, ai_content)
+            generation_time = time.perf_counter() - generation_started_at
+            timer.record("generation", generation_time)
+            messages.append({"role": "assistant", "content": ai_content})
+            embeddings = None
+            if pending_embedding is not None:
+                with timer.stage("embedding_wait"):
+                    embeddings = await pending_embedding.apeek(deadline.within())
+                timer.record("embedding", pending_embedding.seconds)
+
+            with timer.stage("chatlog"):
+                chat_log = await apersist_chat_log(
+                    messages=messages,
+                    model_name=model_name,
+                    user=user,
+                    session_key=session_key
+                )
+            if not truncated and not conversation.has_history:
+                with timer.stage("cache_store"):
+                    await response_cache.acache_response(model_name, SYSTEM_PROMPT, user_prompt, ai_content)
+                    # May write through to Redis, so keep it off the event loop
+                    await sync_to_async(semantic_cache.remember_answer, thread_sensitive=False)(
+                        embeddings, model_name, SYSTEM_PROMPT, user_prompt, ai_content, generation_time
+                    )
+
+            yield sse_event({
+                "cache_hit": False,
+                "truncated": truncated,
+                "embeddings_generated": use_bedrock_embeddings,
+                "embeddings_length": len(embeddings) if embeddings is not None else 0,
+                "history": conversation.stats(),
+                "timings": timer.as_dict(),
+            }, event="done")
+
+        except (asyncio.CancelledError, GeneratorExit):
+            # Django cancels the response when the client disconnects; the stream was
+            # closed on the way out, which made Ollama stop generating
+            if chat_log is None:
+                logger.info(f"Client disconnected after {len(tokens)} tokens; saving the partial answer")
+                get_metrics().observe("cancelled", "async_stream", time.perf_counter() - generation_started_at)
+                messages.append({"role": "assistant", "content": ''.join(tokens)})
+                await apersist_chat_log(
+                    messages=messages,
+                    model_name=model_name,
+                    user=user,
+                    session_key=session_key,
+                    cancelled=True
+                )
+            raise
+        except httpx.TimeoutException:
+            logger.error("Streaming request to Ollama API timed out")
+            yield sse_event({"error": "Request to Ollama API timed out. Please try again later."}, event="error")
+        except httpx.ConnectError:
+            logger.error(f"Connection error to Ollama API at {settings.OLLAMA_API_URL}")
+            yield sse_event({"error": f"Could not connect to Ollama API at {settings.OLLAMA_API_URL}. Please check if the service is running."}, event="error")
+        except Exception as e:
+            logger.exception(f"Error streaming from Ollama: {str(e)}")
+            yield sse_event({"error": str(e)}, event="error")
+        finally:
+            timer.commit()
+
+    # The slot is released when the body ends, fails or is cancelled
+    response = event_stream_response(AsyncReleasingIterator(event_stream(), admission))
+    # Stage timings are recorded once the stream ends, not when the headers go out
+    response.commits_stage_timer = True
+    return response
+
+
+@csrf_exempt
+async def chatbot_batch_api_async(request):
+    """
+    Async version of views.chatbot_batch_api; results are sent as each prompt
+    completes instead of after the whole batch.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+    try:
+        if not request.session.session_key:
+            await request.session.asave()
+        data = json.loads(request.body)
+        items = parse_batch(data, SYSTEM_PROMPT, getattr(settings, "CHATBOT_BATCH_MAX_ITEMS", 500))
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError too
+        return JsonResponse({"error": str(e)}, status=400)
+    logger.info(f"Received an async batch of {len(items)} prompts")
+
+    user = await request.auser()
+    runner = BatchRunner(
+        items,
+        MODEL_NAME,
+        get_batch_concurrency(),
+        user=user if user.is_authenticated else None,
+        session_key=request.session.session_key,
+    )
+
+    async def lines():
+        async for result in runner.arun():
+            yield json.dumps(result) + "\n"
+
+    return event_stream_response(lines(), content_type='application/x-ndjson')
+
+
+@csrf_exempt
+async def test_ollama_connection_async(request):
+    """
+    Async version of the endpoint that tests the connection to the Ollama API
+    """
+    logger.info(f"Testing async connection to Ollama backends: {settings.OLLAMA_BACKENDS}")
+    try:
+        keeper = get_model_keeper()
+        backends = await sync_to_async(keeper.residency_report, thread_sensitive=False)(MODEL_NAME)
+        reachable = any(backend["reachable"] for backend in backends)
+        if not reachable:
+            logger.error(f"Failed to connect to any Ollama backend: {settings.OLLAMA_BACKENDS}")
+        return JsonResponse({
+            "status": "success" if reachable else "error",
+            "message": (
+                "Successfully connected to Ollama API" if reachable
+                else "Failed to connect to any Ollama backend"
+            ),
+            "api_url": settings.OLLAMA_API_URL,
+            "model": MODEL_NAME,
+            "resident": any(backend["resident"] for backend in backends),
+            "backends": backends,
+            "model_keeper": keeper.stats()
+        }, status=200 if reachable else 503)
+    except Exception as e:
+        logger.exception(f"Unexpected error testing Ollama connection: {str(e)}")
+        return JsonResponse({
+            "status": "error",
+            "message": f"Unexpected error: {str(e)}",
+            "api_url": settings.OLLAMA_API_URL
+        }, status=500)
@@ -0,0 +1,345 @@
+"""
+Batch chat: many prompts in one request.
+Internal tools that ask hundreds of questions send them as one array instead of
+one HTTP call each. The prompts are answered concurrently, never more at once than
+the admission controller lets through to Ollama, and each result is streamed back
+as an NDJSON line as soon as it is ready, in completion order. The ChatLogs of the
+whole batch are saved with a single bulk_create once the last prompt finishes.
+
+Each prompt gets its own deadline, from the moment it is picked up, which bounds
+its admission wait and its num_predict like an interactive request; a prompt that
+runs out of time returns the answer so far marked "truncated", which is not cached.
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import requests
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError
+
+from . import response_cache
+from .admission import Overloaded, get_admission_controller
+from .deadline import Deadline, collect_stream, get_request_deadline, with_budget
+from .metrics import get_metrics
+from .models import ChatLog
+from .ollama_client import get_ollama_client
+from .singleflight import FlightTimeout, coalesce
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Fields a prompt may set for itself, overriding the batch-level defaults
+ITEM_FIELDS = ("system", "options", "use_cache", "deadline")
+
+
+@dataclass
+class BatchItem:
+    index: int
+    message: str
+    system: str
+    # Ollama generation options (temperature, num_predict, ...)
+    options: Dict[str, Any] = field(default_factory=dict)
+    use_cache: bool = True
+    # Seconds the prompt may take once picked up (default: CHATBOT_REQUEST_DEADLINE)
+    deadline: Optional[float] = None
+    # Opaque client identifier echoed back with the result
+    id: Any = None
+
+    @property
+    def cacheable(self) -> bool:
+        # Answers generated with custom options are not interchangeable with the cached ones
+        return self.use_cache and not self.options
+
+
+def parse_batch(data: Dict[str, Any], system_prompt: str, max_items: int) -> List[BatchItem]:
+    """
+    Read the prompts of a batch request.
+
+    Each entry of data["prompts"] is a string or an object with "message" and
+    optionally "id", "system", "options", "use_cache" and "deadline"; the top-level
+    "system", "options", "use_cache" and "deadline" are the defaults for every entry.
+
+    Args:
+        data: The decoded request body
+        system_prompt: The system prompt used when neither level sets one
+        max_items: Most prompts accepted in one batch
+
+    Returns:
+        The parsed items, in request order
+
+    Raises:
+        ValueError: If the body is not a valid batch
+    """
+    prompts = data.get("prompts")
+    if not isinstance(prompts, list) or not prompts:
+        raise ValueError("'prompts' must be a non-empty list")
+    if len(prompts) > max_items:
+        raise ValueError(f"A batch may hold at most {max_items} prompts, got {len(prompts)}")
+
+    defaults = {
+        "system": data.get("system", system_prompt),
+        "options": data.get("options") or {},
+        "use_cache": data.get("use_cache", True),
+        "deadline": data.get("deadline"),
+    }
+    items = []
+    for index, entry in enumerate(prompts):
+        if isinstance(entry, str):
+            entry = {"message": entry}
+        if not isinstance(entry, dict):
+            raise ValueError(f"Prompt {index} must be a string or an object")
+        message = str(entry.get("message", "")).strip()
+        if not message:
+            raise ValueError(f"Prompt {index} has no message")
+        values = {name: entry.get(name, defaults[name]) for name in ITEM_FIELDS}
+        if not isinstance(values["options"], dict):
+            raise ValueError(f"Prompt {index} has options that are not an object")
+        items.append(BatchItem(index=index, message=message, id=entry.get("id", index), **values))
+    return items
+
+
+def get_batch_concurrency() -> int:
+    """
+    Return the prompts of one batch worked on at once: settings.CHATBOT_BATCH_CONCURRENCY,
+    or half the admission slots so a batch leaves the rest to interactive requests.
+    """
+    from django.conf import settings
+
+    return getattr(settings, "CHATBOT_BATCH_CONCURRENCY", 0) or max(1, get_admission_controller().max_concurrent // 2)
+
+
+class BatchRunner:
+    """
+    Answers the items of one batch on a small thread pool and yields their
+    results as they complete.
+    """
+
+    def __init__(
+        self,
+        items: List[BatchItem],
+        model_name: str,
+        concurrency: int,
+        user=None,
+        session_key: Optional[str] = None,
+    ):
+        """
+        Initialize the BatchRunner class.
+
+        Args:
+            items: The parsed prompts
+            model_name: The Ollama model answering them
+            concurrency: Prompts worked on at once; each still waits for an admission slot
+            user: The authenticated user the ChatLogs belong to, if any
+            session_key: The session the ChatLogs belong to
+        """
+        self.items = items
+        self.model_name = model_name
+        self.concurrency = max(1, min(concurrency, len(items)))
+        self.user = user
+        self.session_key = session_key
+        self.chat_logs: List[ChatLog] = []
+        self._lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.truncated = 0
+
+    def _generate(self, item: BatchItem, deadline: Deadline) -> Dict[str, Any]:
+        payload = {
+            "model": self.model_name,
+            "messages": [
+                {"role": "system", "content": item.system},
+                {"role": "user", "content": item.message},
+            ],
+        }
+        if item.options:
+            payload["options"] = item.options
+
+        queued_at = time.perf_counter()
+        admission = get_admission_controller()
+        with admission.slot(deadline.within(admission.queue_timeout)):
+            get_metrics().observe("batch", "queue", time.perf_counter() - queued_at)
+            # Read as a stream so the answer so far can be returned at the deadline
+            stream = get_ollama_client().chat_stream(with_budget(payload, deadline), timeout=deadline.within())
+            return collect_stream(stream, deadline, chat=True)
+
+    def answer(self, item: BatchItem) -> Dict[str, Any]:
+        """
+        Answer one item from the response cache or Ollama.
+
+        Returns:
+            The result line for the item; failures carry "error" and an HTTP-like "status"
+        """
+        started_at = time.perf_counter()
+        result: Dict[str, Any] = {"index": item.index, "id": item.id}
+        deadline = get_request_deadline({"deadline": item.deadline})
+        try:
+            content = None
+            if item.cacheable:
+                content = response_cache.get_cached_response(self.model_name, item.system, item.message)
+            if content is not None:
+                result.update(response=content, cache_hit=True)
+            else:
+                if item.cacheable:
+                    flight_key = response_cache.make_cache_key(self.model_name, item.system, item.message)
+                    # A follower waits no longer than this prompt's deadline
+                    generated, coalesced = coalesce(
+                        flight_key, lambda: self._generate(item, deadline), deadline.within(), reusable=deadline.can_reuse
+                    )
+                else:
+                    generated, coalesced = self._generate(item, deadline), False
+                content = generated.get("message", {}).get("content", "")
+                truncated = generated.get("truncated", False)
+                # A cut-short answer is not worth reusing
+                if item.cacheable and not coalesced and not truncated:
+                    response_cache.cache_response(self.model_name, item.system, item.message, content)
+                result.update(response=content, cache_hit=False, coalesced=coalesced, truncated=truncated)
+            self._record(item, content)
+        except Overloaded as e:
+            result.update(error=str(e), status=e.status, retry_after=e.retry_after)
+        except requests.exceptions.Timeout:
+            result.update(error="Request to Ollama API timed out", status=504)
+        except FlightTimeout:
+            result.update(error="Timed out waiting for the answer to an identical prompt", status=504)
+        except requests.exceptions.ConnectionError:
+            result.update(error="Could not connect to Ollama API", status=503)
+        except requests.exceptions.RequestException as e:
+            result.update(error=f"Request error: {str(e)}", status=502)
+        except Exception as e:
+            logger.exception(f"Unexpected error answering batch prompt {item.index}: {str(e)}")
+            result.update(error=str(e), status=500)
+
+        elapsed = time.perf_counter() - started_at
+        get_metrics().observe("batch", "item", elapsed)
+        result["elapsed_ms"] = round(elapsed * 1000, 1)
+        with self._lock:
+            if "error" in result:
+                self.failed += 1
+            else:
+                self.succeeded += 1
+                self.cache_hits += result["cache_hit"]
+                self.coalesced += result.get("coalesced", False)
+                self.truncated += result.get("truncated", False)
+        return result
+
+    def _record(self, item: BatchItem, content: str) -> None:
+        chat_log = ChatLog(
+            messages=[
+                {"role": "system", "content": item.system},
+                {"role": "user", "content": item.message},
+                {"role": "assistant", "content": content},
+            ],
+            model_name=self.model_name,
+            user=self.user,
+            session_key=self.session_key,
+        )
+        # bulk_create() does not call save()
+        chat_log.populate_from_messages()
+        with self._lock:
+            self.chat_logs.append(chat_log)
+
+    def save_chat_logs(self) -> int:
+        """Insert the ChatLogs of every answered item in one bulk_create."""
+        if not self.chat_logs:
+            return 0
+        started_at = time.perf_counter()
+        try:
+            ChatLog.objects.bulk_create(self.chat_logs)
+        except DatabaseError as e:
+            logger.exception(f"Could not save {len(self.chat_logs)} batch chat logs: {str(e)}")
+            return 0
+        get_metrics().observe("batch", "chatlog", time.perf_counter() - started_at)
+        return len(self.chat_logs)
+
+    def run(self) -> Iterator[Dict[str, Any]]:
+        """
+        Yield a result per item in completion order, then a summary line.
+
+        Items are submitted no faster than they are worked on, so a client that
+        disconnects (closing this generator) stops the rest of the batch; the
+        answers it already got are still saved.
+        """
+        started_at = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="chatbot-batch")
+        pending = iter(self.items)
+        running = set()
+        finished = False
+        try:
+            for item in pending:
+                running.add(executor.submit(self.answer, item))
+                if len(running) >= self.concurrency:
+                    break
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    item = next(pending, None)
+                    if item is not None:
+                        running.add(executor.submit(self.answer, item))
+            finished = True
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if not finished:
+                logger.info(f"Batch stopped after {self.succeeded + self.failed} of {len(self.items)} prompts")
+                self.save_chat_logs()
+
+        yield self.summary(self.save_chat_logs(), started_at)
+
+    async def arun(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Async counterpart of run(), for the ASGI endpoint. The items are still
+        answered on the worker threads; the event loop only waits for them. A
+        client that disconnects cancels this generator, which stops the rest of
+        the batch once the items already running have finished.
+        """
+        started_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="chatbot-batch")
+        pending = iter(self.items)
+        running = set()
+        finished = False
+        try:
+            for item in pending:
+                running.add(loop.run_in_executor(executor, self.answer, item))
+                if len(running) >= self.concurrency:
+                    break
+            while running:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    item = next(pending, None)
+                    if item is not None:
+                        running.add(loop.run_in_executor(executor, self.answer, item))
+            finished = True
+        finally:
+            await loop.run_in_executor(None, functools.partial(executor.shutdown, wait=True, cancel_futures=True))
+            if not finished:
+                logger.info(f"Batch stopped after {self.succeeded + self.failed} of {len(self.items)} prompts")
+                await sync_to_async(self.save_chat_logs)()
+
+        yield self.summary(await sync_to_async(self.save_chat_logs)(), started_at)
+
+    def summary(self, saved: int, started_at: float) -> Dict[str, Any]:
+        """The last line of a batch response."""
+        elapsed = time.perf_counter() - started_at
+        get_metrics().observe("batch", "total", elapsed)
+        return {
+            "done": True,
+            "count": len(self.items),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "truncated": self.truncated,
+            "chat_logs_saved": saved,
+            "concurrency": self.concurrency,
+            "elapsed_ms": round(elapsed * 1000, 1),
+        }
@@ -1,19 +1,273 @@
 """
 AWS Bedrock Embeddings module for RAG.
 This module provides functionality to convert text to embeddings using AWS Bedrock's Titan Text Embeddings V2.
+
+The bedrock-runtime client is shared by the whole process (get_bedrock_client), so
+credential resolution, endpoint loading and the TLS handshake happen once rather
+than for every BedrockEmbeddings instance. Its connection pool is sized with
+BEDROCK_MAX_POOL_CONNECTIONS; keep it at least CHATBOT_EMBEDDING_WORKERS so the
+background embedding threads never wait for a connection.
+
+embed_documents() embeds on a bounded thread pool (BEDROCK_EMBED_CONCURRENCY),
+paced by a process-wide token bucket (BEDROCK_EMBED_RATE requests per second)
+that halves its rate whenever Bedrock answers ThrottlingException and creeps back
+up as requests succeed.
+
+Both look their texts up in the embedding cache first (see embedding_cache.py) and
+only send the misses to Bedrock.
+
+A 1024-dimension embedding as a list of Python floats takes about 32 KB of objects.
+Callers that do not need a list ask for output="float32" (numpy arrays, 4 KB) or
+output="binary" (Titan's binary embedding packed 8 dimensions to a byte, 128 bytes),
+and for Titan V2's smaller 512 or 256 dimensions. A list holds Bedrock's floats
+exactly, except on a cache hit: the cache keeps embeddings as float32.
 """
 
-import os
 import json
-import boto3
 import logging
-from typing import List, Dict, Any, Optional, Union
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import boto3
+import numpy as np
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+try:
+    from .embedding_backends import (
+        OUTPUT_BINARY,
+        OUTPUT_FLOAT32,
+        OUTPUT_LIST,
+        OUTPUTS,
+        EmbeddingBackend,
+    )
+    from .embedding_cache import EmbeddingCache, get_embedding_cache, make_key
+except ImportError:
+    # Imported as a top-level module by test_bedrock_embeddings.py, run from this directory
+    from embedding_backends import (
+        OUTPUT_BINARY,
+        OUTPUT_FLOAT32,
+        OUTPUT_LIST,
+        OUTPUTS,
+        EmbeddingBackend,
+    )
+    from embedding_cache import EmbeddingCache, get_embedding_cache, make_key
 
 # Set up logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-class BedrockEmbeddings:
+_clients: Dict[Tuple[str, Optional[str], Optional[str]], Any] = {}
+_clients_lock = threading.Lock()
+
+_rate_limiter: Optional["TokenBucket"] = None
+_rate_limiter_lock = threading.Lock()
+
+# Embedding sizes Titan Text Embeddings V2 supports
+TITAN_V2_DIMENSIONS = (256, 512, 1024)
+
+# Error codes Bedrock answers when a request exceeds the account's quota
+THROTTLING_ERROR_CODES = ("ThrottlingException", "TooManyRequestsException")
+
+
+# Throttled attempts botocore retried by itself, counted per thread (see count_throttled_retry)
+_throttled_retries = threading.local()
+
+
+def is_throttling_error(error: Exception) -> bool:
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+def count_throttled_retry(response=None, **kwargs) -> None:
+    """
+    botocore needs-retry handler: count throttled attempts on the calling thread.
+    botocore retries throttling itself, so without this the rate limiter would only
+    hear about the requests that were throttled on every attempt.
+    """
+    if response is not None and response[1].get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+        _throttled_retries.count = getattr(_throttled_retries, "count", 0) + 1
+
+
+def pop_throttled_retries() -> int:
+    """Throttled attempts counted on this thread since the last call."""
+    count = getattr(_throttled_retries, "count", 0)
+    _throttled_retries.count = 0
+    return count
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket that adapts its rate: halved on throttling
+    (at most once per second, however many requests were throttled together),
+    and grown back by a twentieth of the configured rate per second of successes.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, min_rate: Optional[float] = None):
+        """
+        Initialize the TokenBucket class.
+
+        Args:
+            rate: Tokens added per second, and the most the rate grows back to
+            burst: Most tokens held at once (default: one second's worth)
+            min_rate: Lowest rate throttling backs off to (default: rate / 20)
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.min_rate = min_rate or rate / 20
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.decreased_at = 0.0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self) -> None:
+        """Block until a token is available, and take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.throttles += 1
+            if now - self.decreased_at >= 1.0:
+                self.decreased_at = now
+                self.rate = max(self.min_rate, self.rate / 2)
+                # Spend the burst too, so the threads already waiting slow down at once
+                self.tokens = min(self.tokens, 0.0)
+                logger.warning(f"Bedrock is throttling; embedding rate lowered to {self.rate:.1f}/s")
+
+    def succeeded(self) -> None:
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                # About rate successes arrive per second
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20 / self.rate)
+
+
+def check_output(dimensions: int, output: str) -> str:
+    """
+    Validate the embedding size and output mode of a request.
+
+    Returns:
+        The Titan embedding type to ask for: "float" or "binary"
+
+    Raises:
+        ValueError: If Titan V2 does not offer the size or the mode is unknown
+    """
+    if dimensions not in TITAN_V2_DIMENSIONS:
+        raise ValueError(f"Titan V2 embeddings have {TITAN_V2_DIMENSIONS} dimensions, not {dimensions}")
+    if output not in OUTPUTS:
+        raise ValueError(f"Unknown embedding output {output!r}; expected one of {OUTPUTS}")
+    return "binary" if output == OUTPUT_BINARY else "float"
+
+
+def get_rate_limiter() -> TokenBucket:
+    """
+    Return the process-wide token bucket pacing embed_documents(), so concurrent
+    bulk embeddings share the account's Bedrock quota rather than each using it all.
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = TokenBucket(float(os.getenv("BEDROCK_EMBED_RATE", "50")))
+    return _rate_limiter
+
+
+def get_client_config() -> Config:
+    """
+    The botocore configuration of the shared clients: a connection pool with TCP
+    keep-alive, bounded timeouts and standard retries. Read from the environment,
+    as this module is also used outside Django (bakerydemo/main.py).
+    """
+    return Config(
+        max_pool_connections=int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "16")),
+        tcp_keepalive=True,
+        connect_timeout=float(os.getenv("BEDROCK_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.getenv("BEDROCK_READ_TIMEOUT", "30")),
+        retries={"max_attempts": int(os.getenv("BEDROCK_MAX_ATTEMPTS", "3")), "mode": "standard"},
+    )
+
+
+def create_bedrock_client(
+    region_name: str,
+    credentials_profile: Optional[str] = None,
+    endpoint_url: Optional[str] = None,
+    **kwargs
+):
+    """
+    Create a new bedrock-runtime client with the shared client configuration.
+
+    Args:
+        region_name: AWS region name
+        credentials_profile: AWS credentials profile to use (optional)
+        endpoint_url: Bedrock runtime endpoint (optional)
+        **kwargs: Additional parameters to pass to the boto3 client; a "config" is
+            merged over the shared configuration
+
+    Returns:
+        The boto3 client
+    """
+    config = get_client_config()
+    if kwargs.get("config") is not None:
+        config = config.merge(kwargs.pop("config"))
+    if endpoint_url:
+        kwargs["endpoint_url"] = endpoint_url
+
+    session_kwargs = {}
+    if credentials_profile:
+        session_kwargs["profile_name"] = credentials_profile
+    session = boto3.Session(**session_kwargs)
+    client = session.client(service_name="bedrock-runtime", region_name=region_name, config=config, **kwargs)
+    client.meta.events.register("needs-retry.bedrock-runtime.InvokeModel", count_throttled_retry)
+    return client
+
+
+def get_bedrock_client(
+    region_name: str,
+    credentials_profile: Optional[str] = None,
+    endpoint_url: Optional[str] = None,
+    **kwargs
+):
+    """
+    Return the process-wide bedrock-runtime client for a region, profile and
+    endpoint, creating it on first use. boto3 clients are thread-safe, so the
+    embedding threads and request threads all share one connection pool.
+
+    Clients asked for with additional boto3 parameters are not shared.
+    """
+    if kwargs:
+        return create_bedrock_client(region_name, credentials_profile, endpoint_url, **kwargs)
+
+    key = (region_name, credentials_profile, endpoint_url)
+    client = _clients.get(key)
+    if client is None:
+        # boto3.Session() itself is not thread-safe, so create under the lock
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = create_bedrock_client(region_name, credentials_profile, endpoint_url)
+                logger.info(f"Created shared Bedrock runtime client for region={region_name}")
+    return client
+
+class BedrockEmbeddings(EmbeddingBackend):
     """
     A class to generate embeddings using AWS Bedrock's Titan Text Embeddings V2 model.
     """
@@ -23,6 +277,9 @@ class BedrockEmbeddings:
         model_id: str = "amazon.titan-embed-text-v2:0",
         region_name: Optional[str] = None,
         credentials_profile: Optional[str] = None,
+        endpoint_url: Optional[str] = None,
+        cache: Optional[EmbeddingCache] = None,
+        use_cache: bool = True,
         **kwargs
     ):
         """
@@ -32,59 +289,165 @@ class BedrockEmbeddings:
             model_id: The model ID to use for embeddings (default: amazon.titan-embed-text-v2)
             region_name: AWS region name (default: from environment variable AWS_REGION or ap-southeast-2)
             credentials_profile: AWS credentials profile to use (optional)
-            **kwargs: Additional parameters to pass to the boto3 client
+            endpoint_url: Bedrock runtime endpoint (default: from environment variable BEDROCK_ENDPOINT_URL,
+                else the AWS endpoint for the region); e.g. the load test's stub server
+            cache: Embedding cache to use (default: the process-wide one)
+            use_cache: Whether to cache embeddings at all
+            **kwargs: Additional parameters to pass to the boto3 client (the client is then not shared)
         """
         self.model_id = model_id
         self.region_name = region_name or os.getenv("AWS_REGION", "ap-southeast-2")
-        
-        # Initialize the Bedrock client
-        session_kwargs = {}
-        if credentials_profile:
-            session_kwargs["profile_name"] = credentials_profile
-        
-        session = boto3.Session(**session_kwargs)
-        self.bedrock_client = session.client(
-            service_name="bedrock-runtime",
-            region_name=self.region_name,
-            **kwargs
-        )
-        
-        logger.info(f"Initialized BedrockEmbeddings with model_id={model_id} in region={self.region_name}")
+        endpoint_url = endpoint_url or os.getenv("BEDROCK_ENDPOINT_URL")
+
+        # Reuse the process-wide Bedrock client
+        self.bedrock_client = get_bedrock_client(self.region_name, credentials_profile, endpoint_url, **kwargs)
+        self.cache = (cache or get_embedding_cache()) if use_cache else None
+
+        logger.debug(f"Initialized BedrockEmbeddings with model_id={model_id} in region={self.region_name}")
     
-    def embed_documents(self, texts: List[str], dimensions: int = 1024, normalize: bool = True) -> List[List[float]]:
+    def embed_documents(
+        self,
+        texts: List[str],
+        dimensions: int = 1024,
+        normalize: bool = True,
+        max_workers: Optional[int] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_retries: int = 6,
+        output: str = OUTPUT_LIST,
+    ) -> Union[List[List[float]], np.ndarray]:
         """
         Generate embeddings for a list of documents.
+        The documents are looked up in the embedding cache in bulk; the misses are
+        embedded concurrently, paced by the rate limiter, and a throttled document
+        is retried with exponential backoff.
         
         Args:
             texts: List of text documents to embed
             dimensions: Number of output dimensions (default: 1024)
             normalize: Whether to return the normalized embedding or not (default: True)
+            max_workers: Documents embedded at once (default: from environment variable
+                BEDROCK_EMBED_CONCURRENCY or 8)
+            rate_limiter: Token bucket pacing the requests (default: the process-wide one)
+            max_retries: Times a throttled document is retried before giving up
+            output: "list", "float32" or "binary" (see embed_query)
             
         Returns:
-            List of embeddings, one for each document
+            List of embeddings, one for each document, in the order of texts; for
+            "float32" and "binary" a matrix with one row per document
         """
-        return [self.embed_query(text, dimensions, normalize) for text in texts]
+        embedding_type = check_output(dimensions, output)
+        if not texts:
+            if output == OUTPUT_LIST:
+                return []
+            if output == OUTPUT_BINARY:
+                return np.empty((0, dimensions // 8), dtype=np.uint8)
+            return np.empty((0, dimensions), dtype=np.float32)
+        keys = [make_key(text, self.model_id, dimensions, normalize, embedding_type) for text in texts]
+        found = self.cache.get_many(keys) if self.cache is not None else {}
+        # Each distinct missing text is embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            logger.info(f"Embedding {len(missing)} of {len(texts)} documents ({len(found)} cached)")
+            embedded = dict(zip(missing, self._embed_concurrently(
+                list(missing.values()), dimensions, normalize, embedding_type, max_workers, rate_limiter, max_retries
+            )))
+            if self.cache is not None:
+                self.cache.set_many(embedded, self.model_id)
+            found.update(embedded)
+        if output == OUTPUT_LIST:
+            return [found[key].tolist() for key in keys]
+        matrix = np.stack([found[key] for key in keys])
+        return matrix.astype(np.float32, copy=False) if output == OUTPUT_FLOAT32 else matrix
+
+    def _embed_concurrently(
+        self,
+        texts: List[str],
+        dimensions: int,
+        normalize: bool,
+        embedding_type: str,
+        max_workers: Optional[int],
+        rate_limiter: Optional[TokenBucket],
+        max_retries: int,
+    ) -> List[np.ndarray]:
+        """Embed texts with Bedrock on a thread pool; see embed_documents()."""
+        max_workers = max_workers or int(os.getenv("BEDROCK_EMBED_CONCURRENCY", "8"))
+        rate_limiter = rate_limiter or get_rate_limiter()
+
+        def embed(text: str) -> np.ndarray:
+            for attempt in range(max_retries + 1):
+                rate_limiter.acquire()
+                pop_throttled_retries()
+                try:
+                    embedding = self._invoke_model(text, dimensions, normalize, embedding_type)
+                except ClientError as e:
+                    if not is_throttling_error(e) or attempt == max_retries:
+                        raise
+                    rate_limiter.throttled()
+                    # Full jitter, so the throttled threads do not retry in step
+                    time.sleep(random.uniform(0, min(10.0, 0.2 * 2 ** attempt)))
+                else:
+                    if pop_throttled_retries():
+                        rate_limiter.throttled()
+                    else:
+                        rate_limiter.succeeded()
+                    return embedding
+
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(texts)), thread_name_prefix="bedrock-embed")
+        try:
+            # map() yields in input order, whatever order the requests finish in
+            return list(executor.map(embed, texts))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
     
-    def embed_query(self, text: str, dimensions: int = 1024, normalize: bool = True) -> List[float]:
+    def embed_query(
+        self, text: str, dimensions: int = 1024, normalize: bool = True, output: str = OUTPUT_LIST
+    ) -> Union[List[float], np.ndarray]:
         """
-        Generate embeddings for a single query text.
+        Generate embeddings for a single query text, or return the cached ones.
         
         Args:
             text: The text to embed
-            dimensions: Number of output dimensions (default: 1024)
+            dimensions: Number of output dimensions: 1024 (default), 512 or 256
             normalize: Whether to return the normalized embedding or not (default: True)
+            output: "list" (default) for a list of floats, "float32" for a numpy
+                array, "binary" for Titan's binary embedding as a numpy uint8 array
+                of packed bits (np.unpackbits() restores one 0/1 per dimension)
             
         Returns:
-            The embedding vector as a list of floats
+            The embedding vector; arrays are read-only, as they may be shared with the cache
+        """
+        embedding_type = check_output(dimensions, output)
+        key = make_key(text, self.model_id, dimensions, normalize, embedding_type)
+        embedding = self.cache.get_many([key]).get(key) if self.cache is not None else None
+        if embedding is None:
+            embedding = self._invoke_model(text, dimensions, normalize, embedding_type)
+            if self.cache is not None:
+                self.cache.set_many({key: embedding}, self.model_id)
+            if output == OUTPUT_FLOAT32:
+                embedding = embedding.astype(np.float32)
+                embedding.setflags(write=False)
+        return embedding.tolist() if output == OUTPUT_LIST else embedding
+
+    def _invoke_model(self, text: str, dimensions: int, normalize: bool, embedding_type: str = "float") -> np.ndarray:
+        """
+        Generate embeddings for a text with one Bedrock InvokeModel call.
+        Float embeddings come back as float64, which holds Bedrock's floats exactly,
+        so "list" output is unchanged; the cache and "float32" output convert them.
         """
         try:
             # Prepare the request body for Titan Text Embeddings V2
             # According to AWS docs and examples, we need to include dimensions and normalize
-            request_body = json.dumps({
+            request = {
                 "inputText": text,
                 "dimensions": dimensions,
                 "normalize": normalize
-            })
+            }
+            if embedding_type != "float":
+                request["embeddingTypes"] = [embedding_type]
+            request_body = json.dumps(request)
             
             logger.info(f"Invoking model {self.model_id} in region {self.region_name}")
             
@@ -103,17 +466,22 @@ class BedrockEmbeddings:
             # Log response for debugging
             logger.info(f"Response received with keys: {list(response_body.keys())}")
             
+            # Embedding types asked for with embeddingTypes come back in 'embeddingsByType'
+            if embedding_type != "float" and embedding_type in response_body.get("embeddingsByType", {}):
+                bits = response_body["embeddingsByType"][embedding_type]
+                logger.info(f"Found {embedding_type} embedding with length: {len(bits)}")
+                return np.packbits(np.asarray(bits, dtype=np.uint8))
             # The embedding is in the 'embedding' field for Titan Text Embeddings V2
-            if "embedding" in response_body:
+            elif embedding_type == "float" and "embedding" in response_body:
                 # Standard format for Titan Text Embeddings V2
                 embedding = response_body.get("embedding")
                 logger.info(f"Found embedding with length: {len(embedding)}")
-                return embedding
-            elif "embeddings" in response_body:
+                return np.asarray(embedding, dtype=np.float64)
+            elif embedding_type == "float" and "embeddings" in response_body:
                 # Alternative format that might be used
                 embedding = response_body.get("embeddings")[0]
                 logger.info(f"Found embeddings array with length: {len(embedding)}")
-                return embedding
+                return np.asarray(embedding, dtype=np.float64)
             else:
                 # Log the full response for debugging
                 logger.error(f"Unexpected response format. Response keys: {list(response_body.keys())}")
@@ -123,6 +491,10 @@ class BedrockEmbeddings:
                 raise ValueError(f"Could not find embeddings in response. Keys: {list(response_body.keys())}")
             
         except Exception as e:
+            if is_throttling_error(e):
+                # Expected under load; embed_documents() backs off and retries
+                logger.warning(f"Bedrock throttled the embedding request: {str(e)}")
+                raise
             logger.error(f"Error generating embedding: {str(e)}")
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
@@ -0,0 +1,221 @@
+"""
+Write-behind persistence for ChatLog.
+Chat turns are queued in memory and inserted into AWS RDS in batches with
+bulk_create by a background thread, so users do not wait for an insert on every
+turn and RDS sees a few multi-row inserts instead of one insert per request.
+Batches are retried while the database is briefly unavailable, and the buffer is
+flushed when the process exits.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from django.db import (
+    DatabaseError,
+    InterfaceError,
+    OperationalError,
+    close_old_connections,
+    connection,
+)
+
+from .metrics import get_metrics
+from .models import ChatLog
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class ChatLogWriter:
+    """
+    Buffers unsaved ChatLog instances and flushes them with bulk_create when
+    batch_size logs are pending or flush_interval seconds have passed.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 50,
+        flush_interval: float = 1.0,
+        max_pending: int = 10000,
+        max_retries: int = 5,
+        retry_backoff: float = 0.5,
+    ):
+        """
+        Initialize the ChatLogWriter class.
+
+        Args:
+            batch_size: Pending logs that trigger a flush
+            flush_interval: Longest a log waits before being flushed (seconds)
+            max_pending: Buffer bound; callers save synchronously beyond it
+            max_retries: Attempts for a batch while the database is unavailable
+            retry_backoff: Initial delay between attempts, doubled each time (seconds)
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._pending: Deque[ChatLog] = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.dropped = 0
+
+    def start(self) -> "ChatLogWriter":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chatlog-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        return self
+
+    def enqueue(self, chat_log: ChatLog) -> bool:
+        """
+        Queue an unsaved ChatLog for the next batch.
+
+        Returns:
+            False if the buffer is full or the writer stopped; the caller should save it directly
+        """
+        chat_log.populate_from_messages()
+        with self._condition:
+            if self._stopping or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.append(chat_log)
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+        return True
+
+    def pending_for_session(self, session_key: str) -> List[ChatLog]:
+        """Return the queued, not yet inserted, logs of a session, oldest first."""
+        with self._condition:
+            return [chat_log for chat_log in self._pending if chat_log.session_key == session_key]
+
+    def _take_batch(self) -> List[ChatLog]:
+        # Called with the condition held
+        return [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._stopping and len(self._pending) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._stopping:
+                    return
+                batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[ChatLog]) -> bool:
+        delay = self.retry_backoff
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                close_old_connections()
+                started_at = time.perf_counter()
+                ChatLog.objects.bulk_create(batch)
+                get_metrics().observe("chatlog", "flush", time.perf_counter() - started_at)
+                self.written += len(batch)
+                self.batches += 1
+                return True
+            except (OperationalError, InterfaceError) as e:
+                # Connection-level errors: drop the broken connection and try again
+                logger.warning(f"ChatLog batch of {len(batch)} failed (attempt {attempt}/{self.max_retries}): {str(e)}")
+                connection.close()
+                if attempt == self.max_retries:
+                    break
+                self.retries += 1
+                time.sleep(delay)
+                delay *= 2
+            except DatabaseError as e:
+                logger.exception(f"ChatLog batch of {len(batch)} rejected by the database: {str(e)}")
+                break
+        self.dropped += len(batch)
+        logger.error(f"Dropped {len(batch)} chat logs after repeated database errors")
+        return False
+
+    def flush(self) -> None:
+        """Write everything queued so far from the calling thread."""
+        while True:
+            with self._condition:
+                batch = self._take_batch()
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self) -> None:
+        """Stop the background thread and flush what is left."""
+        with self._condition:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "written": self.written,
+            "batches": self.batches,
+            "retries": self.retries,
+            "dropped": self.dropped,
+        }
+
+
+_writer: Optional[ChatLogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_chat_log_writer() -> Optional[ChatLogWriter]:
+    """
+    Return the process-wide ChatLogWriter configured from Django settings,
+    or None when write-behind persistence is disabled.
+    """
+    global _writer
+    from django.conf import settings
+
+    if not getattr(settings, "CHATBOT_CHATLOG_WRITE_BEHIND", True):
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ChatLogWriter(
+                    batch_size=getattr(settings, "CHATBOT_CHATLOG_BATCH_SIZE", 50),
+                    flush_interval=getattr(settings, "CHATBOT_CHATLOG_FLUSH_INTERVAL", 1.0),
+                    max_pending=getattr(settings, "CHATBOT_CHATLOG_MAX_PENDING", 10000),
+                ).start()
+    return _writer
+
+
+def persist_chat_log(**fields) -> ChatLog:
+    """
+    Queue a ChatLog for a batched insert, or save it straight away when
+    write-behind is disabled or the buffer is full. A queued log has no id yet.
+    """
+    chat_log = ChatLog(**fields)
+    writer = get_chat_log_writer()
+    if writer is None or not writer.enqueue(chat_log):
+        chat_log.save()
+    return chat_log
+
+
+async def apersist_chat_log(**fields) -> ChatLog:
+    """Async counterpart of persist_chat_log()."""
+    chat_log = ChatLog(**fields)
+    writer = get_chat_log_writer()
+    if writer is None or not writer.enqueue(chat_log):
+        await chat_log.asave()
+    return chat_log
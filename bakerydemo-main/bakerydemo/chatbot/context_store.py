@@ -0,0 +1,144 @@
+"""
+Per-session store of Ollama KV contexts.
+/api/generate returns a "context" array: the token ids of everything the model has
+seen in the conversation so far. Sending it back with the next prompt lets Ollama
+continue from that state and evaluate only the new tokens, instead of processing
+the system prompt and every earlier turn again.
+
+Contexts are kept in process memory, bounded by session count and total tokens and
+evicted least recently used first. A context is only reused while it ends with the
+session's latest turn; anything else (another worker answered, a cached answer,
+an eviction) falls back to rebuilding the prompt from the history window.
+"""
+
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass
+class StoredContext:
+    model_name: str
+    # Token ids as 32-bit ints: 4 bytes each instead of a Python int object per token
+    tokens: array
+    # The turn the context ends with, to check it is still the latest one
+    last_turn: Tuple[str, str]
+    turns: int
+    updated_at: float
+
+
+class ContextStore:
+    """
+    A thread-safe LRU of KV contexts keyed by session.
+    """
+
+    def __init__(self, max_sessions: int = 1000, max_total_tokens: int = 2_000_000, ttl: float = 30 * 60):
+        """
+        Initialize the ContextStore class.
+
+        Args:
+            max_sessions: Most sessions with a stored context
+            max_total_tokens: Most token ids held across all sessions (4 bytes each)
+            ttl: Seconds an unused context is kept; Ollama's own cache is gone long before
+        """
+        self.max_sessions = max_sessions
+        self.max_total_tokens = max_total_tokens
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, StoredContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def _remove(self, session_key: str) -> None:
+        # Called with the lock held
+        entry = self._entries.pop(session_key, None)
+        if entry is not None:
+            self.total_tokens -= len(entry.tokens)
+
+    def get(self, session_key: Optional[str], model_name: str, last_turn: Optional[Tuple[str, str]]) -> Optional[StoredContext]:
+        """
+        Return the session's context if it continues from last_turn with the same model.
+
+        Args:
+            session_key: The Django session key
+            model_name: The model that will continue the context
+            last_turn: (user prompt, answer) of the session's latest turn
+        """
+        if not session_key or last_turn is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(session_key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if (
+                entry.model_name != model_name
+                or entry.last_turn != last_turn
+                or time.monotonic() - entry.updated_at > self.ttl
+            ):
+                self._remove(session_key)
+                self.stale += 1
+                return None
+            self._entries.move_to_end(session_key)
+            self.hits += 1
+            return entry
+
+    def put(self, session_key: Optional[str], model_name: str, tokens: List[int], last_turn: Tuple[str, str], turns: int) -> None:
+        """Store the context Ollama returned after a turn, evicting the least recently used."""
+        if not session_key or not tokens:
+            return
+        entry = StoredContext(model_name, array("i", tokens), last_turn, turns, time.monotonic())
+        with self._lock:
+            self._remove(session_key)
+            self._entries[session_key] = entry
+            self.total_tokens += len(entry.tokens)
+            while len(self._entries) > self.max_sessions or (self.total_tokens > self.max_total_tokens and len(self._entries) > 1):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def discard(self, session_key: Optional[str]) -> None:
+        with self._lock:
+            self._remove(session_key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._entries),
+                "tokens": self.total_tokens,
+                "bytes": self.total_tokens * 4,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+            }
+
+
+_store: Optional[ContextStore] = None
+_store_lock = threading.Lock()
+
+
+def get_context_store() -> Optional[ContextStore]:
+    """
+    Return the process-wide ContextStore, or None when CHATBOT_CONTEXT_REUSE is off.
+    """
+    global _store
+    from django.conf import settings
+
+    if not getattr(settings, "CHATBOT_CONTEXT_REUSE", False):
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ContextStore(
+                    max_sessions=getattr(settings, "CHATBOT_CONTEXT_MAX_SESSIONS", 1000),
+                    max_total_tokens=getattr(settings, "CHATBOT_CONTEXT_MAX_TOTAL_TOKENS", 2_000_000),
+                    ttl=getattr(settings, "CHATBOT_CONTEXT_TTL", 30 * 60),
+                )
+    return _store
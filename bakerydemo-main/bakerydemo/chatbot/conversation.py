@@ -0,0 +1,423 @@
+"""
+Multi-turn conversation history for the chatbot.
+Every chat turn is a ChatLog row, so the history of a session is read back from
+ChatLog (plus the turns still queued in the write-behind buffer) and sent to
+Ollama's /api/chat. Only the newest turns that fit in CHATBOT_HISTORY_TOKEN_BUDGET
+are sent, so prompt processing stays flat however long a conversation gets.
+Turns that fall out of the window can optionally be folded into a rolling summary,
+generated in the background and kept in the chatbot cache.
+
+With CHATBOT_CONTEXT_REUSE the conversation goes through /api/generate instead, so
+that Ollama returns its KV context; while the session's stored context is current,
+only the new prompt is sent with it (see context_store.py).
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import requests
+from django.db import close_old_connections
+
+from .chatlog_writer import get_chat_log_writer
+from .context_store import StoredContext, get_context_store
+from .models import ChatLog
+from .response_cache import CACHE_ERRORS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+SUMMARY_KEY_PREFIX = "chatbot:summary"
+SUMMARY_PROMPT = (
+    "Summarize the conversation below between a user and a bakery assistant in at most "
+    "five sentences. Keep names, preferences, orders and open questions; drop pleasantries."
+)
+# Ollama's chat template adds a few tokens around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the tokens in a text without the model's tokenizer.
+    About four characters per token holds for English with BPE vocabularies,
+    which is close enough for budgeting.
+    """
+    return len(text) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+@dataclass
+class Turn:
+    """One user prompt and the assistant's answer."""
+
+    user: str
+    assistant: str
+    # ChatLog.created_at, already set while the log is queued for a batched insert
+    created_at: Optional[Any] = None
+
+    def messages(self) -> List[Dict[str, str]]:
+        return [{"role": "user", "content": self.user}, {"role": "assistant", "content": self.assistant}]
+
+    def tokens(self) -> int:
+        return estimate_tokens(self.user) + estimate_tokens(self.assistant)
+
+
+@dataclass
+class Conversation:
+    """The next request to Ollama for a conversation and how the history was trimmed."""
+
+    messages: List[Dict[str, str]]
+    history_turns: int = 0
+    dropped_turns: List[Turn] = field(default_factory=list)
+    history_tokens: int = 0
+    summary: Optional[str] = None
+    # The session's latest turn, kept or not, which a stored context must end with
+    last_turn: Optional[Tuple[str, str]] = None
+    total_turns: int = 0
+    # Send through /api/generate so Ollama returns a KV context to continue from
+    use_context: bool = False
+    context: Optional[StoredContext] = None
+
+    @property
+    def has_history(self) -> bool:
+        return bool(self.total_turns or self.summary)
+
+    @property
+    def user_prompt(self) -> str:
+        return self.messages[-1]["content"]
+
+    def payload(self, model_name: str) -> Dict[str, Any]:
+        """
+        The Ollama request body: the new prompt and the stored context, the history
+        window rendered for /api/generate, or the messages for /api/chat.
+        """
+        if self.context is not None:
+            return {"model": model_name, "prompt": self.user_prompt, "context": self.context.tokens.tolist()}
+        if not self.use_context:
+            return {"model": model_name, "messages": self.messages}
+        system = "\n\n".join(message["content"] for message in self.messages if message["role"] == "system")
+        earlier = [
+            f"{'User' if message['role'] == 'user' else 'Assistant'}: {message['content']}"
+            for message in self.messages[:-1]
+            if message["role"] != "system"
+        ]
+        prompt = self.user_prompt
+        if earlier:
+            prompt = "Earlier in this conversation:\n" + "\n".join(earlier) + f"\n\nUser: {prompt}"
+        return {"model": model_name, "system": system, "prompt": prompt}
+
+    def answer(self, result: Dict[str, Any]) -> str:
+        """The answer text of a response, or the next piece of it from a stream chunk."""
+        if self.use_context:
+            return result.get("response", "")
+        return result.get("message", {}).get("content", "")
+
+    def remember(self, session_key: Optional[str], model_name: str, result: Dict[str, Any], answer: str) -> None:
+        """Store the KV context from the final response so the next turn can continue from it."""
+        store = get_context_store() if self.use_context else None
+        if store is None:
+            return
+        if "context" in result:
+            store.put(session_key, model_name, result["context"], (self.user_prompt, answer), self.total_turns + 1)
+        else:
+            store.discard(session_key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "history_turns": self.history_turns,
+            "dropped_turns": len(self.dropped_turns),
+            "history_tokens": self.history_tokens,
+            "summarized": self.summary is not None,
+            "context_reused": self.context is not None,
+            "context_tokens": len(self.context.tokens) if self.context is not None else 0,
+        }
+
+
+def attach_context(conversation: Conversation, session_key: Optional[str], model_name: str) -> Conversation:
+    """
+    Switch a conversation to /api/generate when context reuse is on, continuing from
+    the session's stored KV context if it is current and still fits CHATBOT_CONTEXT_MAX_TOKENS.
+    """
+    from django.conf import settings
+
+    store = get_context_store()
+    if store is None:
+        return conversation
+    conversation.use_context = True
+    context = store.get(session_key, model_name, conversation.last_turn)
+    if context is not None:
+        max_tokens = getattr(settings, "CHATBOT_CONTEXT_MAX_TOKENS", 2048)
+        if len(context.tokens) + estimate_tokens(conversation.user_prompt) <= max_tokens:
+            conversation.context = context
+        else:
+            # Start over from the trimmed history window rather than overflow the model's context
+            store.discard(session_key)
+    return conversation
+
+
+def get_history_settings() -> Tuple[int, int]:
+    """Return (token budget, most turns read back) from Django settings."""
+    from django.conf import settings
+
+    return (
+        getattr(settings, "CHATBOT_HISTORY_TOKEN_BUDGET", 1024),
+        getattr(settings, "CHATBOT_HISTORY_MAX_TURNS", 20),
+    )
+
+
+def _merge_pending(turns: List[Turn], session_key: str) -> List[Turn]:
+    # Turns still in the write-behind buffer are newer than anything in the database
+    writer = get_chat_log_writer()
+    if writer is None:
+        return turns
+    for chat_log in writer.pending_for_session(session_key):
+        if chat_log.cancelled:
+            continue
+        turn = Turn(chat_log.user_prompt, chat_log.ai_response, chat_log.created_at)
+        # A batch being inserted right now can show up in both places
+        if turns and (turns[-1].user, turns[-1].assistant) == (turn.user, turn.assistant):
+            continue
+        turns.append(turn)
+    return turns
+
+
+def _history_queryset(session_key: str, max_turns: int):
+    return (
+        # A turn the user walked away from is not part of the conversation
+        ChatLog.objects.filter(session_key=session_key, cancelled=False)
+        .exclude(ai_response="")
+        .order_by("-created_at")
+        .values_list("user_prompt", "ai_response", "created_at")[:max_turns]
+    )
+
+
+def load_history(session_key: Optional[str], max_turns: int) -> List[Turn]:
+    """
+    Read back the newest turns of a session, oldest first.
+
+    Args:
+        session_key: The Django session key the ChatLog rows were saved with
+        max_turns: Most turns to read; older ones could not fit the budget anyway
+    """
+    if not session_key or max_turns <= 0:
+        return []
+    turns = [Turn(*row) for row in reversed(list(_history_queryset(session_key, max_turns)))]
+    return _merge_pending(turns, session_key)[-max_turns:]
+
+
+async def aload_history(session_key: Optional[str], max_turns: int) -> List[Turn]:
+    """Async counterpart of load_history()."""
+    if not session_key or max_turns <= 0:
+        return []
+    rows = [row async for row in _history_queryset(session_key, max_turns)]
+    turns = [Turn(*row) for row in reversed(rows)]
+    return _merge_pending(turns, session_key)[-max_turns:]
+
+
+def build_conversation(
+    system_prompt: str,
+    history: List[Turn],
+    user_prompt: str,
+    token_budget: int,
+    summary: Optional[str] = None,
+) -> Conversation:
+    """
+    Fit the newest turns of the history into the token budget.
+    Turns are dropped oldest first; the system prompt and the new prompt are always sent.
+
+    Args:
+        system_prompt: The assistant's system prompt
+        history: Earlier turns, oldest first
+        user_prompt: The new user prompt
+        token_budget: Estimated tokens allowed for the history and summary
+        summary: Rolling summary of turns older than the history, if any
+    """
+    used = 0
+    summary_message = None
+    if summary:
+        summary_message = {"role": "system", "content": f"Summary of the earlier conversation: {summary}"}
+        used = estimate_tokens(summary_message["content"])
+
+    kept: List[Turn] = []
+    for index in range(len(history) - 1, -1, -1):
+        tokens = history[index].tokens()
+        if used + tokens > token_budget:
+            break
+        used += tokens
+        kept.append(history[index])
+    kept.reverse()
+    dropped = history[: len(history) - len(kept)]
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary_message is not None:
+        messages.append(summary_message)
+    for turn in kept:
+        messages.extend(turn.messages())
+    messages.append({"role": "user", "content": user_prompt})
+    return Conversation(
+        messages,
+        history_turns=len(kept),
+        dropped_turns=dropped,
+        history_tokens=used,
+        summary=summary,
+        last_turn=(history[-1].user, history[-1].assistant) if history else None,
+        total_turns=len(history),
+    )
+
+
+class RollingSummarizer:
+    """
+    Folds turns that no longer fit the history window into a per-session summary.
+    Summaries are written by a single background worker so they never add to a
+    request, and the next turn of the session picks them up from the cache.
+    """
+
+    def __init__(self, model_name: str, ttl: int = 60 * 60 * 24, max_tokens: int = 200):
+        """
+        Initialize the RollingSummarizer class.
+
+        Args:
+            model_name: Ollama model that writes the summaries
+            ttl: Seconds a summary is kept after its last update
+            max_tokens: Longest summary Ollama may generate (num_predict)
+        """
+        self.model_name = model_name
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-summary")
+        self._lock = threading.Lock()
+        self._in_progress: Set[str] = set()
+        self.summaries = 0
+        self.failures = 0
+
+    def _cache(self):
+        from .response_cache import get_cache
+
+        return get_cache()
+
+    def _key(self, session_key: str) -> str:
+        return f"{SUMMARY_KEY_PREFIX}:{session_key}"
+
+    def get(self, session_key: Optional[str]) -> Dict[str, Any]:
+        """Return {"summary", "through"} for a session; through is the created_at of the last summarized turn."""
+        if not session_key:
+            return {}
+        return self._cache().get(self._key(session_key)) or {}
+
+    async def aget(self, session_key: Optional[str]) -> Dict[str, Any]:
+        """Async counterpart of get()."""
+        if not session_key:
+            return {}
+        return await self._cache().aget(self._key(session_key)) or {}
+
+    def unsummarized(self, state: Dict[str, Any], dropped: List[Turn]) -> List[Turn]:
+        """The dropped turns the session's summary does not cover yet."""
+        through = state.get("through")
+        # A turn without a timestamp cannot be placed against the summary
+        return [turn for turn in dropped if turn.created_at is not None and (through is None or turn.created_at > through)]
+
+    def schedule(self, session_key: Optional[str], state: Dict[str, Any], dropped: List[Turn]) -> bool:
+        """
+        Fold newly dropped turns into the session's summary in the background.
+
+        Returns:
+            Whether a summary update was started
+        """
+        turns = self.unsummarized(state, dropped)
+        if not session_key or not turns:
+            return False
+        with self._lock:
+            if session_key in self._in_progress:
+                return False
+            self._in_progress.add(session_key)
+        self._executor.submit(self._summarize, session_key, state.get("summary"), turns)
+        return True
+
+    def _summarize(self, session_key: str, summary: Optional[str], turns: List[Turn]) -> None:
+        from .admission import Overloaded, get_admission_controller
+        from .ollama_client import get_ollama_client
+
+        try:
+            transcript = "\n".join(f"User: {turn.user}\nAssistant: {turn.assistant}" for turn in turns)
+            if summary:
+                transcript = f"Earlier summary: {summary}\n{transcript}"
+            # Summaries share the model slots with chat requests, but never wait for one
+            with get_admission_controller().slot(timeout=0):
+                result = get_ollama_client().chat({
+                    "model": self.model_name,
+                    "messages": [
+                        {"role": "system", "content": SUMMARY_PROMPT},
+                        {"role": "user", "content": transcript},
+                    ],
+                    "options": {"num_predict": self.max_tokens},
+                })
+            content = result.get("message", {}).get("content", "").strip()
+            if content:
+                close_old_connections()
+                self._cache().set(self._key(session_key), {"summary": content, "through": turns[-1].created_at}, self.ttl)
+                self.summaries += 1
+        except Overloaded:
+            logger.info(f"Skipped summarizing session {session_key[:8]}: Ollama is busy")
+        except (requests.exceptions.RequestException, ValueError, *CACHE_ERRORS) as e:
+            # Ollama unreachable or failing, a bad JSON body, or the cache being down
+            self.failures += 1
+            logger.warning(f"Could not summarize session {session_key[:8]}: {str(e)}")
+        finally:
+            with self._lock:
+                self._in_progress.discard(session_key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_progress = len(self._in_progress)
+        return {"summaries": self.summaries, "failures": self.failures, "in_progress": in_progress}
+
+
+_summarizer: Optional[RollingSummarizer] = None
+_summarizer_lock = threading.Lock()
+
+
+def get_summarizer(model_name: str) -> Optional[RollingSummarizer]:
+    """
+    Return the process-wide RollingSummarizer, or None when CHATBOT_HISTORY_SUMMARY is off.
+    """
+    global _summarizer
+    from django.conf import settings
+
+    if not getattr(settings, "CHATBOT_HISTORY_SUMMARY", False):
+        return None
+    if _summarizer is None:
+        with _summarizer_lock:
+            if _summarizer is None:
+                _summarizer = RollingSummarizer(
+                    model_name,
+                    ttl=getattr(settings, "CHATBOT_HISTORY_SUMMARY_TTL", 60 * 60 * 24),
+                )
+    return _summarizer
+
+
+def prepare_conversation(session_key: Optional[str], system_prompt: str, user_prompt: str, model_name: str, use_history: bool = True) -> Conversation:
+    """
+    Build the /api/chat messages for a new prompt from the session's history,
+    scheduling a summary update for turns that no longer fit.
+    """
+    token_budget, max_turns = get_history_settings()
+    history = load_history(session_key, max_turns) if use_history else []
+    summarizer = get_summarizer(model_name) if history else None
+    state = summarizer.get(session_key) if summarizer else {}
+    conversation = build_conversation(system_prompt, history, user_prompt, token_budget, state.get("summary"))
+    if summarizer and conversation.dropped_turns:
+        summarizer.schedule(session_key, state, conversation.dropped_turns)
+    return attach_context(conversation, session_key, model_name)
+
+
+async def aprepare_conversation(session_key: Optional[str], system_prompt: str, user_prompt: str, model_name: str, use_history: bool = True) -> Conversation:
+    """Async counterpart of prepare_conversation()."""
+    token_budget, max_turns = get_history_settings()
+    history = await aload_history(session_key, max_turns) if use_history else []
+    summarizer = get_summarizer(model_name) if history else None
+    state = await summarizer.aget(session_key) if summarizer else {}
+    conversation = build_conversation(system_prompt, history, user_prompt, token_budget, state.get("summary"))
+    if summarizer and conversation.dropped_turns:
+        summarizer.schedule(session_key, state, conversation.dropped_turns)
+    return attach_context(conversation, session_key, model_name)
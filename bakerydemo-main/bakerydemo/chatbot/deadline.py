@@ -0,0 +1,208 @@
+"""
+Per-request deadlines and generation budgets.
+Every chat request gets a deadline when it arrives (CHATBOT_REQUEST_DEADLINE, or
+less if the client asks for it). The embedding wait, the admission queue and the
+Ollama call only get what is left of it, and num_predict is set so the answer can
+be generated in the remaining time at the backends' measured token rate, instead
+of letting a rambling answer run for minutes.
+
+Generations are read as a stream, so when the deadline arrives anyway the tokens
+produced so far are returned as a partial answer marked "truncated" rather than
+a 504.
+"""
+
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import httpx
+import requests
+
+from .conversation import estimate_tokens
+from .ollama_client import get_backend_pool
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """
+    A point in time by which a request must be answered.
+    """
+
+    def __init__(self, seconds: float, reserve: float = 0.5):
+        """
+        Initialize the Deadline class.
+
+        Args:
+            seconds: Time the request may take from now
+            reserve: Seconds kept back at the end for saving and sending the answer
+        """
+        self.seconds = seconds
+        self.reserve = reserve
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Seconds left for work, not counting the reserve."""
+        return max(0.0, self.expires_at - self.reserve - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def within(self, timeout: Optional[float] = None) -> float:
+        """
+        A timeout shortened to what is left of the deadline; never quite 0, so it
+        can be passed on as a socket timeout.
+        """
+        remaining = max(self.remaining(), 0.01)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def can_reuse(self, result: Dict[str, Any]) -> bool:
+        """
+        Whether this request should take the answer of a request it coalesced onto:
+        a partial answer cut short by the other request's deadline only once there is
+        no time left to generate a complete one.
+        """
+        return is_complete(result) or self.expired()
+
+    def __repr__(self):
+        return f"Deadline({self.seconds}s, {self.remaining():.2f}s left)"
+
+
+def get_request_deadline(data: Dict[str, Any]) -> Deadline:
+    """
+    The deadline of a chat request: "deadline" (seconds) from the request body,
+    bounded by CHATBOT_MAX_REQUEST_DEADLINE, or CHATBOT_REQUEST_DEADLINE.
+    """
+    from django.conf import settings
+
+    default = getattr(settings, "CHATBOT_REQUEST_DEADLINE", 60)
+    maximum = getattr(settings, "CHATBOT_MAX_REQUEST_DEADLINE", 120)
+    try:
+        seconds = float(data.get("deadline") or default)
+    except (TypeError, ValueError):
+        seconds = default
+    return Deadline(min(max(seconds, 1.0), maximum), reserve=getattr(settings, "CHATBOT_DEADLINE_RESERVE", 0.5))
+
+
+def payload_tokens(payload: Dict[str, Any]) -> Tuple[int, int]:
+    """
+    Estimate the tokens of an Ollama payload.
+
+    Returns:
+        (tokens Ollama still has to evaluate, tokens of a continued KV context)
+    """
+    text = [payload.get("system") or "", payload.get("prompt") or ""]
+    text.extend(message.get("content", "") for message in payload.get("messages", []))
+    return sum(estimate_tokens(part) for part in text if part), len(payload.get("context") or [])
+
+
+def generation_budget(deadline: Deadline, payload: Dict[str, Any]) -> int:
+    """
+    The num_predict that lets a generation finish before the deadline: the time left
+    after evaluating the prompt, times the slowest backend's generation rate.
+    """
+    from django.conf import settings
+
+    eval_rate, prompt_rate = get_backend_pool().token_rates()
+    eval_rate = eval_rate or getattr(settings, "CHATBOT_DEFAULT_EVAL_RATE", 20.0)
+    prompt_rate = prompt_rate or getattr(settings, "CHATBOT_DEFAULT_PROMPT_RATE", 200.0)
+    new_tokens, context_tokens = payload_tokens(payload)
+
+    num_predict = int((deadline.remaining() - new_tokens / prompt_rate) * eval_rate)
+    num_predict = min(num_predict, getattr(settings, "CHATBOT_MAX_PREDICT", 1024))
+    num_ctx = getattr(settings, "OLLAMA_NUM_CTX", 0)
+    if num_ctx:
+        # The answer has to fit in the context window next to the prompt
+        num_predict = min(num_predict, num_ctx - new_tokens - context_tokens)
+    requested = (payload.get("options") or {}).get("num_predict")
+    if requested is not None and requested >= 0:
+        num_predict = min(num_predict, requested)
+    return max(num_predict, getattr(settings, "CHATBOT_MIN_PREDICT", 32))
+
+
+def with_budget(payload: Dict[str, Any], deadline: Deadline) -> Dict[str, Any]:
+    """A copy of an Ollama payload with num_predict set from the deadline."""
+    options = dict(payload.get("options") or {}, num_predict=generation_budget(deadline, payload))
+    return dict(payload, options=options)
+
+
+def _result(final: Dict[str, Any], content: str, chat: bool, truncated: bool) -> Dict[str, Any]:
+    """Shape a collected stream like the non-streaming response of the same endpoint."""
+    result = dict(final)
+    if chat:
+        result["message"] = {"role": "assistant", "content": content}
+    else:
+        result["response"] = content
+    # done_reason "length" means num_predict cut the answer short
+    result["truncated"] = truncated or final.get("done_reason") == "length"
+    return result
+
+
+def is_complete(result: Dict[str, Any]) -> bool:
+    """Whether a generation ran to its end rather than being cut short by a deadline or num_predict."""
+    return not result.get("truncated", False) and result.get("done_reason") != "length"
+
+
+def _piece(chunk: Dict[str, Any], chat: bool) -> str:
+    return chunk.get("message", {}).get("content", "") if chat else chunk.get("response", "")
+
+
+def collect_stream(
+    stream: Iterator[Dict[str, Any]], deadline: Deadline, chat: bool, pieces: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Read an Ollama stream into one response, stopping at the deadline.
+
+    Args:
+        stream: The chunks of generate_stream() or chat_stream()
+        deadline: The request deadline
+        chat: Whether the stream comes from /api/chat
+        pieces: List the answer is collected in, for callers that need the partial
+            answer if they are interrupted
+
+    Returns:
+        The response, with "truncated" set if the answer was cut short. A partial
+        answer has no final statistics and no KV context.
+    """
+    pieces = [] if pieces is None else pieces
+    try:
+        for chunk in stream:
+            pieces.append(_piece(chunk, chat))
+            if chunk.get("done"):
+                return _result(chunk, "".join(pieces), chat, truncated=False)
+            if deadline.expired():
+                break
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        # A read that timed out at the deadline; with nothing generated it is a real timeout
+        if not any(pieces) or not deadline.expired():
+            raise
+    finally:
+        # Closing the stream closes the connection, which stops the generation
+        stream.close()
+    logger.warning(f"Deadline reached after {len(pieces)} chunks; returning a partial answer")
+    return _result({"done": False, "done_reason": "deadline"}, "".join(pieces), chat, truncated=True)
+
+
+async def acollect_stream(
+    stream: AsyncIterator[Dict[str, Any]], deadline: Deadline, chat: bool, pieces: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Async counterpart of collect_stream(). When the task is cancelled, closing the
+    stream on the way out aborts the upstream request.
+    """
+    pieces = [] if pieces is None else pieces
+    try:
+        async for chunk in stream:
+            pieces.append(_piece(chunk, chat))
+            if chunk.get("done"):
+                return _result(chunk, "".join(pieces), chat, truncated=False)
+            if deadline.expired():
+                break
+    except httpx.TimeoutException:
+        if not any(pieces) or not deadline.expired():
+            raise
+    finally:
+        await stream.aclose()
+    logger.warning(f"Deadline reached after {len(pieces)} chunks; returning a partial answer")
+    return _result({"done": False, "done_reason": "deadline"}, "".join(pieces), chat, truncated=True)
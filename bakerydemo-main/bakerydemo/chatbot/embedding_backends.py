@@ -0,0 +1,242 @@
+"""
+Embedding backends behind one interface.
+Every backend has a model_id and embed_query() / embed_documents() methods taking
+the same dimensions, normalize and output arguments as BedrockEmbeddings, so the
+chatbot and bakerydemo/main.py pick one by name instead of hard-wiring a class:
+
+- "bedrock": AWS Bedrock Titan Text Embeddings V2 (BedrockEmbeddings), the default
+- "ollama": an Ollama embedding model through the pooled OllamaClient
+- "hashing": HashingEmbeddings, feature hashing of words and character trigrams on
+  the CPU. No network and tens of microseconds per text, but the similarity is
+  lexical rather than semantic; for latency-sensitive paths, offline runs and tests.
+
+The chatbot uses CHATBOT_EMBEDDING_BACKEND; other backends can be added with
+register_backend().
+"""
+
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+import numpy as np
+import requests
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Output modes of embed_query() and embed_documents()
+OUTPUT_LIST = "list"
+OUTPUT_FLOAT32 = "float32"
+OUTPUT_BINARY = "binary"
+OUTPUTS = (OUTPUT_LIST, OUTPUT_FLOAT32, OUTPUT_BINARY)
+
+DEFAULT_BACKEND = "bedrock"
+
+# Errors of a backend that could not embed the texts: a failed request, or a
+# response without the expected embeddings
+EMBEDDING_ERRORS: Tuple[Type[Exception], ...] = (requests.exceptions.RequestException, OSError, ValueError, KeyError)
+try:
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    EMBEDDING_ERRORS += (BotoCoreError, ClientError)
+except ImportError:
+    pass
+
+
+class EmbeddingBackend:
+    """
+    Base class of the embedding backends that produce float vectors and derive
+    the output modes from them.
+    """
+
+    model_id = ""
+
+    def _embed(self, texts: List[str], dimensions: int, normalize: bool) -> np.ndarray:
+        """Embed texts as a float32 matrix with one row per text."""
+        raise NotImplementedError
+
+    def _check(self, dimensions: int, output: str) -> None:
+        if dimensions <= 0 or (output == OUTPUT_BINARY and dimensions % 8):
+            raise ValueError(f"Cannot produce {output} embeddings of {dimensions} dimensions")
+        if output not in OUTPUTS:
+            raise ValueError(f"Unknown embedding output {output!r}; expected one of {OUTPUTS}")
+
+    @staticmethod
+    def _finish(matrix: np.ndarray, output: str) -> Union[List[List[float]], np.ndarray]:
+        if output == OUTPUT_BINARY:
+            # Like Titan's binary embeddings: one bit per dimension, set when positive
+            return np.packbits(matrix > 0, axis=1)
+        return matrix.tolist() if output == OUTPUT_LIST else matrix
+
+    def embed_documents(
+        self, texts: List[str], dimensions: int = 1024, normalize: bool = True, output: str = OUTPUT_LIST, **kwargs
+    ) -> Union[List[List[float]], np.ndarray]:
+        """
+        Generate embeddings for a list of documents.
+
+        Args:
+            texts: List of text documents to embed
+            dimensions: Number of output dimensions (default: 1024)
+            normalize: Whether to return unit vectors (default: True)
+            output: "list", "float32" or "binary", as for BedrockEmbeddings
+            **kwargs: Options of other backends, ignored
+
+        Returns:
+            List of embeddings in the order of texts; for "float32" and "binary" a
+            matrix with one row per document
+        """
+        self._check(dimensions, output)
+        return self._finish(self._embed(list(texts), dimensions, normalize), output)
+
+    def embed_query(
+        self, text: str, dimensions: int = 1024, normalize: bool = True, output: str = OUTPUT_LIST
+    ) -> Union[List[float], np.ndarray]:
+        """Generate embeddings for a single query text; see embed_documents()."""
+        return self.embed_documents([text], dimensions, normalize, output)[0]
+
+
+class HashingEmbeddings(EmbeddingBackend):
+    """
+    Local embeddings by the hashing trick: every word, word bigram and character
+    trigram is hashed to a dimension and a sign, weighted by 1 + log(count).
+    Deterministic across processes, so vectors can be stored and compared later.
+    """
+
+    model_id = "local-hashing-v1"
+    token_pattern = re.compile(r"\w+")
+
+    def features(self, text: str) -> Counter:
+        words = self.token_pattern.findall(text.lower())
+        features = Counter(words)
+        features.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+        for word in words:
+            # Trigrams match "bake" with "baker" and "baking", and survive typos
+            padded = f"<{word}>"
+            features.update(f"#{padded[n:n + 3]}" for n in range(len(padded) - 2))
+        return features
+
+    def _embed(self, texts: List[str], dimensions: int, normalize: bool) -> np.ndarray:
+        matrix = np.zeros((len(texts), dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self.features(text).items():
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                sign = 1.0 if digest >> 63 else -1.0
+                matrix[row, digest % dimensions] += sign * (1.0 + math.log(count))
+        if normalize:
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+class OllamaEmbeddings(EmbeddingBackend):
+    """
+    Embeddings from an Ollama embedding model (POST /api/embed). Vectors longer
+    than the dimensions asked for are truncated and renormalized, which suits
+    Matryoshka-trained models such as nomic-embed-text.
+    """
+
+    def __init__(self, model: Optional[str] = None, base_url: Optional[str] = None, client=None):
+        """
+        Initialize the OllamaEmbeddings class.
+
+        Args:
+            model: The Ollama model (default: from environment variable OLLAMA_EMBEDDING_MODEL
+                or tinyllama:latest)
+            base_url: Ollama server to use instead of the chatbot's shared client,
+                e.g. outside Django
+            client: OllamaClient to use (default: the chatbot's shared client)
+        """
+        self.model_id = model or os.getenv("OLLAMA_EMBEDDING_MODEL", "tinyllama:latest")
+        if client is None and base_url:
+            from .ollama_client import OllamaClient
+
+            client = OllamaClient(base_url)
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from .ollama_client import get_ollama_client
+
+            self._client = get_ollama_client()
+        return self._client
+
+    def _embed(self, texts: List[str], dimensions: int, normalize: bool) -> np.ndarray:
+        if not texts:
+            return np.empty((0, dimensions), dtype=np.float32)
+        result = self.client.post("/api/embed", {"model": self.model_id, "input": texts})
+        matrix = np.asarray(result["embeddings"], dtype=np.float32)
+        if matrix.shape[1] < dimensions:
+            raise ValueError(f"{self.model_id} embeddings have {matrix.shape[1]} dimensions, not {dimensions}")
+        matrix = np.ascontiguousarray(matrix[:, :dimensions])
+        if normalize:
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+def _create_bedrock(**kwargs):
+    from .bedrock_embeddings import BedrockEmbeddings
+
+    return BedrockEmbeddings(**kwargs)
+
+
+_factories: Dict[str, Callable[..., Any]] = {
+    "bedrock": _create_bedrock,
+    "ollama": OllamaEmbeddings,
+    "hashing": HashingEmbeddings,
+}
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def register_backend(name: str, factory: Callable[..., Any]) -> None:
+    """Make an embedding backend available by name; factory(**kwargs) builds it."""
+    _factories[name] = factory
+
+
+def get_backend_names() -> Sequence[str]:
+    return sorted(_factories)
+
+
+def create_embedding_backend(name: str, **kwargs):
+    """
+    Build an embedding backend by name.
+
+    Args:
+        name: A registered backend: "bedrock", "ollama", "hashing", ...
+        **kwargs: Passed on to the backend's constructor
+
+    Raises:
+        ValueError: If no backend is registered under the name
+    """
+    factory = _factories.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown embedding backend {name!r}; expected one of {get_backend_names()}")
+    return factory(**kwargs)
+
+
+def get_backend_name() -> str:
+    """The chatbot's embedding backend, settings.CHATBOT_EMBEDDING_BACKEND."""
+    from django.conf import settings
+
+    return getattr(settings, "CHATBOT_EMBEDDING_BACKEND", DEFAULT_BACKEND)
+
+
+def get_embedding_backend():
+    """
+    Return the chatbot's process-wide embedding backend, creating it from Django
+    settings on first use.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_embedding_backend(get_backend_name())
+                logger.info(f"Using the {get_backend_name()} embedding backend ({_backend.model_id})")
+    return _backend
@@ -0,0 +1,294 @@
+"""
+Content-addressed cache of Titan embeddings.
+The same page text and the same common prompts are embedded over and over, each
+time paying a Bedrock round-trip. Vectors are cached under a hash of the model,
+dimensions, normalization, embedding type and text, in two tiers:
+
+- an in-memory LRU of read-only numpy arrays (float32, or packed bits for binary
+  embeddings), per process
+- a persistent tier for float32 embeddings, either the PromptEmbedding table
+  (DatabaseTier, the same rows embedding_store writes, so every prompt
+  embedding it stored in float32 is a hit) or a local SQLite file (FileTier) for scripts running
+  outside Django
+
+BedrockEmbeddings looks up all the texts it is given at once and only embeds the
+misses. Errors of the persistent tier are logged and treated as misses.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Sequence
+
+import numpy as np
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Rows looked up per query, below SQLite's limit on query parameters
+LOOKUP_CHUNK_SIZE = 500
+
+# Errors of a persistent tier that are logged and treated as misses
+PERSISTENT_TIER_ERRORS = (sqlite3.Error, OSError, ValueError)
+try:
+    from django.db import DatabaseError
+except ImportError:
+    pass
+else:
+    PERSISTENT_TIER_ERRORS += (DatabaseError,)
+
+
+def make_key(
+    text: str, model_id: str, dimensions: int = 1024, normalize: bool = True, embedding_type: str = "float"
+) -> str:
+    """
+    Content hash identifying the embedding of a text.
+    Normalized float embeddings hash like embedding_store.make_key() always has, so
+    the existing PromptEmbedding rows stay valid.
+    """
+    parts = [model_id, dimensions, text]
+    if not normalize:
+        parts.append(False)
+    if embedding_type != "float":
+        parts.append(embedding_type)
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def _chunks(keys: Sequence[str]) -> Iterable[Sequence[str]]:
+    for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+        yield keys[start:start + LOOKUP_CHUNK_SIZE]
+
+
+class FileTier:
+    """
+    Persistent tier in a local SQLite file holding float32 blobs.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the FileTier class.
+
+        Args:
+            path: The SQLite file, created if missing
+        """
+        self.path = path
+        # sqlite3 connections may only be used by the thread that opened them
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dimensions INTEGER, vector BLOB)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=30)
+        return connection
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        connection = self._connection()
+        for chunk in _chunks(keys):
+            placeholders = ",".join("?" * len(chunk))
+            rows = connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def set_many(self, vectors: Dict[str, np.ndarray], model_id: str) -> None:
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, dimensions, vector) VALUES (?, ?, ?)",
+                [(key, len(vector), vector.tobytes()) for key, vector in vectors.items()],
+            )
+
+    def __repr__(self):
+        return f"FileTier({self.path})"
+
+
+class DatabaseTier:
+    """
+    Persistent tier in the PromptEmbedding table, through the Django ORM.
+    Vectors are written and served in float32 only: rows embedding_store quantized
+    to float16 or int8 (CHATBOT_EMBEDDING_STORE_DTYPE) are misses, so callers never
+    get a lossy vector back from the cache.
+    """
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        from .embedding_store import decode_vector
+        from .models import PromptEmbedding
+
+        found = {}
+        for chunk in _chunks(keys):
+            rows = PromptEmbedding.objects.filter(key__in=chunk, dtype=PromptEmbedding.FLOAT32).only("key", "vector")
+            for row in rows:
+                found[row.key] = decode_vector(row.vector)
+        return found
+
+    def set_many(self, vectors: Dict[str, np.ndarray], model_id: str) -> None:
+        from .models import PromptEmbedding
+
+        rows = [
+            PromptEmbedding(
+                key=key, model_id=model_id, dimensions=len(vector), dtype=PromptEmbedding.FLOAT32, vector=vector.tobytes()
+            )
+            for key, vector in vectors.items()
+        ]
+        PromptEmbedding.objects.bulk_create(rows, ignore_conflicts=True)
+
+    def __repr__(self):
+        return "DatabaseTier(PromptEmbedding)"
+
+
+class EmbeddingCache:
+    """
+    In-memory LRU of embeddings in front of an optional persistent tier.
+    """
+
+    def __init__(self, capacity: int = 10000, persistent_tier=None):
+        """
+        Initialize the EmbeddingCache class.
+
+        Args:
+            capacity: Most vectors kept in memory
+            persistent_tier: FileTier, DatabaseTier or None
+        """
+        self.capacity = capacity
+        self.persistent_tier = persistent_tier
+        self._lock = threading.Lock()
+        # key -> float32 vector, least recently used first
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.persistent_errors = 0
+
+    def _remember(self, vectors: Dict[str, np.ndarray]) -> None:
+        with self._lock:
+            for key, vector in vectors.items():
+                # Handed out without copying, so nobody may change them
+                vector.setflags(write=False)
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.capacity:
+                self._memory.popitem(last=False)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up many keys at once: memory first, then one bulk query of the
+        persistent tier for the rest.
+
+        Returns:
+            {key: read-only vector} for the keys found
+        """
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+        memory_hits = len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.persistent_tier is not None:
+            try:
+                stored = self.persistent_tier.get_many(missing)
+            except PERSISTENT_TIER_ERRORS as e:
+                logger.error(f"Error reading embeddings from {self.persistent_tier!r}: {str(e)}")
+                stored = {}
+                self.persistent_errors += 1
+            self._remember(stored)
+            found.update(stored)
+
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.persistent_hits += len(found) - memory_hits
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, vectors: Dict[str, Sequence[float]], model_id: str) -> None:
+        """
+        Add freshly generated embeddings of a model to both tiers (binary ones to
+        memory only). Float embeddings are kept as float32.
+        """
+        if not vectors:
+            return
+        arrays = {
+            key: vector if isinstance(vector, np.ndarray) and vector.dtype == np.uint8
+            else np.asarray(vector, dtype=np.float32)
+            for key, vector in vectors.items()
+        }
+        self._remember(arrays)
+        persistent = {key: vector for key, vector in arrays.items() if vector.dtype == np.float32}
+        if persistent and self.persistent_tier is not None:
+            try:
+                self.persistent_tier.set_many(persistent, model_id)
+            except PERSISTENT_TIER_ERRORS as e:
+                logger.error(f"Error writing embeddings to {self.persistent_tier!r}: {str(e)}")
+                self.persistent_errors += 1
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.memory_hits + self.persistent_hits + self.misses
+            return {
+                "size": len(self._memory),
+                "capacity": self.capacity,
+                "persistent_tier": repr(self.persistent_tier) if self.persistent_tier is not None else None,
+                "memory_hits": self.memory_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.persistent_hits) / lookups, 4) if lookups else 0.0,
+                "persistent_errors": self.persistent_errors,
+            }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def _running_under_django() -> bool:
+    try:
+        from django.apps import apps
+        from django.conf import settings
+    except ImportError:
+        return False
+    return settings.configured and apps.ready
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Return the process-wide EmbeddingCache, configured from the environment on
+    first use (this module is also used outside Django, by bakerydemo/main.py):
+
+    - BEDROCK_EMBEDDING_CACHE_SIZE: vectors kept in memory; 0 disables the cache
+    - BEDROCK_EMBEDDING_CACHE_PERSIST: "db" (PromptEmbedding table, the default
+      under Django), "file" (the default elsewhere) or "none"
+    - BEDROCK_EMBEDDING_CACHE_FILE: the SQLite file of the "file" tier
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                capacity = int(os.getenv("BEDROCK_EMBEDDING_CACHE_SIZE", "10000"))
+                if capacity <= 0:
+                    return None
+                persist = os.getenv("BEDROCK_EMBEDDING_CACHE_PERSIST") or ("db" if _running_under_django() else "file")
+                tier = None
+                if persist == "db":
+                    tier = DatabaseTier()
+                elif persist == "file":
+                    default_path = os.path.join(tempfile.gettempdir(), "bakerydemo-embeddings.sqlite3")
+                    tier = FileTier(os.getenv("BEDROCK_EMBEDDING_CACHE_FILE", default_path))
+                _cache = EmbeddingCache(capacity, tier)
+                logger.info(f"Embedding cache of {capacity} vectors, persistent tier {tier!r}")
+    return _cache
@@ -0,0 +1,115 @@
+"""
+Compact storage for prompt embeddings.
+A 1024-dimension Titan vector is about 20 KB as JSON in the session; as a float32
+blob it is 4 KB, as float16 2 KB and as scaled int8 1 KB. Vectors are stored in the
+PromptEmbedding table under a content hash, and the session keeps only that key.
+"""
+
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.db import DatabaseError
+
+from . import embedding_cache
+from .models import PromptEmbedding
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_ID = "amazon.titan-embed-text-v2:0"
+SESSION_KEY = "last_prompt_embedding_key"
+# Written by earlier versions with the full vector; removed from sessions on the next turn
+LEGACY_SESSION_KEY = "last_prompt_embeddings"
+
+
+def make_key(text: str, model_id: str = DEFAULT_MODEL_ID, dimensions: int = 1024) -> str:
+    """Content hash identifying the (normalized) embedding of a text; shared with the embedding cache."""
+    return embedding_cache.make_key(text, model_id, dimensions)
+
+
+def encode_vector(vector: Sequence[float], dtype: str = PromptEmbedding.FLOAT32) -> Tuple[bytes, float]:
+    """
+    Pack a vector into a blob.
+
+    Args:
+        vector: The embedding
+        dtype: "float32", "float16" or "int8"
+
+    Returns:
+        A (blob, scale) tuple; scale restores int8 values and is 1.0 otherwise
+    """
+    array = np.asarray(vector, dtype=np.float32)
+    if dtype == PromptEmbedding.INT8:
+        # Symmetric quantization: the largest component maps to +/-127
+        peak = float(np.max(np.abs(array))) if array.size else 0.0
+        scale = peak / 127 if peak else 1.0
+        return np.round(array / scale).astype(np.int8).tobytes(), scale
+    if dtype == PromptEmbedding.FLOAT16:
+        return array.astype(np.float16).tobytes(), 1.0
+    return array.tobytes(), 1.0
+
+
+def decode_vector(blob: bytes, dtype: str = PromptEmbedding.FLOAT32, scale: float = 1.0) -> np.ndarray:
+    """Unpack a blob written by encode_vector() into a float32 array."""
+    array = np.frombuffer(bytes(blob), dtype=np.dtype(dtype))
+    if dtype == PromptEmbedding.INT8:
+        return array.astype(np.float32) * np.float32(scale)
+    return array.astype(np.float32)
+
+
+def get_dtype() -> str:
+    from django.conf import settings
+
+    return getattr(settings, "CHATBOT_EMBEDDING_STORE_DTYPE", PromptEmbedding.FLOAT32)
+
+
+def build_embedding(text: str, vector: Sequence[float], model_id: str = DEFAULT_MODEL_ID, dtype: Optional[str] = None) -> PromptEmbedding:
+    dtype = dtype or get_dtype()
+    blob, scale = encode_vector(vector, dtype)
+    return PromptEmbedding(
+        key=make_key(text, model_id, len(vector)),
+        model_id=model_id,
+        dimensions=len(vector),
+        dtype=dtype,
+        scale=scale,
+        vector=blob,
+    )
+
+
+def store_embedding(text: str, vector: Sequence[float], model_id: str = DEFAULT_MODEL_ID, dtype: Optional[str] = None) -> Optional[str]:
+    """
+    Save the embedding of a text, keeping the existing row for a repeated text.
+
+    Returns:
+        The embedding key, or None if it could not be stored
+    """
+    embedding = build_embedding(text, vector, model_id, dtype)
+    try:
+        PromptEmbedding.objects.bulk_create([embedding], ignore_conflicts=True)
+        return embedding.key
+    except DatabaseError as e:
+        logger.error(f"Error storing prompt embedding: {str(e)}")
+        return None
+
+
+def load_embedding(key: str) -> Optional[List[float]]:
+    """Return a stored embedding as a list of floats, or None if it is missing."""
+    embedding = PromptEmbedding.objects.filter(key=key).first()
+    if embedding is None:
+        return None
+    return decode_vector(embedding.vector, embedding.dtype, embedding.scale).tolist()
+
+
+async def aload_embedding(key: str) -> Optional[List[float]]:
+    """Async counterpart of load_embedding()."""
+    embedding = await PromptEmbedding.objects.filter(key=key).afirst()
+    if embedding is None:
+        return None
+    return decode_vector(embedding.vector, embedding.dtype, embedding.scale).tolist()
+
+
+def load_session_embedding(session) -> Optional[List[float]]:
+    """Return the embedding of the session's last prompt, if there is one."""
+    key = session.get(SESSION_KEY)
+    return load_embedding(key) if key else None
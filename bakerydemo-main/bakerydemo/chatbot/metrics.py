@@ -0,0 +1,186 @@
+"""
+Per-stage latency instrumentation for the chatbot.
+Each chat request gets a StageTimer that times the cache lookups, the Bedrock
+embedding, the Ollama queue and generation, the ChatLog write and the session
+save. The stages are sent back in a Server-Timing header (visible in the browser's
+network panel) and recorded in in-process histograms that the staff-only metrics
+endpoint reports as p50/p95/p99.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# Ollama reports these durations in nanoseconds; recorded as stages under these names
+OLLAMA_DURATIONS = (
+    ("load_duration", "ollama_load"),
+    ("prompt_eval_duration", "ollama_prompt_eval"),
+    ("eval_duration", "ollama_eval"),
+)
+OLLAMA_COUNTS = ("prompt_eval_count", "eval_count")
+
+
+class Histogram:
+    """Latency samples over a sliding window, plus lifetime count and sum."""
+
+    def __init__(self, window: int = 1000):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        samples = sorted(self._samples)
+
+        def percentile(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1) if samples else 0.0
+
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """Histograms grouped by kind ("stage", "backend", ...) and name."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+
+    def observe(self, group: str, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get((group, name))
+            if histogram is None:
+                histogram = self._histograms[(group, name)] = Histogram(self.window)
+            histogram.observe(seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Return {group: {name: percentiles}}."""
+        with self._lock:
+            result: Dict[str, Dict[str, Any]] = {}
+            for (group, name), histogram in sorted(self._histograms.items()):
+                result.setdefault(group, {})[name] = histogram.snapshot()
+            return result
+
+
+_metrics = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Return the process-wide MetricsRegistry."""
+    return _metrics
+
+
+class StageTimer:
+    """
+    Collects the stage durations of one chat request.
+    Stages that run more than once (or in the background) accumulate.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.view_finished_at: Optional[float] = None
+        self.stages: "OrderedDict[str, float]" = OrderedDict()
+        self.ollama: Dict[str, Any] = {}
+        self._committed = False
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a with block as a stage."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started_at)
+
+    def record(self, name: str, seconds: Optional[float]) -> None:
+        if seconds is not None:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_ollama(self, result: Dict[str, Any]) -> None:
+        """Capture Ollama's own timing fields from a final /api/generate response."""
+        for field, stage in OLLAMA_DURATIONS:
+            if result.get(field):
+                self.record(stage, result[field] / 1e9)
+        for field in OLLAMA_COUNTS:
+            if field in result:
+                self.ollama[field] = result[field]
+        if result.get("eval_count") and result.get("eval_duration"):
+            self.ollama["tokens_per_second"] = round(result["eval_count"] / (result["eval_duration"] / 1e9), 1)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Stage durations in milliseconds, for JSON responses and SSE events."""
+        timings: Dict[str, Any] = {"total_ms": round(self.elapsed() * 1000, 1)}
+        for name, seconds in self.stages.items():
+            timings[f"{name}_ms"] = round(seconds * 1000, 1)
+        if self.ollama:
+            timings["ollama"] = dict(self.ollama)
+        return timings
+
+    def header(self) -> str:
+        """Format the stages as a Server-Timing header value."""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def commit(self, registry: Optional[MetricsRegistry] = None) -> None:
+        """Record the stages in the histograms; later calls are ignored."""
+        if self._committed:
+            return
+        self._committed = True
+        registry = registry or get_metrics()
+        for name, seconds in self.stages.items():
+            registry.observe("stage", name, seconds)
+        registry.observe("stage", "total", self.elapsed())
+
+
+def get_stage_timer(request) -> StageTimer:
+    """Return the StageTimer of a request, creating it on first use."""
+    timer = getattr(request, "stage_timer", None)
+    if timer is None:
+        timer = request.stage_timer = StageTimer()
+    return timer
+
+
+def timed_view(view):
+    """
+    Give a chatbot view a StageTimer and note when it returns, so that
+    ServerTimingMiddleware can attribute the time after it to the session save.
+    """
+    if asyncio.iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            timer = get_stage_timer(request)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                timer.view_finished_at = time.perf_counter()
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        timer = get_stage_timer(request)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            timer.view_finished_at = time.perf_counter()
+
+    return wrapper
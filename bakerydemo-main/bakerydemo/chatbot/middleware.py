@@ -0,0 +1,30 @@
+"""
+Middleware for the chatbot app.
+"""
+
+import time
+
+from django.utils.deprecation import MiddlewareMixin
+
+
+class ServerTimingMiddleware(MiddlewareMixin):
+    """
+    Adds the Server-Timing header to responses of views decorated with
+    metrics.timed_view and records their stages in the metrics histograms.
+
+    It must sit above SessionMiddleware: the time between the view returning and
+    this middleware running is recorded as the "session" stage.
+    """
+
+    def process_response(self, request, response):
+        timer = getattr(request, "stage_timer", None)
+        if timer is None:
+            return response
+
+        if timer.view_finished_at is not None:
+            timer.record("session", time.perf_counter() - timer.view_finished_at)
+        response["Server-Timing"] = timer.header()
+        # A streamed answer is still being generated; its view commits the timer at the end
+        if not getattr(response, "commits_stage_timer", False):
+            timer.commit()
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_alter_chatlog_model_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PromptEmbedding',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('model_id', models.CharField(max_length=100)),
+                ('dimensions', models.PositiveIntegerField()),
+                ('dtype', models.CharField(choices=[('float32', 'float32'), ('float16', 'float16'), ('int8', 'int8 (scaled)')], default='float32', max_length=8)),
+                ('scale', models.FloatField(default=1.0)),
+                ('vector', models.BinaryField()),
+            ],
+            options={
+                'verbose_name': 'Prompt Embedding',
+                'verbose_name_plural': 'Prompt Embeddings',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_promptembedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatlog',
+            name='cancelled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
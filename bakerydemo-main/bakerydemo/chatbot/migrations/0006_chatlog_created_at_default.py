@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_chatlog_cancelled'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatlog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
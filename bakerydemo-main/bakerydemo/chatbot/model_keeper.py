@@ -0,0 +1,261 @@
+"""
+Ollama model warm-up and keep-alive.
+Ollama unloads a model after it has been idle for its keep_alive period, and the
+next request then pays the model's load_duration (several seconds for the
+deepseek-bakery-expert model) on top of the generation. The ModelKeeper preloads
+the configured models on every backend when the app starts and re-sends the
+keep_alive every interval, watching /api/ps to record when models are loaded or
+unloaded. Generations that still hit a cold model are counted per backend by the
+BackendPool.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Union
+
+import requests
+
+from .ollama_client import Backend, BackendPool
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def model_matches(name: str, model: str) -> bool:
+    """Whether a model name from /api/ps refers to a configured model ("x" means "x:latest")."""
+    return name == model or (":" not in model and name == f"{model}:latest")
+
+
+class ModelKeeper:
+    """
+    Keeps a set of models loaded on every backend of a BackendPool.
+    """
+
+    def __init__(
+        self,
+        backend_pool: BackendPool,
+        models: Sequence[str],
+        keep_alive: Union[str, int] = "30m",
+        interval: float = 240,
+        timeout: float = 120,
+        max_events: int = 100,
+        options: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Initialize the ModelKeeper class.
+
+        Args:
+            backend_pool: The pool whose backends are kept warm
+            models: Names of the models to keep loaded
+            keep_alive: How long Ollama keeps a model loaded after a request ("30m", seconds, -1 for ever)
+            interval: Seconds between keep-alive rounds; must be shorter than keep_alive
+            timeout: Request timeout for a preload, which includes loading the model (seconds)
+            max_events: Load/unload events kept for the metrics endpoint
+            options: Options the model is loaded with; a chat request asking for another num_ctx reloads it
+        """
+        self.backend_pool = backend_pool
+        self.models = list(models)
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.timeout = timeout
+        self.options = options or {}
+
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # Models last seen in /api/ps, per backend URL
+        self._resident: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=max_events)
+        self.rounds = 0
+        self.preloads = 0
+        self.loads = 0
+        self.unloads = 0
+        self.errors = 0
+        self.last_round_at: Optional[float] = None
+
+    def _event(self, backend: Backend, model: str, event: str, **details) -> None:
+        # Called with the lock held
+        self.events.append(dict(time=time.time(), backend=backend.base_url, model=model, event=event, **details))
+
+    def residency(self, backend: Backend, timeout: float = 5) -> Dict[str, Dict[str, Any]]:
+        """
+        List the models loaded on a backend, from its /api/ps endpoint.
+
+        Returns:
+            {model name: {"expires_at", "size_vram"}}
+        """
+        response = self.session.get(backend.url("/api/ps"), timeout=timeout)
+        response.raise_for_status()
+        return {
+            entry.get("name") or entry.get("model"): {
+                "expires_at": entry.get("expires_at"),
+                "size_vram": entry.get("size_vram"),
+            }
+            for entry in response.json().get("models", [])
+        }
+
+    def residency_report(self, model: str) -> List[Dict[str, Any]]:
+        """
+        Check every backend for a model without running a generation.
+
+        Returns:
+            One entry per backend: reachable, resident, expires_at and the loaded models
+        """
+        report = []
+        for backend in self.backend_pool.backends:
+            entry: Dict[str, Any] = {"url": backend.base_url}
+            try:
+                resident = self.residency(backend)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                entry.update(reachable=False, resident=False, error=str(e))
+            else:
+                name = next((name for name in resident if model_matches(name, model)), None)
+                entry.update(
+                    reachable=True,
+                    resident=name is not None,
+                    expires_at=resident[name]["expires_at"] if name else None,
+                    size_vram=resident[name]["size_vram"] if name else None,
+                    loaded_models=sorted(resident),
+                )
+            entry["cold_starts"] = backend.cold_starts
+            report.append(entry)
+        return report
+
+    def preload(self, backend: Backend, model: str) -> float:
+        """
+        Load a model on a backend (or refresh its keep_alive) with a prompt-less request.
+
+        Returns:
+            The load_duration Ollama reported, in seconds (close to 0 when already loaded)
+        """
+        payload = {"model": model, "keep_alive": self.keep_alive, "stream": False}
+        if self.options:
+            payload["options"] = self.options
+        response = self.session.post(backend.url("/api/generate"), json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get("load_duration", 0) / 1e9
+
+    def _resident_models(self, resident: Dict[str, Dict[str, Any]]) -> List[str]:
+        return [model for model in self.models if any(model_matches(name, model) for name in resident)]
+
+    def refresh_backend(self, backend: Backend) -> None:
+        """Record load/unload events on one backend and preload any configured model that is not loaded."""
+        try:
+            resident = self.residency(backend)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"Could not list loaded models on {backend.base_url}: {str(e)}")
+            with self._lock:
+                self.errors += 1
+            return
+
+        with self._lock:
+            previous = self._resident.get(backend.base_url)
+            if previous is not None:
+                for model in set(self._resident_models(previous)) - set(self._resident_models(resident)):
+                    logger.warning(f"Model {model} was unloaded from {backend.base_url}")
+                    self.unloads += 1
+                    self._event(backend, model, "unload")
+            self._resident[backend.base_url] = resident
+
+        for model in self.models:
+            was_resident = model in self._resident_models(resident)
+            try:
+                load_seconds = self.preload(backend, model)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning(f"Could not preload {model} on {backend.base_url}: {str(e)}")
+                with self._lock:
+                    self.errors += 1
+                continue
+            with self._lock:
+                self.preloads += 1
+                if not was_resident:
+                    logger.info(f"Loaded {model} on {backend.base_url} in {load_seconds:.2f}s")
+                    self.loads += 1
+                    self._event(backend, model, "load", load_ms=round(load_seconds * 1000, 1))
+                    self._resident[backend.base_url][model] = {"expires_at": None, "size_vram": None}
+
+    def run_once(self) -> None:
+        """Run one keep-alive round over every backend."""
+        for backend in self.backend_pool.backends:
+            self.refresh_backend(backend)
+        with self._lock:
+            self.rounds += 1
+            self.last_round_at = time.time()
+
+    def start(self) -> "ModelKeeper":
+        """Warm the models now and keep them warm from a daemon thread."""
+        if self._thread is not None or not self.models:
+            return self
+
+        def run():
+            while not self._stop.is_set():
+                self.run_once()
+                self._stop.wait(self.interval)
+
+        self._thread = threading.Thread(target=run, name="ollama-model-keeper", daemon=True)
+        self._thread.start()
+        logger.info(f"Keeping {self.models} warm on {self.backend_pool.backends} every {self.interval}s")
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "models": self.models,
+                "keep_alive": self.keep_alive,
+                "interval": self.interval,
+                "running": self._thread is not None and not self._stop.is_set(),
+                "rounds": self.rounds,
+                "preloads": self.preloads,
+                "loads": self.loads,
+                "unloads": self.unloads,
+                "errors": self.errors,
+                "cold_starts": sum(backend.cold_starts for backend in self.backend_pool.backends),
+                "last_round_at": self.last_round_at,
+                "events": list(self.events)[-20:],
+            }
+
+
+_keeper: Optional[ModelKeeper] = None
+_keeper_lock = threading.Lock()
+
+
+def get_model_keeper() -> ModelKeeper:
+    """
+    Return the process-wide ModelKeeper for settings.OLLAMA_WARM_MODELS,
+    creating it on first use. It only runs once start_model_keeper() is called.
+    """
+    global _keeper
+    if _keeper is None:
+        from .ollama_client import get_backend_pool, get_default_options
+
+        backend_pool = get_backend_pool()
+        with _keeper_lock:
+            if _keeper is None:
+                from django.conf import settings
+
+                _keeper = ModelKeeper(
+                    backend_pool,
+                    models=getattr(settings, "OLLAMA_WARM_MODELS", []),
+                    keep_alive=getattr(settings, "OLLAMA_KEEP_ALIVE", "30m"),
+                    interval=getattr(settings, "OLLAMA_WARMUP_INTERVAL", 240),
+                    timeout=getattr(settings, "OLLAMA_TIMEOUT", 120),
+                    options=get_default_options(),
+                )
+    return _keeper
+
+
+def start_model_keeper() -> Optional[ModelKeeper]:
+    """Start the process-wide ModelKeeper unless OLLAMA_WARMUP_INTERVAL is 0."""
+    from django.conf import settings
+
+    if not getattr(settings, "OLLAMA_WARMUP_INTERVAL", 240):
+        return None
+    return get_model_keeper().start()
@@ -3,7 +3,8 @@ from django.contrib.auth import get_user_model
 from django.utils import timezone
 
 class ChatLog(models.Model):
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the turn happens, not when a batched insert gets round to it
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
     messages = models.JSONField()  # stores the full conversation as a list of dicts
     
@@ -25,6 +26,9 @@ class ChatLog(models.Model):
     
     # Model name used for the response
     model_name = models.CharField(max_length=100, default="deepseek-bakery-expert")
+
+    # The client disconnected before the answer was finished; ai_response is the partial answer
+    cancelled = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['-created_at']
@@ -34,13 +38,63 @@ class ChatLog(models.Model):
     def __str__(self):
         return f"ChatLog #{self.id} at {self.created_at.strftime('%Y-%m-%d %H:%M')}"
     
+    def populate_from_messages(self):
+        """
+        Extract the user prompt and AI response from messages if available.
+        The last message of each role wins, so the list is walked backwards and the
+        walk stops as soon as both are found. bulk_create() does not call save(),
+        so batched writers call this themselves.
+        """
+        if not self.messages or not isinstance(self.messages, list):
+            return
+        user_prompt = ai_response = None
+        for msg in reversed(self.messages):
+            role = msg.get('role')
+            if role == 'user' and user_prompt is None:
+                user_prompt = msg.get('content', '')
+            elif role == 'assistant' and ai_response is None:
+                ai_response = msg.get('content', '')
+            if user_prompt is not None and ai_response is not None:
+                break
+        if user_prompt is not None:
+            self.user_prompt = user_prompt
+        if ai_response is not None:
+            self.ai_response = ai_response
+
     def save(self, *args, **kwargs):
-        # Extract user prompt and AI response from messages if available
-        if self.messages and isinstance(self.messages, list):
-            for msg in self.messages:
-                if msg.get('role') == 'user':
-                    self.user_prompt = msg.get('content', '')
-                elif msg.get('role') == 'assistant':
-                    self.ai_response = msg.get('content', '')
-        
+        self.populate_from_messages()
         super().save(*args, **kwargs)
+
+
+class PromptEmbedding(models.Model):
+    """
+    A prompt embedding stored as a compact binary blob instead of a JSON list in
+    the session. Rows are keyed by a hash of the model, dimensions and prompt
+    text, so repeated prompts share one row and the session only keeps the key.
+    """
+
+    FLOAT32 = "float32"
+    FLOAT16 = "float16"
+    INT8 = "int8"
+    DTYPE_CHOICES = [
+        (FLOAT32, "float32"),
+        (FLOAT16, "float16"),
+        (INT8, "int8 (scaled)"),
+    ]
+
+    key = models.CharField(max_length=64, primary_key=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    model_id = models.CharField(max_length=100)
+    dimensions = models.PositiveIntegerField()
+    dtype = models.CharField(max_length=8, choices=DTYPE_CHOICES, default=FLOAT32)
+    # Multiplier restoring int8 values to floats; 1.0 for the float types
+    scale = models.FloatField(default=1.0)
+    vector = models.BinaryField()
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Prompt Embedding"
+        verbose_name_plural = "Prompt Embeddings"
+
+    def __str__(self):
+        return f"PromptEmbedding {self.key[:12]} ({self.dimensions} x {self.dtype})"
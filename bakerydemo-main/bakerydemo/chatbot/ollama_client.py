@@ -0,0 +1,968 @@
+"""
+Ollama API client module.
+This module provides shared HTTP clients for the Ollama API that keep a pool of
+keep-alive connections open, so chat requests do not pay for a new TCP handshake
+(or a curl subprocess) on every prompt. OllamaClient is used by the sync views and
+AsyncOllamaClient by the async views served through ASGI.
+
+Both clients route every request through a BackendPool, which spreads generations
+over several Ollama hosts (least outstanding requests or latency weighted), runs
+background health checks and keeps a circuit breaker per host. Generations that
+had to wait for Ollama to load the model are counted as cold starts per host.
+
+A stream that has not produced its first token within the observed p95 can be
+hedged: a duplicate goes to another backend, the first to answer is kept and the
+other is cancelled (see HedgePolicy).
+"""
+
+import asyncio
+import json
+import logging
+import math
+import queue
+import threading
+import time
+import weakref
+from collections import deque
+from typing import (
+    Any,
+    AsyncIterator,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import get_metrics
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ROUTING_LEAST_OUTSTANDING = "least_outstanding"
+ROUTING_LATENCY = "latency"
+
+
+def get_base_url(api_url: str) -> str:
+    """
+    Strip the endpoint path from an Ollama API URL.
+
+    Args:
+        api_url: An Ollama URL such as http://host:11434/api/generate
+
+    Returns:
+        The server base URL, e.g. http://host:11434
+    """
+    api_url = api_url.rstrip("/")
+    if "/api/" in api_url:
+        return api_url.split("/api/", 1)[0]
+    return api_url
+
+
+class Backend:
+    """
+    One Ollama host and its routing state.
+    The circuit breaker is closed while the host works, open (skipped) for a
+    cooldown after repeated failures, then half-open to let a single trial
+    request decide whether it closes again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, base_url: str):
+        self.base_url = get_base_url(base_url)
+        self.outstanding = 0
+        self.ewma_latency: Optional[float] = None
+        self.healthy = True
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+        self.cold_starts = 0
+        self.last_load_duration: Optional[float] = None
+        # EWMA tokens per second, generated and prompt-evaluated
+        self.eval_rate: Optional[float] = None
+        self.prompt_rate: Optional[float] = None
+
+    def url(self, path: str) -> str:
+        """Build the full URL for an API path such as /api/generate."""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "circuit": self.state,
+            "outstanding": self.outstanding,
+            "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "cold_starts": self.cold_starts,
+            "last_load_ms": round(self.last_load_duration * 1000, 1) if self.last_load_duration is not None else None,
+            "eval_rate": round(self.eval_rate, 1) if self.eval_rate is not None else None,
+            "prompt_rate": round(self.prompt_rate, 1) if self.prompt_rate is not None else None,
+        }
+
+    def __repr__(self):
+        return f"Backend({self.base_url!r})"
+
+
+class BackendPool:
+    """
+    Chooses an Ollama backend for each request.
+
+    With "least_outstanding" routing the backend with the fewest in-flight
+    requests wins, ties broken by latency. With "latency" routing the backend
+    with the lowest expected wait, EWMA latency x (outstanding + 1), wins.
+    When every backend is unhealthy or open the pool fails open and uses them anyway.
+    """
+
+    def __init__(
+        self,
+        base_urls: Union[str, Sequence[str]],
+        routing: str = ROUTING_LEAST_OUTSTANDING,
+        failure_threshold: int = 3,
+        cooldown: float = 30,
+        ewma_alpha: float = 0.3,
+        cold_start_threshold: float = 1.0,
+    ):
+        """
+        Initialize the BackendPool class.
+
+        Args:
+            base_urls: One or more Ollama URLs
+            routing: "least_outstanding" or "latency"
+            failure_threshold: Consecutive failures that open a backend's circuit
+            cooldown: Seconds an open circuit waits before letting a trial request through
+            ewma_alpha: Weight of the newest sample in the latency average
+            cold_start_threshold: load_duration (seconds) above which a generation counts as a cold start
+        """
+        if isinstance(base_urls, str):
+            base_urls = [base_urls]
+        if not base_urls:
+            raise ValueError("At least one Ollama backend is required")
+        self.backends = [Backend(url) for url in base_urls]
+        self.routing = routing
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.ewma_alpha = ewma_alpha
+        self.cold_start_threshold = cold_start_threshold
+        self._lock = threading.Lock()
+        self._health_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _available(self, backend: Backend, now: float) -> bool:
+        # Called with the lock held
+        if not backend.healthy:
+            return False
+        if backend.state == Backend.OPEN:
+            if now - backend.opened_at < self.cooldown:
+                return False
+            backend.state = Backend.HALF_OPEN
+        if backend.state == Backend.HALF_OPEN:
+            return not backend.trial_in_flight
+        return True
+
+    def _score(self, backend: Backend):
+        latency = backend.ewma_latency or 0.0
+        if self.routing == ROUTING_LATENCY:
+            return (latency * (backend.outstanding + 1), backend.outstanding)
+        return (backend.outstanding, latency)
+
+    def acquire(self, exclude: Sequence[Backend] = ()) -> Backend:
+        """
+        Pick a backend for a request and count it as outstanding.
+        Every acquire() must be paired with a release().
+
+        Args:
+            exclude: Backends already tried for this request
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b not in exclude and self._available(b, now)]
+            if not candidates:
+                candidates = [b for b in self.backends if b not in exclude] or list(self.backends)
+            backend = min(candidates, key=self._score)
+            if backend.state == Backend.HALF_OPEN:
+                backend.trial_in_flight = True
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def try_acquire(self, exclude: Sequence[Backend] = ()) -> Optional[Backend]:
+        """
+        Like acquire(), but only considers healthy backends with a closed circuit
+        and returns None instead of failing open.
+        """
+        with self._lock:
+            candidates = [
+                b for b in self.backends if b not in exclude and b.healthy and b.state == Backend.CLOSED
+            ]
+            if not candidates:
+                return None
+            backend = min(candidates, key=self._score)
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend: Backend, latency: Optional[float] = None, failed: bool = False) -> None:
+        """
+        Record the outcome of a request started with acquire().
+
+        Args:
+            backend: The backend returned by acquire()
+            latency: Seconds the request took, if it completed
+            failed: Whether the failure counts against the backend's circuit
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            backend.trial_in_flight = False
+            if failed:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.state == Backend.HALF_OPEN or backend.consecutive_failures >= self.failure_threshold:
+                    if backend.state != Backend.OPEN:
+                        logger.warning(f"Opening circuit for Ollama backend {backend.base_url}")
+                    backend.state = Backend.OPEN
+                    backend.opened_at = time.monotonic()
+                return
+
+            backend.consecutive_failures = 0
+            if backend.state != Backend.CLOSED:
+                logger.info(f"Closing circuit for Ollama backend {backend.base_url}")
+                backend.state = Backend.CLOSED
+            if latency is not None:
+                get_metrics().observe("backend", backend.base_url, latency)
+                if backend.ewma_latency is None:
+                    backend.ewma_latency = latency
+                else:
+                    backend.ewma_latency += self.ewma_alpha * (latency - backend.ewma_latency)
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        return value if current is None else self.ewma_alpha * value + (1 - self.ewma_alpha) * current
+
+    def record_generation(self, backend: Backend, result: Dict[str, Any]) -> None:
+        """
+        Track the backend's token rates from a final Ollama response, and count a
+        cold start if it shows the model had to be loaded.
+        """
+        with self._lock:
+            if result.get("eval_count") and result.get("eval_duration"):
+                backend.eval_rate = self._ewma(backend.eval_rate, result["eval_count"] / (result["eval_duration"] / 1e9))
+            if result.get("prompt_eval_count") and result.get("prompt_eval_duration"):
+                backend.prompt_rate = self._ewma(
+                    backend.prompt_rate, result["prompt_eval_count"] / (result["prompt_eval_duration"] / 1e9)
+                )
+        if "load_duration" not in result:
+            return
+        load_duration = result["load_duration"] / 1e9
+        with self._lock:
+            backend.last_load_duration = load_duration
+            if load_duration < self.cold_start_threshold:
+                return
+            backend.cold_starts += 1
+        logger.warning(f"Cold start on {backend.base_url}: loading {result.get('model', 'the model')} took {load_duration:.2f}s")
+        get_metrics().observe("cold_start", backend.base_url, load_duration)
+
+    def token_rates(self) -> Tuple[Optional[float], Optional[float]]:
+        """
+        The slowest measured (generated, prompt) tokens per second over the
+        backends, or None for a rate no backend has reported yet.
+        """
+        with self._lock:
+            eval_rates = [backend.eval_rate for backend in self.backends if backend.eval_rate]
+            prompt_rates = [backend.prompt_rate for backend in self.backends if backend.prompt_rate]
+        return min(eval_rates, default=None), min(prompt_rates, default=None)
+
+    def mark_health(self, backend: Backend, healthy: bool) -> None:
+        with self._lock:
+            if backend.healthy != healthy:
+                logger.warning(f"Ollama backend {backend.base_url} is now {'healthy' if healthy else 'unhealthy'}")
+            backend.healthy = healthy
+
+    def check_health(self, session: requests.Session, timeout: float = 2) -> None:
+        """Probe every backend with the cheap /api/version endpoint."""
+        for backend in self.backends:
+            try:
+                session.get(backend.url("/api/version"), timeout=timeout).raise_for_status()
+                self.mark_health(backend, True)
+            except requests.exceptions.RequestException:
+                self.mark_health(backend, False)
+
+    def start_health_checks(self, interval: float) -> None:
+        """Run check_health() every interval seconds in a daemon thread."""
+        if self._health_thread is not None:
+            return
+
+        def run():
+            session = requests.Session()
+            while not self._stop.is_set():
+                self.check_health(session)
+                self._stop.wait(interval)
+
+        self._health_thread = threading.Thread(target=run, name="ollama-health-check", daemon=True)
+        self._health_thread.start()
+
+    def stop_health_checks(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return the routing, health and circuit state of every backend."""
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
+
+
+class HedgePolicy:
+    """
+    Decides when a streamed generation gets a duplicate on a second backend.
+
+    The hedge delay is the quantile (p95 by default) of recently observed times to
+    the first chunk, so only the slowest few percent of requests are duplicated.
+    Hedges are extra generations outside admission control, so they are capped at
+    max_ratio of the streams seen.
+    """
+
+    def __init__(self, quantile: float = 0.95, max_ratio: float = 0.05, min_samples: int = 20, min_delay: float = 0.05, window: int = 500):
+        """
+        Initialize the HedgePolicy class.
+
+        Args:
+            quantile: Quantile of the time to first token after which a request is hedged
+            max_ratio: Most hedges as a share of streams
+            min_samples: Observations needed before hedging starts
+            min_delay: Shortest hedge delay (seconds), for very fast backends
+            window: Number of recent first-token times kept
+        """
+        self.quantile = quantile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._first_token: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.hedged = 0
+        self.won = 0
+        self.denied = 0
+
+    def observe(self, seconds: float) -> None:
+        """Record the time to the first chunk of a stream."""
+        with self._lock:
+            self._first_token.append(seconds)
+
+    def delay(self) -> Optional[float]:
+        """
+        Count a stream and return how long to wait for its first token before
+        hedging, or None if it cannot be hedged.
+        """
+        with self._lock:
+            self.streams += 1
+            if len(self._first_token) < self.min_samples or self.hedged >= self.max_ratio * self.streams:
+                return None
+            samples = sorted(self._first_token)
+        index = min(len(samples) - 1, math.ceil(self.quantile * len(samples)) - 1)
+        return max(self.min_delay, samples[index])
+
+    def allow(self) -> bool:
+        """Take a hedge from the budget, if it has one left."""
+        with self._lock:
+            if self.hedged >= self.max_ratio * self.streams:
+                self.denied += 1
+                return False
+            self.hedged += 1
+            return True
+
+    def record_win(self) -> None:
+        with self._lock:
+            self.won += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = sorted(self._first_token)
+            streams, hedged, won, denied = self.streams, self.hedged, self.won, self.denied
+        index = min(len(samples) - 1, math.ceil(self.quantile * len(samples)) - 1)
+        return {
+            "streams": streams,
+            "hedged": hedged,
+            "hedge_rate": round(hedged / streams, 4) if streams else 0.0,
+            "max_ratio": self.max_ratio,
+            "hedges_won": won,
+            "budget_denied": denied,
+            "delay_ms": round(max(self.min_delay, samples[index]) * 1000, 1) if len(samples) >= self.min_samples else None,
+        }
+
+
+class _StreamAttempt:
+    """
+    One copy of a hedged stream, read on its own thread into a shared queue.
+    """
+
+    DONE = object()
+
+    def __init__(self, client: "OllamaClient", backend: Backend, path: str, payload: Dict[str, Any], timeout: Optional[float], events: "queue.Queue"):
+        self.backend = backend
+        self.response = None
+        self.cancelled = False
+        self._stream = client._stream(path, payload, timeout, backend=backend, attempt=self)
+        self._events = events
+        self._thread = threading.Thread(target=self._run, name="ollama-hedge", daemon=True)
+
+    def start(self) -> "_StreamAttempt":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        # Whatever happens, the reader must hear how this attempt ended
+        outcome: Any = RuntimeError(f"Stream from {self.backend.base_url} stopped unexpectedly")
+        try:
+            for chunk in self._stream:
+                if self.cancelled:
+                    break
+                self._events.put((self, chunk))
+            else:
+                outcome = self.DONE
+        except (requests.exceptions.RequestException, OSError, ValueError) as e:
+            # Connection and HTTP errors, or a chunk that is not valid JSON
+            outcome = e
+        finally:
+            self._stream.close()
+            if not self.cancelled:
+                self._events.put((self, outcome))
+
+    def cancel(self) -> None:
+        """Stop reading; the connection is shut down so Ollama stops generating."""
+        self.cancelled = True
+        # urllib3 >= 2.3 can interrupt a read blocked in another thread
+        shutdown = getattr(getattr(self.response, "raw", None), "shutdown", None)
+        if shutdown is not None:
+            try:
+                shutdown()
+            except (OSError, RuntimeError, ValueError):
+                # urllib3 raises ValueError once the response is closed and
+                # RuntimeError once its connection is back in the pool
+                pass
+
+
+def is_backend_failure(error: Exception) -> bool:
+    """Whether an error says something about the backend's health rather than the request."""
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, httpx.TransportError)):
+        return True
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code >= 500
+
+
+class OllamaClient:
+    """
+    A thread-safe Ollama client backed by a pooled requests.Session.
+    """
+
+    def __init__(
+        self,
+        backends: Union[str, Sequence[str]],
+        pool_size: int = 10,
+        timeout: float = 120,
+        backend_pool: Optional[BackendPool] = None,
+        keep_alive: Optional[Union[str, int]] = None,
+        options: Optional[Dict[str, Any]] = None,
+        hedge_policy: Optional[HedgePolicy] = None,
+    ):
+        """
+        Initialize the OllamaClient class.
+
+        Args:
+            backends: Base URL(s) of the Ollama server(s) (e.g. http://host:11434)
+            pool_size: Maximum number of keep-alive connections kept per host
+            timeout: Default request timeout in seconds
+            backend_pool: Shared BackendPool to route through (default: a new one for backends)
+            keep_alive: keep_alive sent with generations that do not set one (default: Ollama's own)
+            options: Default generation options (e.g. num_ctx) merged under each payload's own
+            hedge_policy: Enables hedging for streams asked to hedge
+        """
+        self.pool = backend_pool or BackendPool(backends)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.options = options or {}
+        self.hedge_policy = hedge_policy
+
+        # A single Session shares its connection pool between threads, so every
+        # request after the first reuses an already established connection
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(pool_size, len(self.pool.backends)), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        logger.info(f"Initialized OllamaClient for {self.pool.backends} with pool_size={pool_size}")
+
+    def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        # A request that could not even connect is retried once on another backend
+        attempts = min(2, len(self.pool.backends))
+        tried: List[Backend] = []
+        while True:
+            backend = self.pool.acquire(exclude=tried)
+            tried.append(backend)
+            started_at = time.monotonic()
+            try:
+                response = self.session.request(method, backend.url(path), json=payload, timeout=timeout or self.timeout)
+                response.raise_for_status()
+                result = response.json()
+            except requests.exceptions.ConnectionError as e:
+                self.pool.release(backend, failed=True)
+                if len(tried) < attempts:
+                    logger.warning(f"Ollama backend {backend.base_url} unreachable ({str(e)}); retrying on another backend")
+                    continue
+                raise
+            except Exception as e:
+                self.pool.release(backend, failed=is_backend_failure(e))
+                raise
+            self.pool.release(backend, latency=time.monotonic() - started_at)
+            if isinstance(result, dict):
+                self.pool.record_generation(backend, result)
+            return result
+
+    def post(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        POST a JSON payload to the Ollama API and return the decoded JSON body.
+
+        Raises:
+            requests.exceptions.RequestException: On connection errors, timeouts or HTTP errors
+            ValueError: If the response body is not valid JSON
+        """
+        return self._request("POST", path, payload, timeout)
+
+    def get(self, path: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """GET an Ollama API path and return the decoded JSON body."""
+        return self._request("GET", path, timeout=timeout)
+
+    def with_defaults(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Add the client's keep_alive and default options to a generation payload that does not set them."""
+        if self.keep_alive is not None:
+            payload.setdefault("keep_alive", self.keep_alive)
+        if self.options:
+            payload["options"] = {**self.options, **(payload.get("options") or {})}
+        return payload
+
+    def generate(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Run a non-streaming generation through /api/generate.
+
+        Args:
+            payload: The Ollama request body (model, prompt, options, ...)
+            timeout: Request timeout in seconds (default: the client timeout)
+
+        Returns:
+            The Ollama response as a dictionary
+        """
+        payload = self.with_defaults(dict(payload, stream=False))
+        return self.post("/api/generate", payload, timeout=timeout)
+
+    def generate_stream(self, payload: Dict[str, Any], timeout: Optional[float] = None, hedge: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Run a streaming generation through /api/generate.
+
+        Ollama answers with newline-delimited JSON objects, each carrying the next
+        piece of the answer in "response"; the last one has "done": true and the
+        timing statistics. Closing the returned generator closes the upstream
+        connection.
+
+        Args:
+            payload: The Ollama request body (model, prompt, options, ...)
+            timeout: Connect/read timeout in seconds between chunks (default: the client timeout)
+            hedge: Duplicate the request on another backend if its first token is late
+
+        Yields:
+            Each decoded NDJSON chunk as a dictionary
+        """
+        if hedge:
+            return self.hedged_stream("/api/generate", payload, timeout)
+        return self._stream("/api/generate", payload, timeout)
+
+    def chat(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Run a non-streaming chat completion through /api/chat.
+
+        Args:
+            payload: The Ollama request body (model, messages, options, ...)
+            timeout: Request timeout in seconds (default: the client timeout)
+
+        Returns:
+            The Ollama response as a dictionary; the answer is in ["message"]["content"]
+        """
+        payload = self.with_defaults(dict(payload, stream=False))
+        return self.post("/api/chat", payload, timeout=timeout)
+
+    def chat_stream(self, payload: Dict[str, Any], timeout: Optional[float] = None, hedge: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Run a streaming chat completion through /api/chat.
+        Works like generate_stream(), with each piece of the answer in ["message"]["content"].
+        """
+        if hedge:
+            return self.hedged_stream("/api/chat", payload, timeout)
+        return self._stream("/api/chat", payload, timeout)
+
+    def hedged_stream(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Stream from one backend and, if no chunk has arrived within the hedge delay,
+        send the same request to a second backend. Whichever produces a chunk first
+        is streamed to the caller; the other is cancelled. Without a HedgePolicy,
+        a second healthy backend or hedge budget this is a plain stream.
+        """
+        delay = self.hedge_policy.delay() if self.hedge_policy is not None and len(self.pool.backends) > 1 else None
+        if delay is None:
+            yield from self._stream(path, payload, timeout)
+            return
+
+        events: "queue.Queue" = queue.Queue()
+        primary = _StreamAttempt(self, self.pool.acquire(), path, payload, timeout, events).start()
+        attempts = [primary]
+        winner: Optional[_StreamAttempt] = None
+        hedge_at: Optional[float] = time.monotonic() + delay
+        try:
+            while True:
+                wait = None if hedge_at is None else max(0.0, hedge_at - time.monotonic())
+                try:
+                    attempt, item = events.get(timeout=wait)
+                except queue.Empty:
+                    hedge_at = None
+                    backend = self.pool.try_acquire(exclude=[primary.backend])
+                    if backend is None:
+                        continue
+                    if not self.hedge_policy.allow():
+                        self.pool.release(backend)
+                        continue
+                    logger.info(f"No first token from {primary.backend.base_url} after {delay:.2f}s; hedging on {backend.base_url}")
+                    attempts.append(_StreamAttempt(self, backend, path, payload, timeout, events).start())
+                    continue
+                if attempt.cancelled:
+                    continue
+                if winner is None:
+                    if isinstance(item, Exception):
+                        # Wait for the other copy if there is one still running
+                        attempt.cancelled = True
+                        if any(not other.cancelled for other in attempts):
+                            continue
+                        raise item
+                    winner = attempt
+                    hedge_at = None
+                    for other in attempts:
+                        if other is not winner:
+                            other.cancel()
+                    if winner is not primary:
+                        self.hedge_policy.record_win()
+                if item is _StreamAttempt.DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    def _stream(
+        self,
+        path: str,
+        payload: Dict[str, Any],
+        timeout: Optional[float] = None,
+        backend: Optional[Backend] = None,
+        attempt: Optional[_StreamAttempt] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        payload = self.with_defaults(dict(payload, stream=True))
+        backend = backend or self.pool.acquire()
+        started_at = time.monotonic()
+        latency = None
+        failed = False
+        try:
+            with self.session.post(
+                backend.url(path), json=payload, timeout=timeout or self.timeout, stream=True
+            ) as response:
+                if attempt is not None:
+                    attempt.response = response
+                    # Cancelled while waiting for the headers, before the response could be shut down
+                    if attempt.cancelled:
+                        return
+                response.raise_for_status()
+                first = True
+                for line in response.iter_lines():
+                    if line:
+                        chunk = json.loads(line)
+                        if first and self.hedge_policy is not None and not (attempt is not None and attempt.cancelled):
+                            self.hedge_policy.observe(time.monotonic() - started_at)
+                        first = False
+                        if chunk.get("done"):
+                            self.pool.record_generation(backend, chunk)
+                        yield chunk
+            latency = time.monotonic() - started_at
+        except Exception as e:
+            # A hedge that lost was cut off on purpose; that says nothing about its backend
+            failed = is_backend_failure(e) and not (attempt is not None and attempt.cancelled)
+            raise
+        finally:
+            # Also runs when the consumer closes the generator early
+            self.pool.release(backend, latency=latency, failed=failed)
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.session.close()
+
+
+class AsyncOllamaClient:
+    """
+    An asyncio Ollama client backed by a pooled httpx.AsyncClient.
+    Awaiting a generation does not hold a thread, so a single ASGI worker can keep
+    many generations in flight.
+    """
+
+    def __init__(
+        self,
+        backends: Union[str, Sequence[str]],
+        pool_size: int = 10,
+        timeout: float = 120,
+        backend_pool: Optional[BackendPool] = None,
+        keep_alive: Optional[Union[str, int]] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Initialize the AsyncOllamaClient class.
+
+        Args:
+            backends: Base URL(s) of the Ollama server(s) (e.g. http://host:11434)
+            pool_size: Maximum number of keep-alive connections kept open
+            timeout: Default request timeout in seconds
+            backend_pool: Shared BackendPool to route through (default: a new one for backends)
+            keep_alive: keep_alive sent with generations that do not set one (default: Ollama's own)
+            options: Default generation options (e.g. num_ctx) merged under each payload's own
+        """
+        self.pool = backend_pool or BackendPool(backends)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.options = options or {}
+        # Only idle connections are capped; in-flight requests are not limited here
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_size),
+            headers={"Content-Type": "application/json"},
+        )
+
+        logger.info(f"Initialized AsyncOllamaClient for {self.pool.backends} with pool_size={pool_size}")
+
+    async def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        attempts = min(2, len(self.pool.backends))
+        tried: List[Backend] = []
+        while True:
+            backend = self.pool.acquire(exclude=tried)
+            tried.append(backend)
+            started_at = time.monotonic()
+            try:
+                response = await self.client.request(method, backend.url(path), json=payload, timeout=timeout or self.timeout)
+                response.raise_for_status()
+                result = response.json()
+            except httpx.ConnectError as e:
+                self.pool.release(backend, failed=True)
+                if len(tried) < attempts:
+                    logger.warning(f"Ollama backend {backend.base_url} unreachable ({str(e)}); retrying on another backend")
+                    continue
+                raise
+            except BaseException as e:
+                # Includes cancellation, which says nothing about the backend
+                self.pool.release(backend, failed=isinstance(e, Exception) and is_backend_failure(e))
+                raise
+            self.pool.release(backend, latency=time.monotonic() - started_at)
+            if isinstance(result, dict):
+                self.pool.record_generation(backend, result)
+            return result
+
+    async def post(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        POST a JSON payload to the Ollama API and return the decoded JSON body.
+
+        Raises:
+            httpx.HTTPError: On connection errors, timeouts or HTTP errors
+            ValueError: If the response body is not valid JSON
+        """
+        return await self._request("POST", path, payload, timeout)
+
+    async def get(self, path: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """GET an Ollama API path and return the decoded JSON body."""
+        return await self._request("GET", path, timeout=timeout)
+
+    def with_defaults(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Add the client's keep_alive and default options to a generation payload that does not set them."""
+        if self.keep_alive is not None:
+            payload.setdefault("keep_alive", self.keep_alive)
+        if self.options:
+            payload["options"] = {**self.options, **(payload.get("options") or {})}
+        return payload
+
+    async def generate(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Run a non-streaming generation through /api/generate.
+
+        Args:
+            payload: The Ollama request body (model, prompt, options, ...)
+            timeout: Request timeout in seconds (default: the client timeout)
+
+        Returns:
+            The Ollama response as a dictionary
+        """
+        payload = self.with_defaults(dict(payload, stream=False))
+        return await self.post("/api/generate", payload, timeout=timeout)
+
+    async def chat(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Run a non-streaming chat completion through /api/chat.
+
+        Args:
+            payload: The Ollama request body (model, messages, options, ...)
+            timeout: Request timeout in seconds (default: the client timeout)
+
+        Returns:
+            The Ollama response as a dictionary; the answer is in ["message"]["content"]
+        """
+        payload = self.with_defaults(dict(payload, stream=False))
+        return await self.post("/api/chat", payload, timeout=timeout)
+
+    def generate_stream(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async counterpart of OllamaClient.generate_stream(); close it with aclose()."""
+        return self._stream("/api/generate", payload, timeout)
+
+    def chat_stream(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async counterpart of OllamaClient.chat_stream()."""
+        return self._stream("/api/chat", payload, timeout)
+
+    async def _stream(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        payload = self.with_defaults(dict(payload, stream=True))
+        backend = self.pool.acquire()
+        started_at = time.monotonic()
+        latency = None
+        failed = False
+        try:
+            async with self.client.stream(
+                "POST", backend.url(path), json=payload, timeout=timeout or self.timeout
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        chunk = json.loads(line)
+                        if chunk.get("done"):
+                            self.pool.record_generation(backend, chunk)
+                        yield chunk
+            latency = time.monotonic() - started_at
+        except BaseException as e:
+            failed = isinstance(e, Exception) and is_backend_failure(e)
+            raise
+        finally:
+            self.pool.release(backend, latency=latency, failed=failed)
+
+    async def close(self) -> None:
+        """Close all pooled connections."""
+        await self.client.aclose()
+
+
+_backend_pool: Optional[BackendPool] = None
+_backend_pool_lock = threading.Lock()
+_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+
+# httpx connections are bound to the event loop that opened them. Under uvicorn there
+# is one loop per process, but async views served through WSGI get a fresh loop per
+# request, so async clients are kept per loop.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOllamaClient]" = weakref.WeakKeyDictionary()
+
+
+def get_default_options() -> Dict[str, Any]:
+    """
+    Generation options every request is sent with. num_ctx is the same for all of
+    them: Ollama reloads the model whenever a request asks for a different one.
+    """
+    from django.conf import settings
+
+    num_ctx = getattr(settings, "OLLAMA_NUM_CTX", 0)
+    return {"num_ctx": num_ctx} if num_ctx else {}
+
+
+def get_backend_pool() -> BackendPool:
+    """
+    Return the process-wide BackendPool built from settings.OLLAMA_BACKENDS,
+    starting its background health checks on first use. The sync and async
+    clients share it, so outstanding counts and circuits cover both.
+    """
+    global _backend_pool
+    if _backend_pool is None:
+        with _backend_pool_lock:
+            if _backend_pool is None:
+                from django.conf import settings
+
+                pool = BackendPool(
+                    getattr(settings, "OLLAMA_BACKENDS", None) or [settings.OLLAMA_API_URL],
+                    routing=getattr(settings, "OLLAMA_ROUTING", ROUTING_LEAST_OUTSTANDING),
+                    failure_threshold=getattr(settings, "OLLAMA_CIRCUIT_FAILURE_THRESHOLD", 3),
+                    cooldown=getattr(settings, "OLLAMA_CIRCUIT_COOLDOWN", 30),
+                    cold_start_threshold=getattr(settings, "OLLAMA_COLD_START_THRESHOLD", 1.0),
+                )
+                interval = getattr(settings, "OLLAMA_HEALTH_CHECK_INTERVAL", 15)
+                if interval:
+                    pool.start_health_checks(interval)
+                _backend_pool = pool
+    return _backend_pool
+
+
+def get_ollama_client() -> OllamaClient:
+    """
+    Return the process-wide OllamaClient, creating it from Django settings on first use.
+    """
+    global _client
+    if _client is None:
+        backend_pool = get_backend_pool()
+        with _client_lock:
+            if _client is None:
+                from django.conf import settings
+
+                _client = OllamaClient(
+                    backends=[backend.base_url for backend in backend_pool.backends],
+                    pool_size=getattr(settings, "OLLAMA_POOL_SIZE", 10),
+                    timeout=getattr(settings, "OLLAMA_TIMEOUT", 120),
+                    backend_pool=backend_pool,
+                    keep_alive=getattr(settings, "OLLAMA_KEEP_ALIVE", None),
+                    options=get_default_options(),
+                    hedge_policy=HedgePolicy(
+                        quantile=getattr(settings, "OLLAMA_HEDGE_QUANTILE", 0.95),
+                        max_ratio=getattr(settings, "OLLAMA_HEDGE_MAX_RATIO", 0.05),
+                        min_samples=getattr(settings, "OLLAMA_HEDGE_MIN_SAMPLES", 20),
+                    ) if getattr(settings, "OLLAMA_HEDGING", False) else None,
+                )
+    return _client
+
+
+def get_async_ollama_client() -> AsyncOllamaClient:
+    """
+    Return the AsyncOllamaClient for the running event loop, creating it from Django
+    settings on first use.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        from django.conf import settings
+
+        backend_pool = get_backend_pool()
+        client = AsyncOllamaClient(
+            backends=[backend.base_url for backend in backend_pool.backends],
+            pool_size=getattr(settings, "OLLAMA_POOL_SIZE", 10),
+            timeout=getattr(settings, "OLLAMA_TIMEOUT", 120),
+            backend_pool=backend_pool,
+            keep_alive=getattr(settings, "OLLAMA_KEEP_ALIVE", None),
+            options=get_default_options(),
+        )
+        _async_clients[loop] = client
+    return client
@@ -0,0 +1,168 @@
+"""
+Background embedding of chatbot prompts.
+The prompt embedding and the Ollama generation do not depend on each other, so the
+embedding (a Bedrock round-trip with the default backend) starts on a worker thread
+as soon as a request arrives and runs while Ollama generates. Requests only wait briefly (CHATBOT_SEMANTIC_LOOKUP_WAIT)
+for the vector, so a semantic cache hit can still skip the generation.
+
+The finished vector is written to the compact embedding store from the same worker
+thread, so that insert does not add to the request either.
+
+A backend that cannot be built (no AWS region or profile, an unknown
+CHATBOT_EMBEDDING_BACKEND) leaves the request without embeddings, like a failed
+embedding does.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from . import embedding_store
+from .embedding_backends import EMBEDDING_ERRORS, OUTPUT_FLOAT32, get_embedding_backend
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def get_dimensions() -> int:
+    from django.conf import settings
+
+    return getattr(settings, "CHATBOT_EMBEDDING_DIMENSIONS", 1024)
+
+
+def embed_prompt(user_prompt: str) -> Optional[np.ndarray]:
+    """
+    Generate embeddings for a user prompt with the CHATBOT_EMBEDDING_BACKEND backend.
+    Errors are logged and swallowed so the chatbot flow continues without embeddings.
+
+    Returns:
+        The embedding as a read-only float32 array, or None if it could not be generated
+    """
+    try:
+        # A float32 array goes to the semantic cache and the embedding store without conversion
+        embeddings = get_embedding_backend().embed_query(user_prompt, dimensions=get_dimensions(), output=OUTPUT_FLOAT32)
+        logger.info(f"Successfully generated embeddings for user prompt. Vector length: {len(embeddings)}")
+        return embeddings
+    except EMBEDDING_ERRORS as e:
+        logger.error(f"Error generating embeddings: {str(e)}")
+        return None
+
+
+class PendingEmbedding:
+    """
+    A prompt embedding running in the background.
+    Both the sync and the async views wait on the same concurrent.futures.Future.
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor, user_prompt: str, model_id: str, store: bool = True):
+        self.started_at = time.perf_counter()
+        self.seconds: Optional[float] = None
+        # Content-addressed, so the key is known before the vector is; the model is part
+        # of it, so vectors of different backends never stand in for each other
+        self.model_id = model_id
+        self.key = embedding_store.make_key(user_prompt, self.model_id, get_dimensions())
+        self.store = store
+        self._future: Future = executor.submit(self._run, user_prompt, store)
+
+    def _run(self, user_prompt: str, store: bool) -> Optional[np.ndarray]:
+        try:
+            embeddings = embed_prompt(user_prompt)
+        finally:
+            self.seconds = time.perf_counter() - self.started_at
+        if embeddings is not None and store:
+            # Worker threads outlive requests, so recycle stale connections here
+            close_old_connections()
+            embedding_store.store_embedding(user_prompt, embeddings, model_id=self.model_id)
+        return embeddings
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def peek(self, timeout: float) -> Optional[np.ndarray]:
+        """Wait up to timeout seconds; return the vector if it is ready by then, else None."""
+        try:
+            return self._future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return None
+
+    def result(self) -> Optional[np.ndarray]:
+        """Block until the embedding is finished."""
+        return self._future.result()
+
+    async def apeek(self, timeout: float) -> Optional[np.ndarray]:
+        """Async counterpart of peek(); waiting does not block the event loop."""
+        if self._future.done():
+            # wrap_future() only copies the result on the next loop iteration
+            return self._future.result()
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._future)), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aresult(self) -> Optional[np.ndarray]:
+        """Async counterpart of result()."""
+        return await asyncio.wrap_future(self._future)
+
+    @property
+    def milliseconds(self) -> Optional[float]:
+        return round(self.seconds * 1000, 1) if self.seconds is not None else None
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide thread pool prompt embeddings run on."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from django.conf import settings
+
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "CHATBOT_EMBEDDING_WORKERS", 8),
+                    thread_name_prefix="bedrock-embed",
+                )
+    return _executor
+
+
+def start_prompt_embedding(user_prompt: str) -> Optional[PendingEmbedding]:
+    """
+    Start embedding a prompt in the background.
+
+    Returns:
+        The pending embedding, or None if the embedding backend could not be built
+    """
+    from django.conf import settings
+
+    try:
+        backend = get_embedding_backend()
+    except EMBEDDING_ERRORS as e:
+        logger.error(f"Error creating the embedding backend: {str(e)}")
+        return None
+    store = getattr(settings, "CHATBOT_EMBEDDING_STORE_ENABLED", True)
+    return PendingEmbedding(get_executor(), user_prompt, backend.model_id, store=store)
+
+
+async def astart_prompt_embedding(user_prompt: str) -> Optional[PendingEmbedding]:
+    """
+    Async counterpart of start_prompt_embedding(). The first call builds the backend,
+    for Bedrock a boto3 client resolving credentials, so it runs off the event loop.
+    """
+    return await sync_to_async(start_prompt_embedding, thread_sensitive=False)(user_prompt)
+
+
+def get_lookup_wait() -> float:
+    """Seconds a request waits for its embedding before generating without a semantic lookup."""
+    from django.conf import settings
+
+    return getattr(settings, "CHATBOT_SEMANTIC_LOOKUP_WAIT", 0.25)
@@ -0,0 +1,125 @@
+"""
+Exact-match response cache for the chatbot.
+Answers are cached in the Django cache configured by CHATBOT_RESPONSE_CACHE_ALIAS
+(Redis in production), keyed by the model name, the system prompt and a normalized
+version of the user prompt, so "Opening hours?" and "opening  hours" share an entry.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+from typing import Optional, Tuple, Type
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "chatbot:response"
+
+# Errors of a cache backend whose server is down or misbehaving: sockets, the
+# database cache backend, and Redis through django-redis (installed in production)
+CACHE_ERRORS: Tuple[Type[Exception], ...] = (OSError, DatabaseError)
+try:
+    from django_redis.exceptions import ConnectionInterrupted
+    from redis.exceptions import RedisError
+
+    CACHE_ERRORS += (ConnectionInterrupted, RedisError)
+except ImportError:
+    pass
+
+_whitespace_re = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Fold case, punctuation and whitespace so trivially different prompts match.
+
+    Args:
+        prompt: The raw user prompt
+
+    Returns:
+        The normalized prompt
+    """
+    prompt = unicodedata.normalize("NFKC", prompt).casefold()
+    # Replace every Unicode punctuation character with a space
+    prompt = "".join(" " if unicodedata.category(char).startswith("P") else char for char in prompt)
+    return _whitespace_re.sub(" ", prompt).strip()
+
+
+def make_cache_key(model_name: str, system_prompt: str, prompt: str) -> str:
+    """
+    Build the cache key for a prompt.
+    The parts are hashed so arbitrarily long prompts give fixed-size keys.
+    """
+    raw = json.dumps([model_name, system_prompt, normalize_prompt(prompt)])
+    return f"{KEY_PREFIX}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "CHATBOT_RESPONSE_CACHE_ENABLED", True)
+
+
+def get_cache():
+    return caches[getattr(settings, "CHATBOT_RESPONSE_CACHE_ALIAS", "default")]
+
+
+def is_cacheable(response: str) -> bool:
+    """Only cache non-empty answers under the configured size bound."""
+    max_bytes = getattr(settings, "CHATBOT_RESPONSE_CACHE_MAX_ENTRY_BYTES", 64 * 1024)
+    return bool(response) and len(response.encode("utf-8")) <= max_bytes
+
+
+def get_cached_response(model_name: str, system_prompt: str, prompt: str) -> Optional[str]:
+    """Return the cached answer for a prompt, or None on a miss."""
+    if not is_enabled():
+        return None
+    try:
+        return get_cache().get(make_cache_key(model_name, system_prompt, prompt))
+    except CACHE_ERRORS as e:
+        # A cache outage must never break the chatbot
+        logger.warning(f"Response cache lookup failed: {str(e)}")
+        return None
+
+
+def cache_response(model_name: str, system_prompt: str, prompt: str, response: str) -> None:
+    """Store an answer for a prompt with the configured TTL."""
+    if not is_enabled() or not is_cacheable(response):
+        return
+    try:
+        get_cache().set(
+            make_cache_key(model_name, system_prompt, prompt),
+            response,
+            timeout=getattr(settings, "CHATBOT_RESPONSE_CACHE_TTL", 60 * 60 * 24),
+        )
+    except CACHE_ERRORS as e:
+        logger.warning(f"Response cache store failed: {str(e)}")
+
+
+async def aget_cached_response(model_name: str, system_prompt: str, prompt: str) -> Optional[str]:
+    """Async counterpart of get_cached_response."""
+    if not is_enabled():
+        return None
+    try:
+        return await get_cache().aget(make_cache_key(model_name, system_prompt, prompt))
+    except CACHE_ERRORS as e:
+        logger.warning(f"Response cache lookup failed: {str(e)}")
+        return None
+
+
+async def acache_response(model_name: str, system_prompt: str, prompt: str, response: str) -> None:
+    """Async counterpart of cache_response."""
+    if not is_enabled() or not is_cacheable(response):
+        return
+    try:
+        await get_cache().aset(
+            make_cache_key(model_name, system_prompt, prompt),
+            response,
+            timeout=getattr(settings, "CHATBOT_RESPONSE_CACHE_TTL", 60 * 60 * 24),
+        )
+    except CACHE_ERRORS as e:
+        logger.warning(f"Response cache store failed: {str(e)}")
@@ -0,0 +1,324 @@
+"""
+Semantic answer cache for the chatbot.
+Prompts are matched by the cosine similarity of their Titan embeddings, so a
+near-duplicate question ("when do you open?" / "what time do you open") reuses a
+previous answer instead of waiting for another Ollama generation.
+
+Answers expire after CHATBOT_RESPONSE_CACHE_TTL, like the exact-match cache.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from asgiref.sync import sync_to_async
+
+from .embedding_backends import DEFAULT_BACKEND, get_backend_name
+from .response_cache import CACHE_ERRORS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "chatbot:semantic"
+
+
+@dataclass
+class SemanticMatch:
+    response: str
+    prompt: str
+    similarity: float
+
+
+@dataclass
+class _Entry:
+    key: str
+    namespace: str
+    prompt: str
+    response: str
+    latency: float
+
+
+class SemanticCache:
+    """
+    A bounded in-memory vector index with LRU eviction.
+
+    Vectors are kept unit-normalized in one float32 matrix, so a lookup is a
+    single matrix-vector product. Entries are namespaced (model and system prompt)
+    so answers never leak between models.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 2000,
+        threshold: float = 0.92,
+        persistent_cache=None,
+        ttl: Optional[int] = None,
+    ):
+        """
+        Initialize the SemanticCache class.
+
+        Args:
+            capacity: Maximum number of cached answers
+            threshold: Minimum cosine similarity for a hit
+            persistent_cache: Optional Django cache (e.g. Redis) entries are mirrored to
+            ttl: Seconds an answer is served for, from memory and from the persistent cache
+        """
+        self.capacity = capacity
+        self.threshold = threshold
+        self.persistent_cache = persistent_cache
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        # Namespace id of every slot, -1 for free slots
+        self._slot_namespaces = np.full(capacity, -1, dtype=np.int32)
+        # Wall-clock expiry of every slot, so persisted entries keep theirs across processes
+        self._expires_at = np.full(capacity, np.inf)
+        self._namespace_ids: Dict[str, int] = {}
+        self._entries: List[Optional[_Entry]] = [None] * capacity
+        # key -> slot, least recently used first
+        self._lru: "OrderedDict[str, int]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self.lookup_time = 0.0
+
+    @staticmethod
+    def make_key(namespace: str, prompt: str) -> str:
+        return hashlib.sha256(f"{namespace}\0{prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector: Sequence[float], namespace: str) -> Optional[SemanticMatch]:
+        """
+        Find the most similar cached prompt in a namespace.
+
+        Args:
+            vector: Embedding of the new prompt
+            namespace: Namespace the prompt belongs to
+
+        Returns:
+            The best match if its similarity reaches the threshold, otherwise None
+        """
+        start = time.perf_counter()
+        query = self._normalize(vector)
+        with self._lock:
+            match = None
+            namespace_id = self._namespace_ids.get(namespace)
+            if self._matrix is not None and namespace_id is not None and len(query) == self._matrix.shape[1]:
+                similarities = self._matrix @ query
+                # Expired entries are misses; they are overwritten as the LRU reuses their slots
+                similarities[(self._slot_namespaces != namespace_id) | (self._expires_at <= time.time())] = -np.inf
+                slot = int(np.argmax(similarities))
+                similarity = float(similarities[slot])
+                if similarity >= self.threshold:
+                    entry = self._entries[slot]
+                    self._lru.move_to_end(entry.key)
+                    match = SemanticMatch(entry.response, entry.prompt, similarity)
+                    self.hits += 1
+                    self.latency_saved += entry.latency
+
+            if match is None:
+                self.misses += 1
+            self.lookup_time += time.perf_counter() - start
+        return match
+
+    def add(
+        self,
+        vector: Sequence[float],
+        namespace: str,
+        prompt: str,
+        response: str,
+        latency: float = 0.0,
+        persist: bool = True,
+        expires_at: Optional[float] = None,
+    ) -> None:
+        """
+        Cache an answer, evicting the least recently used entry when full.
+
+        Args:
+            vector: Embedding of the prompt
+            namespace: Namespace the prompt belongs to
+            prompt: The prompt text
+            response: The answer to reuse
+            latency: Seconds the answer took to generate, counted as saved on each hit
+            persist: Whether to mirror the entry to the persistent cache
+            expires_at: time.time() the entry expires at (default: ttl from now)
+        """
+        vector = self._normalize(vector)
+        key = self.make_key(namespace, prompt)
+        if expires_at is None:
+            expires_at = time.time() + self.ttl if self.ttl else np.inf
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.capacity, len(vector)), dtype=np.float32)
+            elif len(vector) != self._matrix.shape[1]:
+                logger.warning(f"Ignoring {len(vector)}-dimension vector in a {self._matrix.shape[1]}-dimension semantic cache")
+                return
+
+            if key in self._lru:
+                slot = self._lru[key]
+                self._lru.move_to_end(key)
+            elif len(self._lru) < self.capacity:
+                slot = len(self._lru)
+                self._lru[key] = slot
+            else:
+                _, slot = self._lru.popitem(last=False)
+                self._lru[key] = slot
+
+            namespace_id = self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+            self._matrix[slot] = vector
+            self._slot_namespaces[slot] = namespace_id
+            self._expires_at[slot] = expires_at
+            self._entries[slot] = _Entry(key, namespace, prompt, response, latency)
+
+        if persist and self.persistent_cache is not None:
+            self._persist(key, vector, namespace, prompt, response, latency, expires_at)
+
+    def _slot_key(self, key: str) -> str:
+        # Entries are persisted in a fixed set of slots picked by their key, so
+        # processes write independent keys instead of sharing a read-modify-write
+        # index; an entry only replaces the one that hashed to the same slot.
+        return f"{KEY_PREFIX}:slot:{int(key, 16) % self.capacity}"
+
+    def _persist(self, key, vector, namespace, prompt, response, latency, expires_at) -> None:
+        try:
+            self.persistent_cache.set(self._slot_key(key), {
+                "vector": vector.tobytes(),
+                "namespace": namespace,
+                "prompt": prompt,
+                "response": response,
+                "latency": latency,
+                "expires_at": expires_at,
+            }, timeout=self.ttl)
+        except CACHE_ERRORS as e:
+            # Persistence is best effort; the in-memory index still works
+            logger.warning(f"Failed to persist semantic cache entry: {str(e)}")
+
+    def load(self) -> int:
+        """
+        Warm the in-memory index from the persistent cache.
+
+        Returns:
+            The number of entries loaded
+        """
+        if self.persistent_cache is None:
+            return 0
+        try:
+            stored = self.persistent_cache.get_many([f"{KEY_PREFIX}:slot:{slot}" for slot in range(self.capacity)])
+        except CACHE_ERRORS as e:
+            logger.warning(f"Failed to load semantic cache: {str(e)}")
+            return 0
+
+        now = time.time()
+        loaded = 0
+        for item in stored.values():
+            expires_at = item.get("expires_at")
+            if expires_at is not None and expires_at <= now:
+                continue
+            vector = np.frombuffer(item["vector"], dtype=np.float32)
+            self.add(
+                vector, item["namespace"], item["prompt"], item["response"], item["latency"],
+                persist=False, expires_at=expires_at,
+            )
+            loaded += 1
+        logger.info(f"Loaded {loaded} semantic cache entries")
+        return loaded
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit-rate and latency-saved counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "latency_saved_seconds": round(self.latency_saved, 3),
+                "avg_lookup_ms": round(self.lookup_time / lookups * 1000, 3) if lookups else 0.0,
+            }
+
+
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """
+    Return the process-wide SemanticCache configured from Django settings,
+    or None when it is disabled.
+    """
+    global _semantic_cache
+    from django.conf import settings
+
+    if not getattr(settings, "CHATBOT_SEMANTIC_CACHE_ENABLED", True):
+        return None
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                persistent_cache = None
+                if getattr(settings, "CHATBOT_SEMANTIC_CACHE_PERSIST", False):
+                    from django.core.cache import caches
+
+                    persistent_cache = caches[getattr(settings, "CHATBOT_RESPONSE_CACHE_ALIAS", "default")]
+
+                cache = SemanticCache(
+                    capacity=getattr(settings, "CHATBOT_SEMANTIC_CACHE_CAPACITY", 2000),
+                    threshold=getattr(settings, "CHATBOT_SEMANTIC_CACHE_THRESHOLD", 0.92),
+                    persistent_cache=persistent_cache,
+                    ttl=getattr(settings, "CHATBOT_RESPONSE_CACHE_TTL", None),
+                )
+                cache.load()
+                _semantic_cache = cache
+    return _semantic_cache
+
+
+def make_namespace(model_name: str, system_prompt: str) -> str:
+    # Vectors of different embedding backends cannot be compared; Titan's keep the
+    # namespace they had before backends were selectable, so persisted entries stay valid
+    namespace = f"{model_name}\0{system_prompt}"
+    backend = get_backend_name()
+    return namespace if backend == DEFAULT_BACKEND else f"{namespace}\0{backend}"
+
+
+def lookup_answer(vector: Optional[Sequence[float]], model_name: str, system_prompt: str) -> Optional[SemanticMatch]:
+    """Look up a cached answer for a prompt embedding; None when disabled or missing."""
+    cache = get_semantic_cache()
+    if cache is None or vector is None:
+        return None
+    return cache.lookup(vector, make_namespace(model_name, system_prompt))
+
+
+async def alookup_answer(vector: Optional[Sequence[float]], model_name: str, system_prompt: str) -> Optional[SemanticMatch]:
+    """
+    Async counterpart of lookup_answer(). The first lookup loads the persisted
+    entries, a blocking read of up to capacity keys, so it runs off the event loop.
+    """
+    return await sync_to_async(lookup_answer, thread_sensitive=False)(vector, model_name, system_prompt)
+
+
+def remember_answer(
+    vector: Optional[Sequence[float]],
+    model_name: str,
+    system_prompt: str,
+    prompt: str,
+    response: str,
+    latency: float,
+) -> None:
+    """Add a freshly generated answer to the semantic cache."""
+    cache = get_semantic_cache()
+    if cache is None or vector is None or not response:
+        return
+    cache.add(vector, make_namespace(model_name, system_prompt), prompt, response, latency)
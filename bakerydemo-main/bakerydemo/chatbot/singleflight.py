@@ -0,0 +1,272 @@
+"""
+Single-flight coalescing of identical in-flight chatbot prompts.
+When many users send the same prompt at once, only one generation is sent to
+Ollama; the other requests wait for it and share its result. A follower waits no
+longer than its own deadline, and can turn down a result it should not reuse, such
+as an answer the leader's shorter deadline cut short.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .response_cache import CACHE_ERRORS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "chatbot:flight"
+# Seconds a cross-process result stays published for polling followers
+RESULT_TTL = 10
+
+
+class FlightTimeout(Exception):
+    """A follower's timeout passed before the call it was waiting for finished."""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key.
+
+    Within a process, followers block on the leader's threading.Event. When a
+    Django cache is given (Redis in production), leaders in different processes
+    also take a short-lived lock there with cache.add(), and followers in other
+    processes poll for the result the winning leader publishes.
+    """
+
+    def __init__(self, shared_cache=None, timeout: float = 120, poll_interval: float = 0.05):
+        """
+        Initialize the SingleFlight class.
+
+        Args:
+            shared_cache: Optional Django cache used to coalesce across processes
+            timeout: Longest a follower waits when the caller gives no timeout
+            poll_interval: Seconds between result polls for cross-process followers
+        """
+        self.shared_cache = shared_cache
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[Tuple[int, str], asyncio.Future] = {}
+
+        self.leaders = 0
+        self.followers = 0
+
+    def do(
+        self,
+        key: str,
+        func: Callable[[], Any],
+        timeout: Optional[float] = None,
+        reusable: Optional[Callable[[Any], bool]] = None,
+    ) -> Tuple[Any, bool]:
+        """
+        Run func once for all concurrent callers with the same key.
+
+        Args:
+            key: Identifies identical work (e.g. the response cache key)
+            func: The call to make; its exceptions are re-raised for every waiter
+            timeout: Longest this caller waits as a follower (default: the SingleFlight's timeout)
+            reusable: Whether this caller may take another request's result; when it
+                returns False the caller runs func itself
+
+        Returns:
+            A (result, shared) tuple; shared is True if another request did the work
+
+        Raises:
+            FlightTimeout: If the timeout passed while waiting for another request
+        """
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise FlightTimeout(f"Timed out after {timeout:.1f}s waiting for in-flight call {key}")
+            if call.error is not None:
+                raise call.error
+            return self._share(key, call.result, func, reusable)
+
+        try:
+            call.result, shared = self._run_leader(key, func, timeout, reusable)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    @staticmethod
+    def _share(key: str, result: Any, func: Callable[[], Any], reusable: Optional[Callable[[Any], bool]]) -> Tuple[Any, bool]:
+        if reusable is None or reusable(result):
+            return result, True
+        logger.info(f"Result of in-flight call {key} cannot be reused; running it again")
+        return func(), False
+
+    def _run_leader(
+        self, key: str, func: Callable[[], Any], timeout: float, reusable: Optional[Callable[[Any], bool]]
+    ) -> Tuple[Any, bool]:
+        if self.shared_cache is None:
+            return func(), False
+
+        lock_key = f"{KEY_PREFIX}:lock:{key}"
+        result_key = f"{KEY_PREFIX}:result:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        try:
+            while not self.shared_cache.add(lock_key, token, timeout=int(self.timeout) + 1):
+                # Another process is generating this prompt; wait for its result
+                published = self.shared_cache.get(result_key)
+                if published is not None:
+                    return self._share(key, published["result"], func, reusable)
+                if time.monotonic() >= deadline:
+                    raise FlightTimeout(f"Timed out after {timeout:.1f}s waiting for cross-process call {key}")
+                time.sleep(self.poll_interval)
+        except CACHE_ERRORS as e:
+            # Never fail a chat because the lock backend is unavailable
+            logger.warning(f"Cross-process single-flight unavailable: {str(e)}")
+            return func(), False
+
+        try:
+            # The previous holder may have released the lock just after publishing
+            published = self.shared_cache.get(result_key)
+            if published is not None:
+                return self._share(key, published["result"], func, reusable)
+            result = func()
+            try:
+                # Published briefly, just long enough for polling followers to pick it up
+                self.shared_cache.set(result_key, {"result": result}, timeout=RESULT_TTL)
+            except CACHE_ERRORS as e:
+                logger.warning(f"Failed to publish single-flight result: {str(e)}")
+            return result, False
+        finally:
+            try:
+                if self.shared_cache.get(lock_key) == token:
+                    self.shared_cache.delete(lock_key)
+            except CACHE_ERRORS as e:
+                logger.warning(f"Failed to release single-flight lock: {str(e)}")
+
+    async def ado(
+        self,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+        reusable: Optional[Callable[[Any], bool]] = None,
+    ) -> Tuple[Any, bool]:
+        """
+        Async counterpart of do(), coalescing coroutines on the running event loop.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        flight_key = (id(asyncio.get_running_loop()), key)
+        future = self._async_calls.get(flight_key)
+        if future is not None:
+            self.followers += 1
+            try:
+                # shield() so a cancelled follower does not cancel the shared call
+                result = await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                raise FlightTimeout(f"Timed out after {timeout:.1f}s waiting for in-flight call {key}") from None
+            except asyncio.CancelledError:
+                # The leader was cancelled (its client disconnected), not this follower:
+                # run the call for this request instead of failing it
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                logger.info(f"Leader of in-flight call {key} was cancelled; running it again")
+                return await func(), False
+            if reusable is None or reusable(result):
+                return result, True
+            logger.info(f"Result of in-flight call {key} cannot be reused; running it again")
+            return await func(), False
+
+        self.leaders += 1
+        future = self._async_calls[flight_key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func()
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting
+            future.exception()
+            raise
+        finally:
+            del self._async_calls[flight_key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"leaders": self.leaders, "followers": self.followers}
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """
+    Return the process-wide SingleFlight configured from Django settings,
+    or None when coalescing is disabled.
+    """
+    global _single_flight
+    from django.conf import settings
+
+    if not getattr(settings, "CHATBOT_SINGLE_FLIGHT_ENABLED", True):
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                shared_cache = None
+                if getattr(settings, "CHATBOT_SINGLE_FLIGHT_DISTRIBUTED", False):
+                    from django.core.cache import caches
+
+                    shared_cache = caches[getattr(settings, "CHATBOT_RESPONSE_CACHE_ALIAS", "default")]
+                _single_flight = SingleFlight(
+                    shared_cache=shared_cache,
+                    timeout=getattr(settings, "OLLAMA_TIMEOUT", 120),
+                )
+    return _single_flight
+
+
+def coalesce(
+    key: str,
+    func: Callable[[], Any],
+    timeout: Optional[float] = None,
+    reusable: Optional[Callable[[Any], bool]] = None,
+) -> Tuple[Any, bool]:
+    """Run func through the configured SingleFlight, or directly when disabled; see SingleFlight.do()."""
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return func(), False
+    return single_flight.do(key, func, timeout, reusable)
+
+
+async def acoalesce(
+    key: str,
+    func: Callable[[], Awaitable[Any]],
+    timeout: Optional[float] = None,
+    reusable: Optional[Callable[[Any], bool]] = None,
+) -> Tuple[Any, bool]:
+    """Async counterpart of coalesce()."""
+    single_flight = get_single_flight()
+    if single_flight is None:
+        return await func(), False
+    return await single_flight.ado(key, func, timeout, reusable)
@@ -1,3 +1,1614 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipIf
 
-# Create your tests here.
+import numpy as np
+import requests
+from botocore.exceptions import NoRegionError
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    batch,
+    context_store,
+    embedding_backends,
+    embedding_store,
+    ollama_client,
+    prompt_embeddings,
+    response_cache,
+    semantic_cache,
+)
+from .admission import (
+    AdmissionController,
+    QueueFull,
+    QueueTimeout,
+    overloaded_response,
+)
+from .batch import BatchRunner, get_batch_concurrency, parse_batch
+from .bedrock_embeddings import OUTPUT_FLOAT32, BedrockEmbeddings, TokenBucket
+from .chatlog_writer import ChatLogWriter
+from .context_store import ContextStore
+from .conversation import (
+    RollingSummarizer,
+    Turn,
+    attach_context,
+    build_conversation,
+    estimate_tokens,
+    load_history,
+)
+from .deadline import Deadline, is_complete
+from .embedding_backends import (
+    HashingEmbeddings,
+    OllamaEmbeddings,
+    create_embedding_backend,
+)
+from .embedding_cache import DatabaseTier, EmbeddingCache, make_key
+from .model_keeper import ModelKeeper, start_model_keeper
+from .models import ChatLog, PromptEmbedding
+from .ollama_client import Backend, BackendPool, HedgePolicy, OllamaClient
+from .semantic_cache import SemanticCache
+from .singleflight import FlightTimeout, SingleFlight
+
+try:
+    from bakerydemo import main as rag_service
+except ImportError:
+    # The RAG service needs FastAPI, LangChain and FAISS, which the Django site does not
+    rag_service = None
+
+
+class NormalizePromptTests(SimpleTestCase):
+    def test_folds_case_punctuation_and_whitespace(self):
+        self.assertEqual(response_cache.normalize_prompt("  Opening   HOURS?! "), "opening hours")
+        self.assertEqual(
+            response_cache.normalize_prompt("Opening hours?"), response_cache.normalize_prompt("opening\thours")
+        )
+
+    def test_normalizes_unicode(self):
+        # NFKC folds the full-width letters, casefold() the German sharp s
+        self.assertEqual(response_cache.normalize_prompt("ＳＴＲＡẞE"), "strasse")
+        self.assertEqual(response_cache.normalize_prompt("«Brot» — bitte…"), "brot bitte")
+
+    def test_keeps_words_apart(self):
+        self.assertNotEqual(response_cache.normalize_prompt("sour dough"), response_cache.normalize_prompt("sourdough"))
+
+
+class MakeCacheKeyTests(SimpleTestCase):
+    def test_equal_for_trivially_different_prompts(self):
+        self.assertEqual(
+            response_cache.make_cache_key("model", "system", "Opening hours?"),
+            response_cache.make_cache_key("model", "system", "opening  hours"),
+        )
+
+    def test_depends_on_model_and_system_prompt(self):
+        key = response_cache.make_cache_key("model", "system", "hours")
+        self.assertNotEqual(key, response_cache.make_cache_key("other", "system", "hours"))
+        self.assertNotEqual(key, response_cache.make_cache_key("model", "other", "hours"))
+
+    def test_fixed_size_key(self):
+        key = response_cache.make_cache_key("model", "system", "bread " * 10000)
+        self.assertTrue(key.startswith(f"{response_cache.KEY_PREFIX}:"))
+        self.assertEqual(len(key), len(response_cache.KEY_PREFIX) + 1 + 64)
+
+    def test_parts_cannot_run_into_each_other(self):
+        self.assertNotEqual(
+            response_cache.make_cache_key("ab", "c", "hours"), response_cache.make_cache_key("a", "bc", "hours")
+        )
+
+
+@override_settings(
+    CACHES={"chatbot": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "tests"}},
+    CHATBOT_RESPONSE_CACHE_ALIAS="chatbot",
+    CHATBOT_RESPONSE_CACHE_ENABLED=True,
+)
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        response_cache.get_cache().clear()
+
+    def test_round_trip(self):
+        response_cache.cache_response("model", "system", "Opening hours?", "9 to 5")
+        self.assertEqual(response_cache.get_cached_response("model", "system", "opening hours"), "9 to 5")
+        self.assertIsNone(response_cache.get_cached_response("model", "system", "closing hours"))
+
+    def test_skips_empty_and_oversized_answers(self):
+        response_cache.cache_response("model", "system", "empty", "")
+        with override_settings(CHATBOT_RESPONSE_CACHE_MAX_ENTRY_BYTES=4):
+            response_cache.cache_response("model", "system", "long", "too long")
+        self.assertIsNone(response_cache.get_cached_response("model", "system", "empty"))
+        self.assertIsNone(response_cache.get_cached_response("model", "system", "long"))
+
+    def test_cache_outage_is_a_miss(self):
+        broken = mock.Mock(**{"get.side_effect": ConnectionRefusedError(), "set.side_effect": TimeoutError()})
+        with mock.patch.object(response_cache, "get_cache", return_value=broken):
+            self.assertIsNone(response_cache.get_cached_response("model", "system", "hours"))
+            response_cache.cache_response("model", "system", "hours", "9 to 5")
+
+    def test_programming_errors_are_not_swallowed(self):
+        broken = mock.Mock(**{"get.side_effect": TypeError("bad key")})
+        with mock.patch.object(response_cache, "get_cache", return_value=broken):
+            with self.assertRaises(TypeError):
+                response_cache.get_cached_response("model", "system", "hours")
+
+
+class SemanticCachePersistenceTests(SimpleTestCase):
+    def setUp(self):
+        self.store = LocMemCache("semantic-tests", {})
+        self.store.clear()
+
+    def test_processes_do_not_overwrite_each_other(self):
+        # Two workers sharing one cache each persist an answer
+        first = SemanticCache(capacity=64, persistent_cache=self.store)
+        second = SemanticCache(capacity=64, persistent_cache=self.store)
+        first.add([1.0, 0.0], "ns", "opening hours", "9 to 5")
+        second.add([0.0, 1.0], "ns", "gluten free", "Yes, the rye")
+
+        warmed = SemanticCache(capacity=64, persistent_cache=self.store)
+        self.assertEqual(warmed.load(), 2)
+        self.assertEqual(warmed.lookup([1.0, 0.0], "ns").response, "9 to 5")
+        self.assertEqual(warmed.lookup([0.0, 1.0], "ns").response, "Yes, the rye")
+
+    def test_cache_outage_keeps_the_memory_index(self):
+        broken = mock.Mock(**{"set.side_effect": ConnectionRefusedError(), "get_many.side_effect": TimeoutError()})
+        cache = SemanticCache(capacity=8, persistent_cache=broken)
+        cache.add([1.0, 0.0], "ns", "opening hours", "9 to 5")
+        self.assertEqual(cache.lookup([1.0, 0.0], "ns").response, "9 to 5")
+        self.assertEqual(cache.load(), 0)
+
+    def test_answers_expire_after_the_ttl(self):
+        cache = SemanticCache(capacity=8, ttl=60, persistent_cache=self.store)
+        with mock.patch("time.time", return_value=1000.0):
+            cache.add([1.0, 0.0], "ns", "opening hours", "9 to 5")
+        with mock.patch("time.time", return_value=1059.0):
+            self.assertEqual(cache.lookup([1.0, 0.0], "ns").response, "9 to 5")
+            # A restarted worker keeps the entry's original expiry
+            warmed = SemanticCache(capacity=8, ttl=60, persistent_cache=self.store)
+            self.assertEqual(warmed.load(), 1)
+        with mock.patch("time.time", return_value=1061.0):
+            self.assertIsNone(cache.lookup([1.0, 0.0], "ns"))
+            self.assertIsNone(warmed.lookup([1.0, 0.0], "ns"))
+            self.assertEqual(SemanticCache(capacity=8, ttl=60, persistent_cache=self.store).load(), 0)
+
+    def test_async_lookup_runs_off_the_event_loop(self):
+        threads = []
+
+        def lookup_answer(vector, model_name, system_prompt):
+            threads.append(threading.current_thread())
+
+        async def lookup():
+            with mock.patch.object(semantic_cache, "lookup_answer", lookup_answer):
+                await semantic_cache.alookup_answer([1.0, 0.0], "model", "system")
+            return threading.current_thread()
+
+        self.assertIsNot(asyncio.run(lookup()), threads[0])
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def slow_call(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return "answer"
+
+    def run_concurrently(self, flight, func, count=4):
+        """Call flight.do() from count threads once the leader has started."""
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.do("key", func))
+            except ConnectionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        threads[0].start()
+        self.started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        # Let the followers queue up behind the leader before it finishes
+        while flight.followers < count - 1:
+            threading.Event().wait(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def test_followers_share_the_leaders_result(self):
+        flight = SingleFlight()
+        results, errors = self.run_concurrently(flight, self.slow_call)
+        self.assertEqual(errors, [])
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(results), [("answer", False)] + [("answer", True)] * 3)
+        self.assertEqual(flight.stats(), {"leaders": 1, "followers": 3})
+
+    def test_leader_error_reaches_every_follower(self):
+        def failing_call():
+            self.slow_call()
+            raise ConnectionError("model down")
+
+        results, errors = self.run_concurrently(SingleFlight(), failing_call)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(all(isinstance(e, ConnectionError) for e in errors))
+        self.assertEqual(self.calls, 1)
+
+    def test_finished_calls_are_not_reused(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do("key", lambda: 1), (1, False))
+        self.assertEqual(flight.do("key", lambda: 2), (2, False))
+
+    def test_cross_process_follower_polls_for_the_result(self):
+        shared = LocMemCache("single-flight-tests", {})
+        shared.clear()
+        # Two processes, each with its own SingleFlight over the same cache
+        leader, follower = SingleFlight(shared, poll_interval=0.01), SingleFlight(shared, poll_interval=0.01)
+        thread = threading.Thread(target=lambda: leader.do("key", self.slow_call))
+        thread.start()
+        self.started.wait(5)
+        threading.Timer(0.05, self.release.set).start()
+
+        self.assertEqual(follower.do("key", lambda: "second generation"), ("answer", True))
+        thread.join(5)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNone(shared.get("chatbot:flight:lock:key"))
+
+    def test_follower_waits_no_longer_than_its_timeout(self):
+        flight = SingleFlight(timeout=120)
+        thread = threading.Thread(target=lambda: flight.do("key", self.slow_call))
+        thread.start()
+        self.started.wait(5)
+        with self.assertRaises(FlightTimeout):
+            flight.do("key", lambda: "second generation", timeout=0.01)
+        self.release.set()
+        thread.join(5)
+
+    def test_cross_process_follower_waits_no_longer_than_its_timeout(self):
+        shared = LocMemCache("single-flight-tests", {})
+        shared.clear()
+        leader, follower = SingleFlight(shared, poll_interval=0.01), SingleFlight(shared, poll_interval=0.01)
+        thread = threading.Thread(target=lambda: leader.do("key", self.slow_call))
+        thread.start()
+        self.started.wait(5)
+        with self.assertRaises(FlightTimeout):
+            follower.do("key", lambda: "second generation", timeout=0.05)
+        self.release.set()
+        thread.join(5)
+
+    def test_follower_runs_the_call_for_a_result_it_cannot_reuse(self):
+        flight = SingleFlight()
+        results = []
+
+        def truncated_call():
+            self.slow_call()
+            return {"response": "Sourdough is", "truncated": True}
+
+        thread = threading.Thread(target=lambda: results.append(flight.do("key", truncated_call)))
+        thread.start()
+        self.started.wait(5)
+        follower = threading.Thread(
+            target=lambda: results.append(flight.do("key", lambda: {"response": "Sourdough is bread."}, reusable=is_complete))
+        )
+        follower.start()
+        while flight.followers < 1:
+            threading.Event().wait(0.001)
+        self.release.set()
+        thread.join(5)
+        follower.join(5)
+        self.assertIn(({"response": "Sourdough is bread."}, False), results)
+        self.assertIn(({"response": "Sourdough is", "truncated": True}, False), results)
+
+    def test_deadline_takes_a_partial_answer_only_when_out_of_time(self):
+        partial = {"response": "Sourdough is", "truncated": True}
+        self.assertTrue(Deadline(10).can_reuse({"response": "Sourdough is bread.", "done_reason": "stop"}))
+        self.assertFalse(Deadline(10).can_reuse(partial))
+        self.assertFalse(Deadline(10).can_reuse({"response": "Sourdough", "done_reason": "length"}))
+        self.assertTrue(Deadline(1, reserve=1).can_reuse(partial))
+
+    def test_lock_backend_outage_runs_the_call(self):
+        broken = mock.Mock(**{"add.side_effect": ConnectionRefusedError()})
+        self.assertEqual(SingleFlight(broken).do("key", lambda: "answer"), ("answer", False))
+
+    def test_async_followers_share_the_result(self):
+        async def scenario():
+            flight = SingleFlight()
+            release = asyncio.Event()
+
+            async def call():
+                self.calls += 1
+                await release.wait()
+                return "answer"
+
+            tasks = [asyncio.ensure_future(flight.ado("key", call)) for _ in range(3)]
+            await asyncio.sleep(0)
+            release.set()
+            return await asyncio.gather(*tasks)
+
+        results = asyncio.run(scenario())
+        self.assertEqual(results, [("answer", False), ("answer", True), ("answer", True)])
+        self.assertEqual(self.calls, 1)
+
+    def test_async_follower_waits_no_longer_than_its_timeout(self):
+        async def scenario():
+            flight = SingleFlight()
+            release = asyncio.Event()
+
+            async def call():
+                await release.wait()
+                return "answer"
+
+            leader = asyncio.ensure_future(flight.ado("key", call))
+            await asyncio.sleep(0)
+            with self.assertRaises(FlightTimeout):
+                await flight.ado("key", call, timeout=0.01)
+            release.set()
+            return await leader
+
+        self.assertEqual(asyncio.run(scenario()), ("answer", False))
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def queue_waiter(self, controller, order, name):
+        """Start a thread that takes a slot, records its turn and frees the slot."""
+
+        def run():
+            with controller.slot(timeout=5):
+                order.append(name)
+
+        thread = threading.Thread(target=run)
+        depth = len(controller._queue)
+        thread.start()
+        while len(controller._queue) == depth:
+            threading.Event().wait(0.001)
+        return thread
+
+    def test_released_slots_go_to_the_oldest_waiter(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=8)
+        controller.acquire()
+        order = []
+        threads = [self.queue_waiter(controller, order, name) for name in "abc"]
+        controller.release()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ["a", "b", "c"])
+        self.assertEqual(controller.active, 0)
+        self.assertEqual(controller.stats()["max_queue_depth"], 3)
+
+    def test_new_requests_do_not_overtake_the_queue(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=8)
+        controller.acquire()
+        thread = threading.Thread(target=controller.acquire, args=(5,))
+        thread.start()
+        while not controller._queue:
+            threading.Event().wait(0.001)
+        # The slot is handed to the waiter, even before its thread wakes up
+        controller.release()
+        with self.assertRaises(QueueTimeout):
+            controller.acquire(timeout=0)
+        thread.join(5)
+        self.assertEqual(controller.active, 1)
+
+    def test_full_queue_is_rejected_with_429(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=1)
+        controller.acquire()
+        thread = self.queue_waiter(controller, [], "queued")
+        with self.assertRaises(QueueFull) as raised:
+            controller.acquire(timeout=5)
+        controller.release()
+        thread.join(5)
+
+        response = overloaded_response(raised.exception)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], str(raised.exception.retry_after))
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        self.assertEqual(controller.stats()["rejected"], 1)
+
+    def test_queue_deadline_is_rejected_with_503(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=4)
+        controller.acquire()
+        with self.assertRaises(QueueTimeout) as raised:
+            controller.acquire(timeout=0.01)
+
+        response = overloaded_response(raised.exception)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        # The request left the queue, so releasing frees the slot
+        controller.release()
+        self.assertEqual((controller.active, controller.stats()["queue_depth"]), (0, 0))
+        self.assertEqual(controller.timed_out, 1)
+
+    def test_async_waiters_share_the_queue(self):
+        async def scenario():
+            controller = AdmissionController(max_concurrent=1, max_queue=4)
+            await controller.aacquire()
+            order = []
+
+            async def wait(name):
+                async with controller.aslot(timeout=5):
+                    order.append(name)
+
+            tasks = [asyncio.ensure_future(wait(name)) for name in "ab"]
+            await asyncio.sleep(0.01)
+            controller.release()
+            await asyncio.gather(*tasks)
+            return order, controller.active
+
+        self.assertEqual(asyncio.run(scenario()), (["a", "b"], 0))
+
+    def test_cancelled_async_waiter_gives_up_its_slot(self):
+        async def scenario():
+            controller = AdmissionController(max_concurrent=1, max_queue=4)
+            await controller.aacquire()
+            task = asyncio.ensure_future(controller.aacquire(timeout=5))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            controller.release()
+            return controller.active, controller.stats()["queue_depth"]
+
+        self.assertEqual(asyncio.run(scenario()), (0, 0))
+
+
+class BackendPoolTests(SimpleTestCase):
+    def record_failures(self, pool, backend, times=1):
+        for _ in range(times):
+            pool.acquire()
+            pool.release(backend, failed=True)
+
+    def test_repeated_failures_open_the_circuit(self):
+        pool = BackendPool(["http://a:11434", "http://b:11434"], failure_threshold=3)
+        a, b = pool.backends
+        self.record_failures(pool, a, 2)
+        self.assertEqual(a.state, Backend.CLOSED)
+        self.record_failures(pool, a)
+        self.assertEqual(a.state, Backend.OPEN)
+        # An open backend is skipped even though it is otherwise the better choice
+        b.outstanding = 5
+        self.assertIs(pool.acquire(), b)
+
+    def test_success_resets_the_failure_count(self):
+        pool = BackendPool(["http://a:11434"], failure_threshold=2)
+        (a,) = pool.backends
+        self.record_failures(pool, a)
+        pool.release(pool.acquire(), latency=0.1)
+        self.record_failures(pool, a)
+        self.assertEqual(a.state, Backend.CLOSED)
+
+    def test_half_open_backend_gets_a_single_trial(self):
+        pool = BackendPool(["http://a:11434", "http://b:11434"], failure_threshold=1, cooldown=30)
+        a, b = pool.backends
+        self.record_failures(pool, a)
+        a.opened_at -= 31
+        b.outstanding = 5
+        self.assertIs(pool.acquire(), a)
+        self.assertEqual(a.state, Backend.HALF_OPEN)
+        # Only one trial request at a time
+        self.assertIs(pool.acquire(), b)
+        pool.release(a, latency=0.1)
+        self.assertEqual(a.state, Backend.CLOSED)
+
+    def test_failed_trial_reopens_the_circuit(self):
+        pool = BackendPool(["http://a:11434", "http://b:11434"], failure_threshold=3, cooldown=30)
+        a, _ = pool.backends
+        self.record_failures(pool, a, 3)
+        a.opened_at -= 31
+        pool.backends[1].outstanding = 5
+        self.assertIs(pool.acquire(), a)
+        pool.release(a, failed=True)
+        self.assertEqual(a.state, Backend.OPEN)
+        self.assertNotIn(a, [pool.acquire() for _ in range(3)])
+
+    def test_fails_open_when_every_backend_is_down(self):
+        pool = BackendPool(["http://a:11434"], failure_threshold=1)
+        (a,) = pool.backends
+        self.record_failures(pool, a)
+        self.assertIs(pool.acquire(), a)
+        self.assertIsNone(pool.try_acquire())
+
+
+class FakeClock:
+    """Stands in for the time module: sleep() only moves monotonic() forward."""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("bakerydemo.chatbot.bedrock_embeddings.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_acquires_are_paced_at_the_rate_after_the_burst(self):
+        bucket = TokenBucket(rate=8, burst=2)
+        for _ in range(2):
+            bucket.acquire()
+        self.assertEqual(self.clock.now, 100.0)
+        for _ in range(4):
+            bucket.acquire()
+        self.assertEqual(self.clock.now, 100.5)
+
+    def test_throttling_halves_the_rate_once_per_second(self):
+        bucket = TokenBucket(rate=16)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 8)
+        self.assertLessEqual(bucket.tokens, 0)
+        # Requests throttled together count as one signal
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 8)
+        self.assertEqual(bucket.throttles, 2)
+        self.clock.sleep(1.0)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 4)
+
+    def test_throttling_stops_at_min_rate(self):
+        bucket = TokenBucket(rate=16, min_rate=5)
+        for _ in range(5):
+            bucket.throttled()
+            self.clock.sleep(1.0)
+        self.assertEqual(bucket.rate, 5)
+
+    def test_successes_grow_the_rate_back_to_the_configured_rate(self):
+        bucket = TokenBucket(rate=20)
+        bucket.throttled()
+        self.assertEqual(bucket.rate, 10)
+        bucket.succeeded()
+        self.assertAlmostEqual(bucket.rate, 10.1)
+        for _ in range(1000):
+            bucket.succeeded()
+        self.assertEqual(bucket.rate, 20)
+
+
+class HedgePolicyTests(SimpleTestCase):
+    def test_no_hedging_before_enough_samples(self):
+        policy = HedgePolicy(min_samples=3, max_ratio=1.0)
+        policy.observe(0.2)
+        policy.observe(0.2)
+        self.assertIsNone(policy.delay())
+        policy.observe(0.2)
+        self.assertEqual(policy.delay(), 0.2)
+
+    def test_delay_is_the_quantile_of_first_token_times(self):
+        policy = HedgePolicy(quantile=0.95, min_samples=1, max_ratio=1.0, min_delay=0.05)
+        for n in range(1, 101):
+            policy.observe(n / 100)
+        self.assertEqual(policy.delay(), 0.95)
+
+        fast = HedgePolicy(min_samples=1, max_ratio=1.0, min_delay=0.05)
+        fast.observe(0.001)
+        self.assertEqual(fast.delay(), 0.05)
+
+    def test_hedges_are_capped_at_max_ratio_of_streams(self):
+        policy = HedgePolicy(min_samples=1, max_ratio=0.25)
+        policy.observe(0.1)
+        hedges = 0
+        for _ in range(20):
+            if policy.delay() is not None and policy.allow():
+                hedges += 1
+        self.assertEqual(hedges, 5)
+        self.assertLessEqual(policy.stats()["hedged"], 0.25 * policy.stats()["streams"])
+
+
+class HedgedStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.policy = HedgePolicy(min_samples=1, max_ratio=1.0, min_delay=0.05)
+        self.policy.observe(0.05)
+        self.client = OllamaClient(["http://slow:11434", "http://fast:11434"], hedge_policy=self.policy)
+        self.addCleanup(self.client.close)
+        self.slow, self.fast = self.client.pool.backends
+        self.cancelled = []
+
+    def fake_stream(self, slow_delay):
+        """Stand in for OllamaClient._stream; the slow backend's first chunk comes after slow_delay."""
+
+        def stream(path, payload, timeout=None, backend=None, attempt=None):
+            try:
+                if backend is self.slow:
+                    until = time.monotonic() + slow_delay
+                    while not attempt.cancelled and time.monotonic() < until:
+                        time.sleep(0.005)
+                    if attempt.cancelled:
+                        self.cancelled.append(backend)
+                        return
+                yield {"message": {"content": f"from {backend.base_url}"}}
+                yield {"done": True}
+            finally:
+                self.client.pool.release(backend)
+
+        return stream
+
+    def test_late_first_token_is_hedged_on_another_backend(self):
+        with mock.patch.object(self.client, "_stream", side_effect=self.fake_stream(5.0)):
+            chunks = list(self.client.chat_stream({"model": "m", "messages": []}, hedge=True))
+        self.assertEqual(chunks, [{"message": {"content": "from http://fast:11434"}}, {"done": True}])
+        self.assertEqual(self.policy.stats()["hedges_won"], 1)
+        # The losing copy notices the cancellation on its own thread
+        until = time.monotonic() + 1
+        while not self.cancelled and time.monotonic() < until:
+            time.sleep(0.005)
+        self.assertEqual(self.cancelled, [self.slow])
+
+    def test_prompt_first_token_is_not_hedged(self):
+        with mock.patch.object(self.client, "_stream", side_effect=self.fake_stream(0.0)):
+            chunks = list(self.client.chat_stream({"model": "m", "messages": []}, hedge=True))
+        self.assertEqual(chunks[0], {"message": {"content": "from http://slow:11434"}})
+        self.assertEqual(self.policy.stats()["hedged"], 0)
+
+
+class OllamaClientRetryTests(SimpleTestCase):
+    def make_client(self, urls):
+        client = OllamaClient(urls)
+        self.addCleanup(client.close)
+        return client
+
+    def answer(self, body):
+        response = mock.Mock(**{"json.return_value": body})
+        response.raise_for_status.return_value = None
+        return response
+
+    def test_unreachable_backend_is_retried_on_another(self):
+        client = self.make_client(["http://a:11434", "http://b:11434"])
+        calls = []
+
+        def request(method, url, **kwargs):
+            calls.append(url)
+            if url.startswith("http://a:11434"):
+                raise requests.exceptions.ConnectionError("refused")
+            return self.answer({"response": "hello"})
+
+        with mock.patch.object(client.session, "request", side_effect=request):
+            self.assertEqual(client.post("/api/generate", {"prompt": "hi"}), {"response": "hello"})
+        self.assertEqual(calls, ["http://a:11434/api/generate", "http://b:11434/api/generate"])
+        a, b = client.pool.backends
+        self.assertEqual((a.failures, a.outstanding, b.failures, b.outstanding), (1, 0, 0, 0))
+
+    def test_gives_up_after_one_retry(self):
+        client = self.make_client(["http://a:11434", "http://b:11434", "http://c:11434"])
+        error = requests.exceptions.ConnectionError("refused")
+        with mock.patch.object(client.session, "request", side_effect=error) as request:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.post("/api/generate", {"prompt": "hi"})
+        self.assertEqual(request.call_count, 2)
+
+    def test_http_errors_are_not_retried(self):
+        client = self.make_client(["http://a:11434", "http://b:11434"])
+        response = mock.Mock(status_code=404)
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError("not found", response=response)
+        with mock.patch.object(client.session, "request", return_value=response) as request:
+            with self.assertRaises(requests.exceptions.HTTPError):
+                client.post("/api/generate", {"model": "missing"})
+        self.assertEqual(request.call_count, 1)
+        # A 4xx is the request's fault, not the backend's
+        self.assertEqual(sum(backend.failures for backend in client.pool.backends), 0)
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a canned generation, recording the client port of each request."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.ports.append(self.client_address[1])
+        body = json.dumps({"response": "Fresh sourdough daily.", "done": True}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OllamaClientPoolingTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllamaHandler)
+        self.server.ports = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def test_requests_reuse_a_keep_alive_connection(self):
+        client = OllamaClient(self.url)
+        self.addCleanup(client.close)
+        for _ in range(3):
+            self.assertEqual(client.generate({"prompt": "hours?"})["response"], "Fresh sourdough daily.")
+        self.assertEqual(len(self.server.ports), 3)
+        self.assertEqual(len(set(self.server.ports)), 1)
+
+    def test_connection_pool_is_sized_from_pool_size(self):
+        client = OllamaClient(self.url, pool_size=3)
+        self.addCleanup(client.close)
+        adapter = client.session.get_adapter(self.url)
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    @override_settings(OLLAMA_HEALTH_CHECK_INTERVAL=0, OLLAMA_POOL_SIZE=5, OLLAMA_TIMEOUT=7)
+    def test_process_wide_client_is_shared(self):
+        with override_settings(OLLAMA_BACKENDS=[self.url]), mock.patch.object(ollama_client, "_client", None):
+            with mock.patch.object(ollama_client, "_backend_pool", None):
+                client = ollama_client.get_ollama_client()
+                self.addCleanup(client.close)
+                self.assertIs(ollama_client.get_ollama_client(), client)
+        self.assertEqual((client.pool_size, client.timeout), (5, 7))
+        self.assertEqual([backend.base_url for backend in client.pool.backends], [self.url])
+
+
+class FakeOllamaSession:
+    """Stands in for the keeper's requests.Session: /api/ps lists `loaded`, /api/generate loads a model."""
+
+    def __init__(self, loaded=(), load_duration=3e9):
+        self.loaded = list(loaded)
+        self.load_duration = load_duration
+        self.payloads = []
+        self.down = False
+
+    def _response(self, body):
+        response = mock.Mock()
+        response.json.return_value = body
+        return response
+
+    def get(self, url, timeout=None):
+        if self.down:
+            raise requests.exceptions.ConnectionError("refused")
+        return self._response({"models": [{"name": name, "expires_at": "later"} for name in self.loaded]})
+
+    def post(self, url, json=None, timeout=None):
+        self.payloads.append(json)
+        was_loaded = json["model"] in self.loaded
+        self.loaded.append(json["model"])
+        return self._response({"load_duration": 0 if was_loaded else self.load_duration})
+
+
+class ModelKeeperTests(SimpleTestCase):
+    def keeper(self, session, **kwargs):
+        keeper = ModelKeeper(BackendPool("http://ollama:11434"), **kwargs)
+        keeper.session = session
+        return keeper
+
+    def test_warm_up_loads_missing_models(self):
+        session = FakeOllamaSession(loaded=["llama3:latest"])
+        keeper = self.keeper(session, models=["llama3", "deepseek-bakery-expert"], options={"num_ctx": 4096})
+        keeper.run_once()
+        self.assertEqual([payload["model"] for payload in session.payloads], ["llama3", "deepseek-bakery-expert"])
+        self.assertEqual(
+            session.payloads[0], {"model": "llama3", "keep_alive": "30m", "stream": False, "options": {"num_ctx": 4096}}
+        )
+        stats = keeper.stats()
+        self.assertEqual((stats["rounds"], stats["preloads"], stats["loads"], stats["unloads"]), (1, 2, 1, 0))
+        self.assertEqual(
+            [(event["model"], event["event"], event["load_ms"]) for event in stats["events"]],
+            [("deepseek-bakery-expert", "load", 3000.0)],
+        )
+
+        # Both models are resident now, so the next round only refreshes their keep_alive
+        keeper.run_once()
+        self.assertEqual((keeper.preloads, keeper.loads), (4, 1))
+
+    def test_records_unloads_between_rounds(self):
+        session = FakeOllamaSession()
+        keeper = self.keeper(session, models=["llama3"])
+        keeper.run_once()
+        session.loaded = []
+        keeper.run_once()
+        self.assertEqual((keeper.loads, keeper.unloads), (2, 1))
+        self.assertEqual([event["event"] for event in keeper.events], ["load", "unload", "load"])
+
+    def test_unreachable_backend_counts_an_error(self):
+        session = FakeOllamaSession()
+        session.down = True
+        keeper = self.keeper(session, models=["llama3"])
+        keeper.run_once()
+        self.assertEqual((keeper.errors, keeper.preloads, keeper.rounds), (1, 0, 1))
+        self.assertFalse(keeper.residency_report("llama3")[0]["reachable"])
+
+    def test_counts_cold_starts_above_the_threshold(self):
+        pool = BackendPool("http://ollama:11434", cold_start_threshold=1.0)
+        backend = pool.backends[0]
+        pool.record_generation(backend, {"model": "llama3", "load_duration": 250_000_000})
+        self.assertEqual((backend.cold_starts, backend.last_load_duration), (0, 0.25))
+        pool.record_generation(backend, {"model": "llama3", "response": "no timings"})
+        self.assertEqual(backend.last_load_duration, 0.25)
+        pool.record_generation(backend, {"model": "llama3", "load_duration": 4_000_000_000})
+        self.assertEqual((backend.cold_starts, backend.last_load_duration), (1, 4.0))
+
+        keeper = ModelKeeper(pool, models=["llama3"])
+        self.assertEqual(keeper.stats()["cold_starts"], 1)
+
+    @override_settings(OLLAMA_WARMUP_INTERVAL=0)
+    def test_disabled_by_a_zero_interval(self):
+        self.assertIsNone(start_model_keeper())
+
+
+class ChatLogWriterTests(TestCase):
+    def setUp(self):
+        # flush() runs on the test thread, inside the test's transaction
+        for name in ("close_old_connections", "connection"):
+            patcher = mock.patch(f"bakerydemo.chatbot.chatlog_writer.{name}")
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.writer = ChatLogWriter(batch_size=2, max_pending=3, max_retries=3, retry_backoff=0)
+
+    def queue(self, count):
+        for n in range(count):
+            chat_log = ChatLog(messages=[{"role": "user", "content": f"prompt {n}"}, {"role": "assistant", "content": "answer"}])
+            self.assertTrue(self.writer.enqueue(chat_log))
+
+    def test_flush_inserts_in_batches(self):
+        self.queue(3)
+        self.assertEqual(len(self.writer.pending_for_session(None)), 3)
+        self.writer.flush()
+        self.assertEqual(ChatLog.objects.count(), 3)
+        self.assertEqual(set(ChatLog.objects.values_list("user_prompt", flat=True)), {"prompt 0", "prompt 1", "prompt 2"})
+        self.assertEqual(self.writer.stats(), {"pending": 0, "written": 3, "batches": 2, "retries": 0, "dropped": 0})
+
+    def test_created_at_is_the_time_of_the_request(self):
+        self.queue(1)
+        queued_at = self.writer.pending_for_session(None)[0].created_at
+        flushed_at = timezone.now()
+        self.writer.flush()
+        self.assertEqual(ChatLog.objects.get().created_at, queued_at)
+        self.assertLess(queued_at, flushed_at)
+
+    def test_full_buffer_asks_the_caller_to_save(self):
+        self.queue(3)
+        self.assertFalse(self.writer.enqueue(ChatLog(messages=[])))
+
+    def test_batch_is_retried_while_the_database_is_unavailable(self):
+        self.queue(2)
+        bulk_create = ChatLog.objects.bulk_create
+        errors = [OperationalError("gone away")]
+
+        def flaky_bulk_create(batch):
+            if errors:
+                raise errors.pop()
+            return bulk_create(batch)
+
+        with mock.patch.object(ChatLog.objects, "bulk_create", side_effect=flaky_bulk_create):
+            self.writer.flush()
+        self.assertEqual(ChatLog.objects.count(), 2)
+        self.assertEqual((self.writer.retries, self.writer.dropped, self.writer.written), (1, 0, 2))
+
+    def test_batch_is_dropped_after_max_retries(self):
+        self.queue(2)
+        with mock.patch.object(ChatLog.objects, "bulk_create", side_effect=OperationalError("gone away")) as bulk_create:
+            self.writer.flush()
+        self.assertEqual(bulk_create.call_count, 3)
+        self.assertEqual((self.writer.retries, self.writer.dropped, self.writer.written), (2, 2, 0))
+
+    def test_rejected_batch_is_not_retried(self):
+        self.queue(2)
+        with mock.patch.object(ChatLog.objects, "bulk_create", side_effect=IntegrityError("bad row")) as bulk_create:
+            self.writer.flush()
+        self.assertEqual(bulk_create.call_count, 1)
+        self.assertEqual((self.writer.retries, self.writer.dropped), (0, 2))
+
+
+@override_settings(
+    CACHES={"chatbot": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "summary-tests"}},
+    CHATBOT_RESPONSE_CACHE_ALIAS="chatbot",
+)
+class RollingSummarizerTests(SimpleTestCase):
+    def summarize(self, chat):
+        summarizer = RollingSummarizer("model")
+        self.addCleanup(summarizer._executor.shutdown)
+        client = mock.Mock(**{"chat.side_effect": chat})
+        with mock.patch("bakerydemo.chatbot.ollama_client.get_ollama_client", return_value=client):
+            with mock.patch("bakerydemo.chatbot.admission.get_admission_controller", return_value=AdmissionController()):
+                summarizer._summarize("session-key", None, [Turn("hours?", "9 to 5", timezone.now())])
+        return summarizer
+
+    def test_summary_is_cached_for_the_session(self):
+        summarizer = self.summarize(lambda payload: {"message": {"content": "Asked about opening hours."}})
+        self.assertEqual(summarizer.get("session-key")["summary"], "Asked about opening hours.")
+        self.assertEqual((summarizer.summaries, summarizer.failures), (1, 0))
+
+    def test_ollama_failure_is_counted_not_raised(self):
+        summarizer = self.summarize(requests.exceptions.ConnectionError("refused"))
+        self.assertEqual((summarizer.summaries, summarizer.failures), (0, 1))
+        self.assertEqual(summarizer.get("session-key"), {})
+
+
+class HistoryBudgetTests(SimpleTestCase):
+    def turns(self, count, size=40):
+        return [Turn(f"question {n} " + "q" * size, f"answer {n} " + "a" * size) for n in range(count)]
+
+    def test_keeps_the_newest_turns_that_fit(self):
+        history = self.turns(5)
+        budget = history[-1].tokens() * 2
+        conversation = build_conversation("system", history, "next?", budget)
+        self.assertEqual(conversation.history_turns, 2)
+        self.assertEqual(conversation.dropped_turns, history[:3])
+        self.assertEqual(conversation.history_tokens, history[3].tokens() + history[4].tokens())
+        self.assertEqual(
+            [message["content"] for message in conversation.messages[1:-1]],
+            [history[3].user, history[3].assistant, history[4].user, history[4].assistant],
+        )
+
+    def test_always_sends_the_system_prompt_and_new_prompt(self):
+        conversation = build_conversation("system", self.turns(3), "next?", 0)
+        self.assertEqual(conversation.messages, [{"role": "system", "content": "system"}, {"role": "user", "content": "next?"}])
+        self.assertEqual((conversation.history_turns, len(conversation.dropped_turns)), (0, 3))
+
+    def test_an_older_turn_is_not_sent_without_the_newer_ones(self):
+        history = [Turn("short", "turn"), Turn("long " * 200, "turn")]
+        conversation = build_conversation("system", history, "next?", 100)
+        self.assertEqual(conversation.history_turns, 0)
+
+    def test_summary_counts_against_the_budget(self):
+        history = self.turns(2)
+        budget = history[0].tokens() * 2
+        self.assertEqual(build_conversation("system", history, "next?", budget).history_turns, 2)
+
+        conversation = build_conversation("system", history, "next?", budget, summary="Asked about bread.")
+        self.assertEqual(conversation.history_turns, 1)
+        self.assertEqual(conversation.messages[1]["role"], "system")
+        self.assertIn("Asked about bread.", conversation.messages[1]["content"])
+        self.assertLessEqual(conversation.history_tokens, budget)
+
+    def test_estimate_grows_with_the_text(self):
+        self.assertLess(estimate_tokens("bread"), estimate_tokens("bread " * 100))
+
+
+@override_settings(CHATBOT_CHATLOG_WRITE_BEHIND=False)
+class ContextStoreTests(SimpleTestCase):
+    def test_evicts_the_least_recently_used_session(self):
+        store = ContextStore(max_sessions=2)
+        store.put("a", "model", [1, 2], ("q", "a"), 1)
+        store.put("b", "model", [3, 4], ("q", "b"), 1)
+        self.assertIsNotNone(store.get("a", "model", ("q", "a")))
+        store.put("c", "model", [5, 6], ("q", "c"), 1)
+        self.assertIsNone(store.get("b", "model", ("q", "b")))
+        self.assertIsNotNone(store.get("a", "model", ("q", "a")))
+        stats = store.stats()
+        self.assertEqual((stats["sessions"], stats["tokens"], stats["evictions"], stats["misses"]), (2, 4, 1, 1))
+
+    def test_evicts_down_to_the_token_bound(self):
+        store = ContextStore(max_total_tokens=10)
+        store.put("a", "model", list(range(6)), ("q", "a"), 1)
+        store.put("b", "model", list(range(6)), ("q", "b"), 1)
+        self.assertEqual((store.stats()["sessions"], store.total_tokens, store.evictions), (1, 6, 1))
+        self.assertIsNotNone(store.get("b", "model", ("q", "b")))
+        # A single context over the bound is still kept; replacing it frees its tokens
+        store.put("b", "model", list(range(20)), ("q", "b2"), 2)
+        self.assertEqual((store.stats()["sessions"], store.total_tokens), (1, 20))
+
+    def test_expires_unused_contexts(self):
+        store = ContextStore(ttl=60)
+        with mock.patch("bakerydemo.chatbot.context_store.time.monotonic", return_value=1000.0):
+            store.put("a", "model", [1, 2], ("q", "a"), 1)
+        with mock.patch("bakerydemo.chatbot.context_store.time.monotonic", return_value=1059.0):
+            self.assertIsNotNone(store.get("a", "model", ("q", "a")))
+        with mock.patch("bakerydemo.chatbot.context_store.time.monotonic", return_value=1061.0):
+            self.assertIsNone(store.get("a", "model", ("q", "a")))
+        self.assertEqual((store.stale, store.total_tokens), (1, 0))
+
+    def test_context_must_continue_the_latest_turn_with_the_same_model(self):
+        store = ContextStore()
+        store.put("a", "model", [1, 2], ("q", "a"), 1)
+        self.assertIsNone(store.get("a", "other", ("q", "a")))
+        store.put("a", "model", [1, 2], ("q", "a"), 1)
+        self.assertIsNone(store.get("a", "model", ("q", "answered by another worker")))
+        self.assertIsNone(store.get(None, "model", ("q", "a")))
+        self.assertEqual(store.stale, 2)
+
+
+class AttachContextTests(SimpleTestCase):
+    history = [Turn("When do you open?", "At seven."), Turn("Do you bake rye?", "Every Friday.")]
+
+    def setUp(self):
+        self.store = ContextStore()
+        patcher = mock.patch.object(context_store, "_store", self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def conversation(self):
+        conversation = build_conversation("system", self.history, "And sourdough?", 1024)
+        self.assertEqual(conversation.last_turn, ("Do you bake rye?", "Every Friday."))
+        return conversation
+
+    @override_settings(CHATBOT_CONTEXT_REUSE=True)
+    def test_continues_from_a_current_context(self):
+        self.store.put("session", "model", [1, 2, 3], ("Do you bake rye?", "Every Friday."), 2)
+        payload = attach_context(self.conversation(), "session", "model").payload("model")
+        self.assertEqual(payload, {"model": "model", "prompt": "And sourdough?", "context": [1, 2, 3]})
+
+    @override_settings(CHATBOT_CONTEXT_REUSE=True)
+    def test_stale_context_falls_back_to_the_history_window(self):
+        self.store.put("session", "model", [1, 2, 3], ("Do you bake rye?", "On Saturdays."), 2)
+        conversation = attach_context(self.conversation(), "session", "model")
+        self.assertTrue(conversation.use_context)
+        self.assertIsNone(conversation.context)
+        self.assertEqual(self.store.stats()["sessions"], 0)
+        payload = conversation.payload("model")
+        self.assertNotIn("context", payload)
+        self.assertIn("User: Do you bake rye?\nAssistant: Every Friday.", payload["prompt"])
+
+    @override_settings(CHATBOT_CONTEXT_REUSE=True, CHATBOT_CONTEXT_MAX_TOKENS=100)
+    def test_context_over_the_limit_is_dropped(self):
+        self.store.put("session", "model", list(range(100)), ("Do you bake rye?", "Every Friday."), 2)
+        conversation = attach_context(self.conversation(), "session", "model")
+        self.assertIsNone(conversation.context)
+        self.assertIsNone(self.store.get("session", "model", ("Do you bake rye?", "Every Friday.")))
+
+    def test_both_paths_send_the_same_history(self):
+        with override_settings(CHATBOT_CONTEXT_REUSE=False):
+            chat = attach_context(self.conversation(), "session", "model")
+        with override_settings(CHATBOT_CONTEXT_REUSE=True):
+            generate = attach_context(self.conversation(), "session", "model")
+        self.assertFalse(chat.use_context)
+        self.assertEqual(
+            chat.payload("model")["messages"][1:],
+            [*self.history[0].messages(), *self.history[1].messages(), {"role": "user", "content": "And sourdough?"}],
+        )
+        self.assertEqual(
+            generate.payload("model"),
+            {
+                "model": "model",
+                "system": "system",
+                "prompt": (
+                    "Earlier in this conversation:\n"
+                    "User: When do you open?\nAssistant: At seven.\n"
+                    "User: Do you bake rye?\nAssistant: Every Friday.\n\n"
+                    "User: And sourdough?"
+                ),
+            },
+        )
+        self.assertEqual(chat.stats(), generate.stats())
+
+    def test_off_by_default(self):
+        conversation = attach_context(self.conversation(), "session", "model")
+        self.assertFalse(conversation.use_context)
+        self.assertIsNone(context_store.get_context_store())
+
+
+class LoadHistoryTests(TestCase):
+    def save_turn(self, prompt, answer, session_key="session", **fields):
+        ChatLog.objects.create(
+            messages=[{"role": "user", "content": prompt}, {"role": "assistant", "content": answer}],
+            session_key=session_key,
+            **fields,
+        )
+
+    def test_reads_the_newest_turns_oldest_first(self):
+        for n in range(4):
+            self.save_turn(f"prompt {n}", f"answer {n}")
+        self.save_turn("other session", "answer", session_key="other")
+        history = load_history("session", 3)
+        self.assertEqual([turn.user for turn in history], ["prompt 1", "prompt 2", "prompt 3"])
+        self.assertTrue(all(turn.created_at is not None for turn in history))
+
+    def test_skips_cancelled_and_unanswered_turns(self):
+        self.save_turn("walked away", "partial", cancelled=True)
+        self.save_turn("no answer", "")
+        self.save_turn("prompt", "answer")
+        self.assertEqual([turn.user for turn in load_history("session", 10)], ["prompt"])
+
+    def test_includes_turns_still_queued_for_insert(self):
+        self.save_turn("saved", "answer")
+        writer = ChatLogWriter()
+        writer.enqueue(ChatLog(messages=[{"role": "user", "content": "queued"}, {"role": "assistant", "content": "answer"}], session_key="session"))
+        with mock.patch("bakerydemo.chatbot.conversation.get_chat_log_writer", return_value=writer):
+            self.assertEqual([turn.user for turn in load_history("session", 10)], ["saved", "queued"])
+
+
+class EmbeddingStoreTests(TestCase):
+    def test_round_trip(self):
+        vector = [0.5, -0.25, 0.125, 1.0]
+        key = embedding_store.store_embedding("opening hours", vector, dtype=PromptEmbedding.FLOAT32)
+        self.assertEqual(embedding_store.load_embedding(key), vector)
+        # A repeated text keeps its row
+        self.assertEqual(embedding_store.store_embedding("opening hours", vector, dtype=PromptEmbedding.FLOAT32), key)
+        self.assertEqual(PromptEmbedding.objects.count(), 1)
+
+    def test_int8_is_close(self):
+        vector = [0.5, -0.25, 0.125, 1.0]
+        key = embedding_store.store_embedding("hours", vector, dtype=PromptEmbedding.INT8)
+        for stored, original in zip(embedding_store.load_embedding(key), vector):
+            self.assertAlmostEqual(stored, original, delta=1 / 127)
+
+    def test_float16_is_close(self):
+        vector = [0.5, -0.25, 0.1, 1.0 / 3]
+        key = embedding_store.store_embedding("hours", vector, dtype=PromptEmbedding.FLOAT16)
+        for stored, original in zip(embedding_store.load_embedding(key), vector):
+            self.assertAlmostEqual(stored, original, delta=abs(original) / 1024)
+
+    def test_blob_sizes(self):
+        vector = np.linspace(-1, 1, 1024)
+        sizes = {
+            dtype: len(embedding_store.encode_vector(vector, dtype)[0])
+            for dtype in (PromptEmbedding.FLOAT32, PromptEmbedding.FLOAT16, PromptEmbedding.INT8)
+        }
+        self.assertEqual(
+            sizes, {PromptEmbedding.FLOAT32: 4096, PromptEmbedding.FLOAT16: 2048, PromptEmbedding.INT8: 1024}
+        )
+
+    def test_int8_scale_maps_the_peak_to_127(self):
+        blob, scale = embedding_store.encode_vector([0.0, -2.0, 1.0], PromptEmbedding.INT8)
+        self.assertEqual(np.frombuffer(blob, dtype=np.int8).tolist(), [0, -127, 64])
+        self.assertAlmostEqual(scale, 2 / 127)
+        decoded = embedding_store.decode_vector(blob, PromptEmbedding.INT8, scale)
+        self.assertEqual(decoded.dtype, np.float32)
+        np.testing.assert_allclose(decoded, [0.0, -2.0, 1.0], atol=scale / 2)
+        # An all-zero vector has no peak to scale by
+        blob, scale = embedding_store.encode_vector([0.0, 0.0], PromptEmbedding.INT8)
+        self.assertEqual(embedding_store.decode_vector(blob, PromptEmbedding.INT8, scale).tolist(), [0.0, 0.0])
+        self.assertEqual(scale, 1.0)
+
+    def test_session_holds_only_the_key(self):
+        key = embedding_store.store_embedding("hours", [0.5, -0.25], dtype=PromptEmbedding.FLOAT32)
+        session = {embedding_store.SESSION_KEY: key}
+        self.assertEqual(embedding_store.load_session_embedding(session), [0.5, -0.25])
+        self.assertIsNone(embedding_store.load_session_embedding({}))
+
+    def test_database_error_is_not_raised(self):
+        with mock.patch.object(PromptEmbedding.objects, "bulk_create", side_effect=OperationalError("gone away")):
+            self.assertIsNone(embedding_store.store_embedding("hours", [1.0, 0.0]))
+
+
+class EmbeddingCacheTests(TestCase):
+    def test_key_is_shared_with_the_embedding_store(self):
+        key = make_key("opening hours", embedding_store.DEFAULT_MODEL_ID)
+        self.assertEqual(key, embedding_store.make_key("opening hours"))
+        self.assertEqual(len(key), 64)
+        variants = {
+            make_key("opening hours", embedding_store.DEFAULT_MODEL_ID, dimensions=256),
+            make_key("opening hours", embedding_store.DEFAULT_MODEL_ID, normalize=False),
+            make_key("opening hours", embedding_store.DEFAULT_MODEL_ID, embedding_type="binary"),
+            make_key("opening hours", "other-model"),
+        }
+        self.assertEqual(len(variants), 4)
+        self.assertNotIn(key, variants)
+
+    def test_memory_tier_evicts_the_least_recently_used(self):
+        cache = EmbeddingCache(capacity=2)
+        cache.set_many({"a": [1.0], "b": [2.0]}, "model")
+        cache.get_many(["a"])
+        cache.set_many({"c": [3.0]}, "model")
+        self.assertEqual(set(cache.get_many(["a", "b", "c"])), {"a", "c"})
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_misses_fall_back_to_the_database_tier(self):
+        EmbeddingCache(persistent_tier=DatabaseTier()).set_many({"a": [0.5, -0.25]}, "model")
+        cache = EmbeddingCache(persistent_tier=DatabaseTier())
+        found = cache.get_many(["a", "b"])
+        self.assertEqual(found["a"].tolist(), [0.5, -0.25])
+        self.assertEqual(found["a"].dtype, np.float32)
+        cache.get_many(["a"])
+        stats = cache.stats()
+        self.assertEqual((stats["persistent_hits"], stats["memory_hits"], stats["misses"]), (1, 1, 1))
+
+    def test_quantized_rows_are_not_served(self):
+        key = embedding_store.store_embedding("hours", [0.5, -0.25], dtype=PromptEmbedding.INT8)
+        self.assertEqual(EmbeddingCache(persistent_tier=DatabaseTier()).get_many([key]), {})
+
+    def test_binary_embeddings_stay_in_memory(self):
+        cache = EmbeddingCache(persistent_tier=DatabaseTier())
+        cache.set_many({"bits": np.packbits([1, 0, 1, 1, 0, 0, 0, 1])}, "model")
+        self.assertIn("bits", cache.get_many(["bits"]))
+        self.assertFalse(PromptEmbedding.objects.exists())
+
+    def test_tier_errors_are_misses(self):
+        tier = mock.Mock(get_many=mock.Mock(side_effect=OperationalError("gone away")))
+        cache = EmbeddingCache(persistent_tier=tier)
+        self.assertEqual(cache.get_many(["a"]), {})
+        self.assertEqual(cache.stats()["persistent_errors"], 1)
+
+
+class BedrockEmbeddingsOutputTests(SimpleTestCase):
+    vector = [0.1, -0.2, 0.3] + [0.0] * 253
+
+    def setUp(self):
+        self.embeddings = BedrockEmbeddings(region_name="us-east-1", cache=EmbeddingCache())
+        body = mock.Mock(read=lambda: json.dumps({"embedding": self.vector}).encode())
+        self.embeddings.bedrock_client = mock.Mock(invoke_model=mock.Mock(side_effect=lambda **kwargs: {"body": body}))
+
+    def test_list_output_keeps_bedrock_floats(self):
+        self.assertEqual(self.embeddings.embed_query("hours", dimensions=256), self.vector)
+        self.assertEqual(self.embeddings.embed_documents(["bread"], dimensions=256), [self.vector])
+
+    def test_float32_output(self):
+        embedding = self.embeddings.embed_query("hours", dimensions=256, output=OUTPUT_FLOAT32)
+        self.assertEqual(embedding.dtype, np.float32)
+        self.assertFalse(embedding.flags.writeable)
+        matrix = self.embeddings.embed_documents(["hours", "bread"], dimensions=256, output=OUTPUT_FLOAT32)
+        self.assertEqual((matrix.dtype, matrix.shape), (np.float32, (2, 256)))
+        np.testing.assert_allclose(matrix[1], self.vector, rtol=1e-6)
+
+
+class EmbeddingBackendTests(SimpleTestCase):
+    texts = ["Fresh sourdough every morning", "When does the bakery open?"]
+
+    def test_hashing_is_deterministic_and_unit_norm(self):
+        first = HashingEmbeddings().embed_documents(self.texts, dimensions=256, output="float32")
+        second = create_embedding_backend("hashing").embed_documents(self.texts, dimensions=256, output="float32")
+        self.assertEqual((first.shape, first.dtype), ((2, 256), np.float32))
+        np.testing.assert_array_equal(first, second)
+        np.testing.assert_allclose(np.linalg.norm(first, axis=1), [1.0, 1.0], rtol=1e-6)
+        self.assertLess(float(first[0] @ first[1]), 0.5)
+        query = HashingEmbeddings().embed_query(self.texts[0], dimensions=256)
+        self.assertIsInstance(query, list)
+        np.testing.assert_allclose(query, first[0])
+
+    def test_binary_output_packs_one_bit_per_dimension(self):
+        backend = HashingEmbeddings()
+        packed = backend.embed_documents(self.texts, dimensions=256, output="binary")
+        self.assertEqual((packed.shape, packed.dtype), ((2, 32), np.uint8))
+        floats = backend.embed_documents(self.texts, dimensions=256, output="float32")
+        np.testing.assert_array_equal(np.unpackbits(packed, axis=1), floats > 0)
+
+    def test_rejects_dimensions_and_outputs_it_cannot_produce(self):
+        backend = HashingEmbeddings()
+        for dimensions, output in [(0, "list"), (-8, "float32"), (100, "binary"), (256, "bits")]:
+            with self.subTest(dimensions=dimensions, output=output), self.assertRaises(ValueError):
+                backend.embed_query("rye", dimensions=dimensions, output=output)
+
+    def test_unknown_backend(self):
+        with self.assertRaisesMessage(ValueError, "Unknown embedding backend 'word2vec'"):
+            create_embedding_backend("word2vec")
+
+    def test_ollama_vectors_are_truncated_and_renormalized(self):
+        client = mock.Mock()
+        client.post.return_value = {"embeddings": [[3.0, 4.0, 12.0], [0.0, 0.0, 1.0]]}
+        backend = OllamaEmbeddings(model="nomic-embed-text", client=client)
+        vectors = backend.embed_documents(self.texts, dimensions=2)
+        client.post.assert_called_once_with("/api/embed", {"model": "nomic-embed-text", "input": self.texts})
+        np.testing.assert_allclose(vectors[0], [0.6, 0.8], rtol=1e-6)
+        # A vector with nothing left after truncation stays zero rather than dividing by 0
+        self.assertEqual(vectors[1], [0.0, 0.0])
+        self.assertEqual(backend.embed_documents(self.texts, dimensions=2, normalize=False)[0], [3.0, 4.0])
+        with self.assertRaisesMessage(ValueError, "have 3 dimensions, not 4"):
+            backend.embed_documents(self.texts, dimensions=4)
+        self.assertEqual(backend.embed_documents([], dimensions=2, output="float32").shape, (0, 2))
+        self.assertEqual(client.post.call_count, 3)
+
+    def test_semantic_cache_namespaces_keep_backends_apart(self):
+        namespaces = {}
+        for backend in embedding_backends.get_backend_names():
+            with override_settings(CHATBOT_EMBEDDING_BACKEND=backend):
+                namespaces[backend] = semantic_cache.make_namespace("model", "system")
+        self.assertEqual(len(set(namespaces.values())), len(namespaces))
+        # Titan's entries keep the namespace they had before backends were selectable
+        self.assertEqual(namespaces["bedrock"], "model\0system")
+
+
+@skipIf(rag_service is None, "The RAG service's dependencies are not installed")
+class RagQueryEmbeddingTests(SimpleTestCase):
+    def test_retrieves_with_the_hashing_backend(self):
+        docs = [
+            "We bake sourdough loaves every morning.",
+            "The shop opens at seven on weekdays.",
+            "Rye bread comes out of the oven on Fridays.",
+        ]
+
+        def from_chain_type(llm, retriever):
+            # Answer with the retrieved documents instead of asking the model
+            chain = mock.Mock()
+            chain.run.side_effect = lambda query: [doc.page_content for doc in retriever.invoke(query)]
+            return chain
+
+        with mock.patch.object(rag_service, "query_kendra", return_value=docs):
+            with mock.patch.object(rag_service, "Ollama"), mock.patch.object(
+                rag_service.RetrievalQA, "from_chain_type", side_effect=from_chain_type
+            ):
+                retrieved = rag_service.rag_query("When does the shop open?", "index", embedding_backend="hashing")
+        self.assertEqual(retrieved[0], docs[1])
+        self.assertIsInstance(rag_service.get_embeddings(backend="hashing"), rag_service.Embeddings)
+
+
+class FakeStreamClient:
+    """Stands in for the pooled Ollama client, streaming canned /api/chat chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.payloads = []
+
+    def chat_stream(self, payload, timeout=None, hedge=False):
+        self.payloads.append(payload)
+        return (chunk for chunk in self.chunks)
+
+    def generate_stream(self, payload, timeout=None, hedge=False):
+        # The same answer in /api/generate's shape, for sessions continuing a KV context
+        self.payloads.append(payload)
+        return (dict(chunk, response=chunk["message"]["content"]) for chunk in self.chunks)
+
+
+class ChatbotStreamApiTests(TestCase):
+    chunks = [
+        {"message": {"content": "We open "}, "done": False},
+        {"message": {"content": "at 8am."}, "done": False},
+        {"message": {"content": ""}, "done": True, "done_reason": "stop", "eval_count": 2},
+    ]
+
+    def setUp(self):
+        response_cache.get_cache().clear()
+        self.client_stub = FakeStreamClient(self.chunks)
+        self.admission = AdmissionController(max_concurrent=2)
+        for target, value in [
+            ("bakerydemo.chatbot.views.get_ollama_client", self.client_stub),
+            ("bakerydemo.chatbot.views.get_admission_controller", self.admission),
+            ("bakerydemo.chatbot.async_views.get_admission_controller", self.admission),
+            ("bakerydemo.chatbot.deadline.get_backend_pool", BackendPool(["http://a:11434"])),
+        ]:
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post(self, message, use_embeddings=False):
+        body = {"message": message, "use_bedrock_embeddings": use_embeddings, "use_history": False}
+        with mock.patch("bakerydemo.chatbot.views.persist_chat_log") as persist:
+            response = self.client.post(reverse("chatbot_stream_api"), json.dumps(body), content_type="application/json")
+            content = b"".join(response.streaming_content).decode()
+            response.close()
+        return response, content, persist
+
+    def parse(self, content):
+        self.assertTrue(content.endswith("\n\n"))
+        events = []
+        for message in content.split("\n\n")[:-1]:
+            lines = message.split("\n")
+            event = lines[0][len("event: "):] if lines[0].startswith("event: ") else None
+            self.assertTrue(lines[-1].startswith("data: "))
+            events.append((event, json.loads(lines[-1][len("data: "):])))
+        return events
+
+    def test_tokens_are_sent_as_events_then_a_done_event(self):
+        response, content, persist = self.post("When do you open?")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        events = self.parse(content)
+        self.assertEqual(events[:2], [(None, {"token": "We open "}), (None, {"token": "at 8am."})])
+        event, done = events[-1]
+        self.assertEqual((event, len(events)), ("done", 3))
+        self.assertFalse(done["cache_hit"])
+        self.assertFalse(done["truncated"])
+
+        persist.assert_called_once()
+        messages = persist.call_args.kwargs["messages"]
+        self.assertEqual(messages[-1], {"role": "assistant", "content": "We open at 8am."})
+        self.assertEqual(persist.call_args.kwargs["session_key"], self.client.session.session_key)
+        # The slot taken for the stream is handed back once the response is closed
+        self.assertEqual(self.admission.active, 0)
+
+    def test_slot_is_released_when_the_stream_setup_fails(self):
+        with mock.patch("bakerydemo.chatbot.views.with_budget", side_effect=RuntimeError("no backends")):
+            with self.assertRaises(RuntimeError):
+                self.post("When do you open?")
+        self.assertEqual(self.admission.active, 0)
+
+    async def test_async_slot_is_released_when_the_stream_setup_fails(self):
+        body = {"message": "When do you open?", "use_bedrock_embeddings": False, "use_history": False}
+        with mock.patch("bakerydemo.chatbot.async_views.with_budget", side_effect=RuntimeError("no backends")):
+            with self.assertRaises(RuntimeError):
+                await self.async_client.post(
+                    reverse("chatbot_stream_api_async"), json.dumps(body), content_type="application/json"
+                )
+        self.assertEqual(self.admission.active, 0)
+
+    def test_answers_without_embeddings_when_the_backend_cannot_be_built(self):
+        with mock.patch.object(prompt_embeddings, "get_embedding_backend", side_effect=NoRegionError()):
+            _, content, _ = self.post("When do you open?", use_embeddings=True)
+        event, done = self.parse(content)[-1]
+        self.assertEqual((event, done["embeddings_length"]), ("done", 0))
+        self.assertNotIn(embedding_store.SESSION_KEY, self.client.session)
+
+    def test_repeated_prompt_is_one_cached_token_event(self):
+        self.post("When do you open?")
+        _, content, persist = self.post("When do you open?")
+        events = self.parse(content)
+        self.assertEqual(events[0], (None, {"token": "We open at 8am."}))
+        self.assertEqual(events[1][0], "done")
+        self.assertTrue(events[1][1]["cache_hit"])
+        self.assertEqual(len(self.client_stub.payloads), 1)
+        self.assertEqual(persist.call_args.kwargs["messages"][-1]["content"], "We open at 8am.")
+
+
+class ParseBatchTests(SimpleTestCase):
+    def test_rejects_invalid_batches(self):
+        for data, error in [
+            ({}, "'prompts' must be a non-empty list"),
+            ({"prompts": []}, "'prompts' must be a non-empty list"),
+            ({"prompts": "hours?"}, "'prompts' must be a non-empty list"),
+            ({"prompts": ["a", "b", "c"]}, "at most 2 prompts, got 3"),
+            ({"prompts": ["hours?", 42]}, "Prompt 1 must be a string or an object"),
+            ({"prompts": [{"message": "  "}]}, "Prompt 0 has no message"),
+            ({"prompts": [{"message": "hours?", "options": [0.2]}]}, "Prompt 0 has options that are not an object"),
+            ({"prompts": ["hours?"], "options": "hot"}, "Prompt 0 has options that are not an object"),
+        ]:
+            with self.subTest(data=data), self.assertRaisesMessage(ValueError, error):
+                parse_batch(data, "system", 2)
+
+    def test_items_override_the_batch_defaults(self):
+        items = parse_batch(
+            {
+                "prompts": [" hours? ", {"message": "rye?", "id": "q2", "system": "terse", "use_cache": False}],
+                "options": {"temperature": 0},
+            },
+            "system",
+            10,
+        )
+        self.assertEqual(
+            [(item.index, item.id, item.message, item.system) for item in items],
+            [(0, 0, "hours?", "system"), (1, "q2", "rye?", "terse")],
+        )
+        self.assertEqual([item.options for item in items], [{"temperature": 0}, {"temperature": 0}])
+        self.assertEqual([item.use_cache for item in items], [True, False])
+        # Answers generated with custom options never come from or go to the cache
+        self.assertFalse(items[0].cacheable)
+        self.assertTrue(parse_batch({"prompts": ["hours?"]}, "system", 1)[0].cacheable)
+
+
+class FakeBatchClient:
+    """
+    Streams each prompt back in upper case, word by word; a prompt starting with "slow"
+    waits for `release` first, and "dawdle" waits `pause` seconds between words.
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.pause = 0
+        self.payloads = []
+
+    def chat_stream(self, payload, timeout=None):
+        self.payloads.append(payload)
+        message = payload["messages"][-1]["content"]
+        if message.startswith("slow"):
+            self.release.wait(5)
+        words = message.upper().split(" ")
+        for index, word in enumerate(words):
+            if index and message.startswith("dawdle"):
+                time.sleep(self.pause)
+            yield {"message": {"role": "assistant", "content": (" " if index else "") + word}, "done": False}
+        yield {"message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop"}
+
+
+class BatchRunnerTests(TestCase):
+    def setUp(self):
+        self.client = FakeBatchClient()
+        self.admission = AdmissionController(max_concurrent=4)
+        for name, value in [("get_ollama_client", self.client), ("get_admission_controller", self.admission)]:
+            patcher = mock.patch.object(batch, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def runner(self, prompts, concurrency):
+        items = parse_batch({"prompts": prompts, "use_cache": False}, "system", 10)
+        return BatchRunner(items, "model", concurrency, session_key="session")
+
+    def test_yields_results_in_completion_order_and_saves_once(self):
+        runner = self.runner(["slow rye?", "hours?"], concurrency=2)
+        with mock.patch.object(ChatLog.objects, "bulk_create", wraps=ChatLog.objects.bulk_create) as bulk_create:
+            results = runner.run()
+            first = next(results)
+            # The slow prompt only finishes once the fast one has been yielded
+            self.client.release.set()
+            rest = list(results)
+        self.assertEqual((first["index"], first["response"]), (1, "HOURS?"))
+        self.assertEqual((rest[0]["index"], rest[0]["response"]), (0, "SLOW RYE?"))
+        summary = rest[-1]
+        self.assertEqual(
+            (summary["done"], summary["succeeded"], summary["failed"], summary["chat_logs_saved"]), (True, 2, 0, 2)
+        )
+        bulk_create.assert_called_once()
+        self.assertEqual(
+            sorted(ChatLog.objects.filter(session_key="session").values_list("user_prompt", flat=True)),
+            ["hours?", "slow rye?"],
+        )
+
+    def test_disconnect_still_saves_the_finished_items(self):
+        runner = self.runner(["hours?", "rye?", "spelt?"], concurrency=1)
+        results = runner.run()
+        self.assertEqual(next(results)["response"], "HOURS?")
+        # The client going away closes the generator before the next prompt is submitted
+        results.close()
+        self.assertEqual((runner.succeeded, runner.failed), (1, 0))
+        self.assertEqual(
+            list(ChatLog.objects.filter(session_key="session").values_list("user_prompt", flat=True)), ["hours?"]
+        )
+
+    def test_each_prompt_gets_a_generation_budget(self):
+        results = list(self.runner(["hours?", {"message": "rye?", "options": {"num_predict": 40}}], concurrency=1).run())
+        self.assertEqual([result["truncated"] for result in results[:2]], [False, False])
+        self.assertEqual(results[-1]["truncated"], 0)
+        budgets = [payload["options"]["num_predict"] for payload in self.client.payloads]
+        self.assertGreater(budgets[0], 40)
+        self.assertEqual(budgets[1], 40)
+
+    def test_deadline_returns_the_answer_so_far_and_skips_the_cache(self):
+        self.client.pause = 0.1
+        items = parse_batch({"prompts": ["dawdle over the sourdough"]}, "system", 10)
+        runner = BatchRunner(items, "model", 1, session_key="session")
+        with mock.patch.object(response_cache, "cache_response") as cache_response:
+            with mock.patch.object(batch, "get_request_deadline", return_value=Deadline(0.05, reserve=0)):
+                result, summary = runner.run()
+        self.assertEqual((result["response"], result["truncated"]), ("DAWDLE OVER", True))
+        self.assertEqual((summary["succeeded"], summary["truncated"]), (1, 1))
+        cache_response.assert_not_called()
+
+    def test_admission_wait_is_bounded_by_the_deadline(self):
+        self.admission.max_concurrent = 1
+        self.admission.acquire()
+        self.addCleanup(self.admission.release)
+        runner = self.runner(["hours?"], concurrency=1)
+        with mock.patch.object(batch, "get_request_deadline", return_value=Deadline(0.05, reserve=0)):
+            result, summary = runner.run()
+        self.assertEqual(result["status"], QueueTimeout.status)
+        self.assertEqual((summary["failed"], summary["chat_logs_saved"]), (1, 0))
+
+    def test_batch_leaves_slots_to_interactive_requests(self):
+        with override_settings(CHATBOT_BATCH_CONCURRENCY=0):
+            self.assertEqual(get_batch_concurrency(), 2)
+            self.admission.max_concurrent = 1
+            self.assertEqual(get_batch_concurrency(), 1)
+        with override_settings(CHATBOT_BATCH_CONCURRENCY=3):
+            self.assertEqual(get_batch_concurrency(), 3)
+
+
+class PendingEmbeddingTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        self.release = threading.Event()
+        self.vector = np.array([0.6, 0.8], dtype=np.float32)
+
+        def embed_prompt(user_prompt):
+            self.release.wait(5)
+            return self.vector
+
+        patcher = mock.patch.object(prompt_embeddings, "embed_prompt", embed_prompt)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_peek_gives_up_at_the_timeout_and_result_joins(self):
+        pending = prompt_embeddings.PendingEmbedding(self.executor, "opening hours", "model", store=False)
+        self.assertEqual(pending.key, embedding_store.make_key("opening hours", "model", prompt_embeddings.get_dimensions()))
+        self.assertIsNone(pending.peek(0.01))
+        self.assertFalse(pending.done())
+        self.release.set()
+        self.assertIs(pending.result(), self.vector)
+        self.assertIs(pending.peek(0), self.vector)
+        self.assertIsNotNone(pending.seconds)
+
+    def test_apeek_gives_up_at_the_timeout_and_aresult_joins(self):
+        pending = prompt_embeddings.PendingEmbedding(self.executor, "opening hours", "model", store=False)
+
+        async def wait():
+            early = await pending.apeek(0.01)
+            self.release.set()
+            return early, await pending.aresult(), await pending.apeek(0)
+
+        early, joined, peeked = asyncio.run(wait())
+        self.assertIsNone(early)
+        self.assertIs(joined, self.vector)
+        self.assertIs(peeked, self.vector)
+
+    def test_finished_vector_is_stored_from_the_worker(self):
+        self.release.set()
+        with mock.patch.object(prompt_embeddings, "close_old_connections"):
+            with mock.patch.object(embedding_store, "store_embedding") as store_embedding:
+                pending = prompt_embeddings.PendingEmbedding(self.executor, "opening hours", "model")
+                pending.result()
+        store_embedding.assert_called_once_with("opening hours", self.vector, model_id="model")
+
+    def test_backend_that_cannot_be_built_means_no_embedding(self):
+        for error in (NoRegionError(), ValueError("Unknown embedding backend 'nope'")):
+            with mock.patch.object(prompt_embeddings, "get_embedding_backend", side_effect=error):
+                self.assertIsNone(prompt_embeddings.start_prompt_embedding("opening hours"))
+                self.assertIsNone(asyncio.run(prompt_embeddings.astart_prompt_embedding("opening hours")))
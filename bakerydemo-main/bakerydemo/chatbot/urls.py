@@ -1,11 +1,33 @@
 from django.urls import path
 from django.views.generic import TemplateView
-from .views import chatbot_api, chatbot_ui, test_ollama_connection, test_bedrock_embeddings
+
+from .async_views import (
+    chatbot_api_async,
+    chatbot_batch_api_async,
+    chatbot_stream_api_async,
+    test_ollama_connection_async,
+)
+from .views import (
+    chatbot_api,
+    chatbot_batch_api,
+    chatbot_metrics,
+    chatbot_stream_api,
+    chatbot_ui,
+    test_bedrock_embeddings,
+    test_ollama_connection,
+)
 
 urlpatterns = [
     path("api/chatbot/", chatbot_api, name="chatbot_api"),
+    path("api/chatbot/stream/", chatbot_stream_api, name="chatbot_stream_api"),
+    path("api/chatbot/batch/", chatbot_batch_api, name="chatbot_batch_api"),
+    path("api/chatbot/metrics/", chatbot_metrics, name="chatbot_metrics"),
     path("chatbot/", chatbot_ui, name="chatbot_ui"),
     path("api/test-ollama/", test_ollama_connection, name="test_ollama_connection"),
+    path("api/async/chatbot/", chatbot_api_async, name="chatbot_api_async"),
+    path("api/async/chatbot/stream/", chatbot_stream_api_async, name="chatbot_stream_api_async"),
+    path("api/async/chatbot/batch/", chatbot_batch_api_async, name="chatbot_batch_api_async"),
+    path("api/async/test-ollama/", test_ollama_connection_async, name="test_ollama_connection_async"),
     path("api/test-bedrock-embeddings/", test_bedrock_embeddings, name="test_bedrock_embeddings"),
     path("test-bedrock/", TemplateView.as_view(template_name="chatbot/test_bedrock.html"), name="test_bedrock_ui"),
 ]
@@ -1,20 +1,75 @@
 import json
 import logging
 import os
+import time
+
 import requests
-import subprocess
 from django.conf import settings
-from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
-from .models import ChatLog
-from .bedrock_embeddings import BedrockEmbeddings
+from . import embedding_store, response_cache, semantic_cache
+from .admission import (
+    Overloaded,
+    ReleasingIterator,
+    get_admission_controller,
+    overloaded_response,
+)
+from .batch import BatchRunner, get_batch_concurrency, parse_batch
+from .chatlog_writer import get_chat_log_writer, persist_chat_log
+from .context_store import get_context_store
+from .conversation import get_summarizer, prepare_conversation
+from .deadline import collect_stream, get_request_deadline, with_budget
+from .embedding_backends import get_backend_name
+from .embedding_cache import get_embedding_cache
+from .metrics import get_metrics, get_stage_timer, timed_view
+from .model_keeper import get_model_keeper
+from .ollama_client import get_backend_pool, get_ollama_client
+from .prompt_embeddings import get_lookup_wait, start_prompt_embedding
+from .singleflight import FlightTimeout, coalesce, get_single_flight
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = "deepseek-bakery-expert"
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+def store_prompt_embedding_key(request, pending_embedding):
+    """
+    Keep a reference to the prompt embedding in the session for later use (e.g., for RAG).
+    The vector itself goes to the compact embedding store; read it back with
+    embedding_store.load_session_embedding().
+    """
+    request.session.pop(embedding_store.LEGACY_SESSION_KEY, None)
+    if pending_embedding is not None and pending_embedding.store:
+        request.session[embedding_store.SESSION_KEY] = pending_embedding.key
+
+
+def save_chat_log(request, messages, model_name):
+    """
+    Persist a finished conversation to AWS RDS via the ChatLog model.
+    The insert is batched by the write-behind ChatLogWriter, off the request path.
+    """
+    return persist_chat_log(
+        messages=messages,
+        model_name=model_name,
+        user=request.user if request.user.is_authenticated else None,
+        session_key=request.session.session_key
+    )
+
+
+def sse_event(data, event=None):
+    """Format a Server-Sent Events message carrying a JSON payload."""
+    message = f"event: {event}\n" if event else ""
+    return f"{message}data: {json.dumps(data)}\n\n"
+
+
 @csrf_exempt
+@timed_view
 def chatbot_api(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST allowed'}, status=405)
@@ -26,309 +81,491 @@ def chatbot_api(request):
         # Log the Ollama API URL being used
         logger.info(f"Using Ollama API URL: {settings.OLLAMA_API_URL}")
         
+        timer = get_stage_timer(request)
         data = json.loads(request.body)
         user_prompt = data.get('message', '').strip()
         use_bedrock_embeddings = data.get('use_bedrock_embeddings', True)
+        use_history = data.get('use_history', True)
+        # Everything below, from the embedding wait to the generation, shares this deadline
+        deadline = get_request_deadline(data)
         logger.info(f"Received user prompt: {user_prompt}")
-        
-        # If Bedrock embeddings are enabled, generate embeddings for the user prompt
-        if use_bedrock_embeddings:
-            try:
-                # Initialize Bedrock embeddings
-                bedrock_embeddings = BedrockEmbeddings()
-                 
-                # Generate embeddings for the user prompt
-                embeddings = bedrock_embeddings.embed_query(user_prompt)
-                
-                # Log success
-                logger.info(f"Successfully generated Bedrock embeddings for user prompt. Vector length: {len(embeddings)}")
-                
-                # Store embeddings for later use (e.g., for RAG)
-                # This could be stored in the session, database, or passed to another service
-                request.session['last_prompt_embeddings'] = embeddings
-                
-            except Exception as e:
-                logger.error(f"Error generating Bedrock embeddings: {str(e)}")
-                # Continue with the chatbot flow even if embeddings generation fails
-
-        # Build the conversation array
+
+        # Build the conversation array (this turn only; earlier turns are in their own ChatLogs)
         messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ]
+        model_name = MODEL_NAME
+
+        # Earlier turns of the session, trimmed to the history token budget
+        with timer.stage("history"):
+            conversation = prepare_conversation(
+                request.session.session_key, SYSTEM_PROMPT, user_prompt, model_name, use_history
+            )
+
+        # Answer repeated questions from the response cache without calling Ollama.
+        # Answers that depend on earlier turns are neither looked up nor cached.
+        cached_content = None
+        if not conversation.has_history:
+            with timer.stage("cache"):
+                cached_content = response_cache.get_cached_response(model_name, SYSTEM_PROMPT, user_prompt)
+        if cached_content is not None:
+            logger.info("Answering from the response cache")
+            messages.append({"role": "assistant", "content": cached_content})
+            with timer.stage("chatlog"):
+                save_chat_log(request, messages, model_name)
+            return JsonResponse({
+                "response": cached_content,
+                "cache_hit": True,
+                "embeddings_generated": False,
+                "timings": timer.as_dict()
+            })
+        
+        # If Bedrock embeddings are enabled, start embedding the user prompt in the
+        # background; it does not depend on Ollama, so it runs alongside the generation
+        pending_embedding = start_prompt_embedding(user_prompt) if use_bedrock_embeddings else None
+        store_prompt_embedding_key(request, pending_embedding)
 
-        # Call Ollama with the correct payload structure
-        model_name = "deepseek-bakery-expert"
-        payload = {
-            "model": model_name,
-            "prompt": user_prompt,
-            "stream": False
-        }
+        # Give the embedding a moment so a near-duplicate prompt can reuse a cached answer
+        embeddings = match = None
+        if pending_embedding is not None and not conversation.has_history:
+            with timer.stage("embedding_wait"):
+                embeddings = pending_embedding.peek(deadline.within(get_lookup_wait()))
+            with timer.stage("semantic"):
+                match = semantic_cache.lookup_answer(embeddings, model_name, SYSTEM_PROMPT)
+        if match is not None:
+            logger.info(f"Answering from the semantic cache (similarity {match.similarity:.3f})")
+            timer.record("embedding", pending_embedding.seconds)
+            messages.append({"role": "assistant", "content": match.response})
+            with timer.stage("chatlog"):
+                save_chat_log(request, messages, model_name)
+            return JsonResponse({
+                "response": match.response,
+                "cache_hit": True,
+                "semantic_cache_hit": True,
+                "similarity": round(match.similarity, 4),
+                "embeddings_generated": True,
+                "embeddings_length": len(embeddings),
+                "timings": timer.as_dict()
+            })
+
+        # Call Ollama with the system prompt, the history window and the new prompt,
+        # or only the new prompt when the session's KV context can be continued
+        payload = conversation.payload(model_name)
         
         # Log the request payload and URL
         logger.info(f"Sending request to Ollama at URL: {settings.OLLAMA_API_URL}")
         
-        # Use curl command directly since it works reliably in our tests
+        # Use the shared pooled client so the connection to Ollama is reused between requests.
+        # Identical prompts already in flight share one generation instead of sending another.
         try:
-            # Escape double quotes in the prompt for the curl command
-            escaped_prompt = user_prompt.replace('"', '\\"')
+            flight_key = response_cache.make_cache_key(model_name, SYSTEM_PROMPT, user_prompt)
+
+            def generate():
+                # Only the leader of a coalesced prompt waits for a model slot
+                queued_at = time.perf_counter()
+                admission = get_admission_controller()
+                with admission.slot(deadline.within(admission.queue_timeout)):
+                    timer.record("queue", time.perf_counter() - queued_at)
+                    with timer.stage("ollama"):
+                        # Read as a stream so the answer so far can be returned at the deadline,
+                        # hedged on a second backend when the first token is late
+                        client = get_ollama_client()
+                        budgeted = with_budget(payload, deadline)
+                        if conversation.use_context:
+                            stream = client.generate_stream(budgeted, timeout=deadline.within(), hedge=True)
+                        else:
+                            stream = client.chat_stream(budgeted, timeout=deadline.within(), hedge=True)
+                        return collect_stream(stream, deadline, chat=not conversation.use_context)
+
+            generation_started_at = time.perf_counter()
+            if conversation.has_history:
+                result, coalesced = generate(), False
+            else:
+                # A follower waits no longer than this request's deadline
+                result, coalesced = coalesce(flight_key, generate, deadline.within(), reusable=deadline.can_reuse)
+            generation_time = time.perf_counter() - generation_started_at
+            timer.record("generation", generation_time)
+            timer.record_ollama(result)
+            logger.info("Successfully parsed JSON response from Ollama")
+            ai_content = conversation.answer(result)
+            truncated = result.get("truncated", False)
+            conversation.remember(request.session.session_key, model_name, result, ai_content)
+
+            # Join the embedding, which has usually finished during the generation
+            if pending_embedding is not None:
+                with timer.stage("embedding_wait"):
+                    embeddings = pending_embedding.peek(deadline.within())
+                timer.record("embedding", pending_embedding.seconds)
+            
+            # Append AI response to messages
+            messages.append({"role": "assistant", "content": ai_content})
             
-            # Construct the curl command
-            curl_cmd = f'curl -s -X POST "{settings.OLLAMA_API_URL}" -H "Content-Type: application/json" -d "{{\\"model\\":\\"{model_name}\\",\\"prompt\\":\\"{escaped_prompt}\\",\\"stream\\":false}}"'
-            logger.info(f"Executing curl command: {curl_cmd}")
+            # Persist to AWS RDS via Django model
+            with timer.stage("chatlog"):
+                save_chat_log(request, messages, model_name)
+            # The leader of a coalesced generation fills the caches for everyone; a cut-short
+            # answer is not worth reusing
+            if not coalesced and not truncated and not conversation.has_history:
+                with timer.stage("cache_store"):
+                    response_cache.cache_response(model_name, SYSTEM_PROMPT, user_prompt, ai_content)
+                    semantic_cache.remember_answer(embeddings, model_name, SYSTEM_PROMPT, user_prompt, ai_content, generation_time)
             
-            # Execute the curl command
-            result = subprocess.run(curl_cmd, shell=True, capture_output=True, text=True)
+            # Include information about embeddings in the response
+            response_data = {
+                "response": ai_content,
+                "cache_hit": False,
+                "coalesced": coalesced,
+                "truncated": truncated,
+                "embeddings_generated": use_bedrock_embeddings,
+                "history": conversation.stats()
+            }
             
-            if result.returncode != 0:
-                logger.error(f"Curl command failed with return code {result.returncode}")
-                if result.stderr:
-                    logger.error(f"Curl error: {result.stderr}")
-                raise Exception(f"Curl command failed: {result.stderr}")
+            # If embeddings were generated, include the vector length
+            if embeddings is not None:
+                response_data["embeddings_length"] = len(embeddings)
+            response_data["timings"] = timer.as_dict()
+            logger.info(f"Chatbot stage timings: {response_data['timings']}")
             
-            # Parse the JSON response
-            try:
-                response_data = json.loads(result.stdout)
-                logger.info("Successfully parsed JSON response from curl command")
-                ai_content = response_data.get('response', '')
-                
-                # Append AI response to messages
-                messages.append({"role": "assistant", "content": ai_content})
-                
-                # Persist to AWS RDS via Django model
-                chat_log = ChatLog.objects.create(
-                    messages=messages,
-                    model_name=model_name,
-                    user=request.user if request.user.is_authenticated else None,
-                    session_key=request.session.session_key
-                )
-                
-                # Include information about embeddings in the response
-                response_data = {
-                    "response": ai_content,
-                    "embeddings_generated": use_bedrock_embeddings
-                }
-                
-                # If embeddings were generated, include the vector length
-                if use_bedrock_embeddings and 'last_prompt_embeddings' in request.session:
-                    response_data["embeddings_length"] = len(request.session['last_prompt_embeddings'])
-                
-                return JsonResponse(response_data)
-                
-            except json.JSONDecodeError:
-                logger.error(f"Failed to parse JSON response: {result.stdout}")
-                raise Exception("Invalid JSON response from Ollama API")
-                
-        except Exception as e:
-            logger.exception(f"Error using curl command: {str(e)}")
+            return JsonResponse(response_data)
             
-            # Fallback to using requests if curl fails
-            logger.info("Falling back to requests library")
-            try:
-                headers = {'Content-Type': 'application/json'}
-                response = requests.post(
-                    settings.OLLAMA_API_URL, 
-                    json=payload, 
-                    headers=headers,
-                    timeout=120  # Extended timeout
-                )
-                
-                # Log the response status
-                logger.info(f"Requests response status code: {response.status_code}")
-                
-                # Check if the response is successful
-                response.raise_for_status()
-                
-                # Parse the JSON response
-                result = response.json()
-                logger.info("Successfully parsed JSON response from requests")
-                ai_content = result.get('response', '')
-                
-                # Append AI response to messages
-                messages.append({"role": "assistant", "content": ai_content})
-                
-                # Persist to AWS RDS via Django model
-                chat_log = ChatLog.objects.create(
-                    messages=messages,
-                    model_name=model_name,
-                    user=request.user if request.user.is_authenticated else None,
-                    session_key=request.session.session_key
-                )
-                
-                # Include information about embeddings in the response
-                response_data = {
-                    "response": ai_content,
-                    "embeddings_generated": use_bedrock_embeddings
-                }
-                
-                # If embeddings were generated, include the vector length
-                if use_bedrock_embeddings and 'last_prompt_embeddings' in request.session:
-                    response_data["embeddings_length"] = len(request.session['last_prompt_embeddings'])
-                
-                return JsonResponse(response_data)
-                
-            except requests.exceptions.Timeout:
-                logger.error("Request to Ollama API timed out")
-                return JsonResponse({"error": "Request to Ollama API timed out. Please try again later."}, status=504)
-            except requests.exceptions.ConnectionError:
-                logger.error(f"Connection error to Ollama API at {settings.OLLAMA_API_URL}")
-                return JsonResponse({"error": f"Could not connect to Ollama API at {settings.OLLAMA_API_URL}. Please check if the service is running."}, status=503)
-            except requests.exceptions.RequestException as req_err:
-                logger.error(f"Request error: {str(req_err)}")
-                return JsonResponse({"error": f"Request error: {str(req_err)}"}, status=500)
+        except Overloaded as e:
+            logger.warning(f"Rejected chat request: {str(e)}")
+            return overloaded_response(e)
+        except FlightTimeout as e:
+            logger.warning(str(e))
+            return JsonResponse({"error": "Timed out waiting for the answer to an identical request"}, status=504)
+        except requests.exceptions.Timeout:
+            logger.error("Request to Ollama API timed out")
+            return JsonResponse({"error": "Request to Ollama API timed out. Please try again later."}, status=504)
+        except requests.exceptions.ConnectionError:
+            logger.error(f"Connection error to Ollama API at {settings.OLLAMA_API_URL}")
+            return JsonResponse({"error": f"Could not connect to Ollama API at {settings.OLLAMA_API_URL}. Please check if the service is running."}, status=503)
+        except ValueError:
+            logger.error("Failed to parse JSON response from Ollama")
+            return JsonResponse({"error": "Invalid JSON response from Ollama API"}, status=502)
+        except requests.exceptions.RequestException as req_err:
+            logger.error(f"Request error: {str(req_err)}")
+            return JsonResponse({"error": f"Request error: {str(req_err)}"}, status=500)
     
     except Exception as e:
         logger.exception(f"Unexpected error in chatbot_api: {str(e)}")
         return JsonResponse({"error": str(e)}, status=500)
 
-
-def chatbot_ui(request):
-    # Renders the chatbot interface
-    return render(request, "chatbot/chatbot.html")
-
 @csrf_exempt
-def test_ollama_connection(request):
+@timed_view
+def chatbot_stream_api(request):
     """
-    A simple endpoint to test the connection to the Ollama API
+    Streaming variant of chatbot_api.
+    Tokens are relayed from Ollama's NDJSON stream to the browser as Server-Sent
+    Events as soon as they arrive, and the full answer is saved to ChatLog once
+    the stream ends.
     """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
     try:
         # Make sure we have a session key for anonymous users
         if not request.session.session_key:
             request.session.save()
-            
-        logger.info(f"Testing connection to Ollama API at: {settings.OLLAMA_API_URL}")
-        
-        # Test prompt and model
-        test_prompt = "Hello, testing the connection!"
-        model_name = "deepseek-bakery-expert"
-        
-        # Build the conversation array for logging
+
+        timer = get_stage_timer(request)
+        data = json.loads(request.body)
+        user_prompt = data.get('message', '').strip()
+        use_bedrock_embeddings = data.get('use_bedrock_embeddings', True)
+        use_history = data.get('use_history', True)
+        deadline = get_request_deadline(data)
+        logger.info(f"Received streaming user prompt: {user_prompt}")
+
+        model_name = MODEL_NAME
         messages = [
-            {"role": "system", "content": "Connection test."},
-            {"role": "user", "content": test_prompt}
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
         ]
-        
-        # Try using curl first (which we know works from our tests)
+        with timer.stage("history"):
+            conversation = prepare_conversation(
+                request.session.session_key, SYSTEM_PROMPT, user_prompt, model_name, use_history
+            )
+
+        # A cached answer is sent as a single token event
+        cached_content = None
+        if not conversation.has_history:
+            with timer.stage("cache"):
+                cached_content = response_cache.get_cached_response(model_name, SYSTEM_PROMPT, user_prompt)
+        if cached_content is not None:
+            logger.info("Answering streaming request from the response cache")
+            messages.append({"role": "assistant", "content": cached_content})
+            with timer.stage("chatlog"):
+                save_chat_log(request, messages, model_name)
+            events = [
+                sse_event({"token": cached_content}),
+                sse_event({
+                    "cache_hit": True,
+                    "embeddings_generated": False,
+                    "timings": timer.as_dict(),
+                }, event="done"),
+            ]
+            response = StreamingHttpResponse(events, content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        # The embedding runs in the background while tokens stream
+        pending_embedding = start_prompt_embedding(user_prompt) if use_bedrock_embeddings else None
+        store_prompt_embedding_key(request, pending_embedding)
+        embeddings = match = None
+        if pending_embedding is not None and not conversation.has_history:
+            with timer.stage("embedding_wait"):
+                embeddings = pending_embedding.peek(deadline.within(get_lookup_wait()))
+            with timer.stage("semantic"):
+                match = semantic_cache.lookup_answer(embeddings, model_name, SYSTEM_PROMPT)
+        if match is not None:
+            logger.info(f"Answering streaming request from the semantic cache (similarity {match.similarity:.3f})")
+            timer.record("embedding", pending_embedding.seconds)
+            messages.append({"role": "assistant", "content": match.response})
+            with timer.stage("chatlog"):
+                save_chat_log(request, messages, model_name)
+            events = [
+                sse_event({"token": match.response}),
+                sse_event({
+                    "cache_hit": True,
+                    "semantic_cache_hit": True,
+                    "similarity": round(match.similarity, 4),
+                    "embeddings_generated": True,
+                    "embeddings_length": len(embeddings),
+                    "timings": timer.as_dict(),
+                }, event="done"),
+            ]
+            response = StreamingHttpResponse(events, content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            return response
+    except Exception as e:
+        logger.exception(f"Unexpected error in chatbot_stream_api: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+    # Take a model slot before streaming starts so an overloaded server can still answer 429/503
+    admission = get_admission_controller()
+    try:
+        with timer.stage("queue"):
+            admission.acquire(deadline.within(admission.queue_timeout))
+    except Overloaded as e:
+        logger.warning(f"Rejected streaming chat request: {str(e)}")
+        return overloaded_response(e)
+
+    try:
+        payload = with_budget(conversation.payload(model_name), deadline)
+        # Resolve these now: the generator below runs after the view has returned
+        user = request.user if request.user.is_authenticated else None
+        session_key = request.session.session_key
+    except BaseException:
+        # Nothing else gives the slot back until the stream is wrapped below
+        admission.release()
+        raise
+
+    def event_stream():
+        tokens = []
+        chat_log = None
+        generation_started_at = time.perf_counter()
         try:
-            curl_cmd = f'curl -s -X POST "{settings.OLLAMA_API_URL}" -H "Content-Type: application/json" -d "{{\\"model\\":\\"{model_name}\\",\\"prompt\\":\\"{test_prompt}\\",\\"stream\\":false}}"'
-            logger.info(f"Testing with curl command: {curl_cmd}")
-            
-            result = subprocess.run(curl_cmd, shell=True, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                logger.error(f"Curl command failed with return code {result.returncode}")
-                if result.stderr:
-                    logger.error(f"Curl error: {result.stderr}")
-                raise Exception(f"Curl command failed: {result.stderr}")
-            
-            # Try to parse the response as JSON
+            client = get_ollama_client()
+            if conversation.use_context:
+                stream = client.generate_stream(payload, timeout=deadline.within())
+            else:
+                stream = client.chat_stream(payload, timeout=deadline.within())
+            final_chunk = {}
+            truncated = False
             try:
-                response_data = json.loads(result.stdout)
-                logger.info(f"Curl response JSON: {response_data}")
-                
-                # Get the AI response
-                ai_content = response_data.get('response', '')
-                
-                # Append AI response to messages
-                messages.append({"role": "assistant", "content": ai_content})
-                
-                # Store the test in the database
-                chat_log = ChatLog.objects.create(
+                for chunk in stream:
+                    token = conversation.answer(chunk)
+                    if token:
+                        if not tokens:
+                            timer.record("first_token", time.perf_counter() - generation_started_at)
+                        tokens.append(token)
+                        yield sse_event({"token": token})
+                    if chunk.get('done'):
+                        final_chunk = chunk
+                        timer.record_ollama(chunk)
+                        break
+                    if deadline.expired():
+                        logger.warning("Deadline reached while streaming; ending with a partial answer")
+                        truncated = True
+                        break
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                # A read that timed out at the deadline ends the answer like the check above
+                if not tokens or not deadline.expired():
+                    raise
+                truncated = True
+            finally:
+                stream.close()
+            truncated = truncated or final_chunk.get("done_reason") == "length"
+
+            ai_content = ''.join(tokens)
+            conversation.remember(session_key, model_name, final_chunk, ai_content)
+            generation_time = time.perf_counter() - generation_started_at
+            timer.record("generation", generation_time)
+            messages.append({"role": "assistant", "content": ai_content})
+            embeddings = None
+            if pending_embedding is not None:
+                with timer.stage("embedding_wait"):
+                    embeddings = pending_embedding.peek(deadline.within())
+                timer.record("embedding", pending_embedding.seconds)
+
+            # Persist to AWS RDS via Django model (batched by the write-behind writer)
+            with timer.stage("chatlog"):
+                chat_log = persist_chat_log(
                     messages=messages,
                     model_name=model_name,
-                    user=request.user if request.user.is_authenticated else None,
-                    session_key=request.session.session_key,
-                    user_prompt=test_prompt,
-                    ai_response=ai_content
+                    user=user,
+                    session_key=session_key
                 )
-                
-                return JsonResponse({
-                    "status": "success",
-                    "method": "curl",
-                    "message": "Successfully connected to Ollama API using curl",
-                    "api_url": settings.OLLAMA_API_URL,
-                    "response": response_data,
-                    "chat_log_id": chat_log.id
-                })
-            except json.JSONDecodeError:
-                logger.error(f"Failed to decode JSON response from curl. Raw response: {result.stdout}")
-                raise Exception("Invalid JSON response from curl command")
-                
-        except Exception as curl_error:
-            logger.warning(f"Curl method failed: {str(curl_error)}. Trying requests library...")
-            
-            # Fallback to using requests
-            # Simple test payload
-            payload = {
-                "model": model_name,
-                "prompt": test_prompt,
-                "stream": False
-            }
-            
-            # Make the request
-            response = requests.post(
-                settings.OLLAMA_API_URL, 
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=30  # Increased timeout
-            )
-            
-            # Log the response details
-            logger.info(f"Requests response status code: {response.status_code}")
-            logger.info(f"Requests response headers: {response.headers}")
-            
-            # Try to parse the response as JSON
-            try:
-                result = response.json()
-                logger.info(f"Requests response JSON: {result}")
-                
-                # Get the AI response
-                ai_content = result.get('response', '')
-                
-                # Append AI response to messages
-                messages.append({"role": "assistant", "content": ai_content})
-                
-                # Store the test in the database
-                chat_log = ChatLog.objects.create(
+            if not truncated and not conversation.has_history:
+                with timer.stage("cache_store"):
+                    response_cache.cache_response(model_name, SYSTEM_PROMPT, user_prompt, ai_content)
+                    semantic_cache.remember_answer(
+                        embeddings, model_name, SYSTEM_PROMPT, user_prompt, ai_content, generation_time
+                    )
+
+            yield sse_event({
+                "cache_hit": False,
+                "truncated": truncated,
+                "embeddings_generated": use_bedrock_embeddings,
+                "embeddings_length": len(embeddings) if embeddings is not None else 0,
+                "history": conversation.stats(),
+                "timings": timer.as_dict(),
+            }, event="done")
+
+        except GeneratorExit:
+            # The server closes the response when the client disconnects; the stream was
+            # closed on the way out, which made Ollama stop generating
+            if chat_log is None:
+                logger.info(f"Client disconnected after {len(tokens)} tokens; saving the partial answer")
+                get_metrics().observe("cancelled", "stream", time.perf_counter() - generation_started_at)
+                messages.append({"role": "assistant", "content": ''.join(tokens)})
+                persist_chat_log(
                     messages=messages,
                     model_name=model_name,
-                    user=request.user if request.user.is_authenticated else None,
-                    session_key=request.session.session_key,
-                    user_prompt=test_prompt,
-                    ai_response=ai_content
+                    user=user,
+                    session_key=session_key,
+                    cancelled=True
                 )
-                
-                return JsonResponse({
-                    "status": "success",
-                    "method": "requests",
-                    "message": "Successfully connected to Ollama API using requests",
-                    "api_url": settings.OLLAMA_API_URL,
-                    "response": result,
-                    "chat_log_id": chat_log.id
-                })
-            except json.JSONDecodeError:
-                logger.error(f"Failed to decode JSON response. Raw response: {response.text}")
-                return JsonResponse({
-                    "status": "error",
-                    "message": "Connected to API but received invalid JSON response",
-                    "api_url": settings.OLLAMA_API_URL,
-                    "raw_response": response.text
-                }, status=500)
-            
-    except requests.exceptions.Timeout:
-        logger.error("Connection to Ollama API timed out")
-        return JsonResponse({
-            "status": "error",
-            "message": "Connection to Ollama API timed out",
-            "api_url": settings.OLLAMA_API_URL
-        }, status=504)
-    except requests.exceptions.ConnectionError:
-        logger.error(f"Failed to connect to Ollama API at {settings.OLLAMA_API_URL}")
+            raise
+        except requests.exceptions.Timeout:
+            logger.error("Streaming request to Ollama API timed out")
+            yield sse_event({"error": "Request to Ollama API timed out. Please try again later."}, event="error")
+        except requests.exceptions.ConnectionError:
+            logger.error(f"Connection error to Ollama API at {settings.OLLAMA_API_URL}")
+            yield sse_event({"error": f"Could not connect to Ollama API at {settings.OLLAMA_API_URL}. Please check if the service is running."}, event="error")
+        except Exception as e:
+            logger.exception(f"Error streaming from Ollama: {str(e)}")
+            yield sse_event({"error": str(e)}, event="error")
+        finally:
+            timer.commit()
+
+    # The slot is released when the response is closed, even if streaming never started
+    response = StreamingHttpResponse(ReleasingIterator(event_stream(), admission), content_type='text/event-stream')
+    # Stop proxies (nginx, Heroku router) from buffering the stream
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    # Stage timings are recorded once the stream ends, not when the headers go out
+    response.commits_stage_timer = True
+    return response
+
+
+@csrf_exempt
+def chatbot_batch_api(request):
+    """
+    Answer many prompts in one request.
+    Expects {"prompts": [...]} (strings, or objects with "message" and optional "id",
+    "system", "options", "use_cache" and "deadline") and streams one NDJSON line per
+    prompt as it completes, followed by a summary line with "done": true.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+    try:
+        if not request.session.session_key:
+            request.session.save()
+        data = json.loads(request.body)
+        items = parse_batch(data, SYSTEM_PROMPT, getattr(settings, "CHATBOT_BATCH_MAX_ITEMS", 500))
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError too
+        return JsonResponse({"error": str(e)}, status=400)
+    logger.info(f"Received a batch of {len(items)} prompts")
+
+    runner = BatchRunner(
+        items,
+        MODEL_NAME,
+        get_batch_concurrency(),
+        user=request.user if request.user.is_authenticated else None,
+        session_key=request.session.session_key,
+    )
+    lines = (json.dumps(result) + "\n" for result in runner.run())
+    response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def chatbot_ui(request):
+    # Renders the chatbot interface. Served through ASGI it streams from the async
+    # endpoint: the sync one would only be sent once the whole answer is ready.
+    stream_view = "chatbot_stream_api_async" if isinstance(request, ASGIRequest) else "chatbot_stream_api"
+    return render(request, "chatbot/chatbot.html", {"stream_url": reverse(stream_view)})
+
+
+@staff_member_required
+def chatbot_metrics(request):
+    """
+    Staff-only endpoint exposing the chatbot's in-process counters:
+    Ollama admission queue depth and wait times, cache hit rates, coalescing,
+    backend health and cold starts, model warm-up, hedged requests, the ChatLog write-behind buffer,
+    the embedding cache, conversation summaries, stored KV contexts and p50/p95/p99 latency per request stage and per Ollama backend.
+    """
+    semantic = semantic_cache.get_semantic_cache()
+    single_flight = get_single_flight()
+    chat_log_writer = get_chat_log_writer()
+    summarizer = get_summarizer(MODEL_NAME)
+    context_store = get_context_store()
+    hedge_policy = get_ollama_client().hedge_policy
+    embeddings = get_embedding_cache()
+    return JsonResponse({
+        "admission": get_admission_controller().stats(),
+        "semantic_cache": semantic.stats() if semantic else None,
+        "single_flight": single_flight.stats() if single_flight else None,
+        "backends": get_backend_pool().stats(),
+        "hedging": hedge_policy.stats() if hedge_policy else None,
+        "chat_log_writer": chat_log_writer.stats() if chat_log_writer else None,
+        "embedding_backend": get_backend_name(),
+        "embedding_cache": embeddings.stats() if embeddings else None,
+        "model_keeper": get_model_keeper().stats(),
+        "summarizer": summarizer.stats() if summarizer else None,
+        "context_store": context_store.stats() if context_store else None,
+        "latency": get_metrics().snapshot(),
+    })
+
+@csrf_exempt
+def test_ollama_connection(request):
+    """
+    A simple endpoint to test the connection to the Ollama API.
+    Reports whether the chatbot model is loaded on each backend (from /api/ps)
+    instead of running a generation, which could itself trigger a model load.
+    """
+    logger.info(f"Testing connection to Ollama backends: {settings.OLLAMA_BACKENDS}")
+    try:
+        keeper = get_model_keeper()
+        backends = keeper.residency_report(MODEL_NAME)
+        reachable = any(backend["reachable"] for backend in backends)
+        if not reachable:
+            logger.error(f"Failed to connect to any Ollama backend: {settings.OLLAMA_BACKENDS}")
         return JsonResponse({
-            "status": "error",
-            "message": f"Failed to connect to Ollama API at {settings.OLLAMA_API_URL}",
-            "api_url": settings.OLLAMA_API_URL
-        }, status=503)
+            "status": "success" if reachable else "error",
+            "message": (
+                "Successfully connected to Ollama API" if reachable
+                else "Failed to connect to any Ollama backend"
+            ),
+            "api_url": settings.OLLAMA_API_URL,
+            "model": MODEL_NAME,
+            "resident": any(backend["resident"] for backend in backends),
+            "backends": backends,
+            "model_keeper": keeper.stats()
+        }, status=200 if reachable else 503)
     except Exception as e:
         logger.exception(f"Unexpected error testing Ollama connection: {str(e)}")
         return JsonResponse({
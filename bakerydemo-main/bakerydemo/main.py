@@ -1,19 +1,20 @@
 from fastapi import FastAPI, Request
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 import boto3
 import os
 import logging
 from langchain.chains import RetrievalQA
 from langchain_community.llms import Ollama
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import OllamaEmbeddings
 
 from langchain.schema import Document
 from langchain.text_splitter import CharacterTextSplitter
+from langchain_core.embeddings import Embeddings
 
-# Import our custom Bedrock embeddings
+# Import our custom Bedrock embeddings and the other embedding backends
 from bakerydemo.chatbot.bedrock_embeddings import LangChainBedrockEmbeddings
+from bakerydemo.chatbot.embedding_backends import create_embedding_backend
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -26,6 +27,7 @@ class QueryRequest(BaseModel):
     index_id: str
     top_k: int = 5
     use_bedrock: bool = True  # Flag to toggle between Bedrock and Ollama embeddings
+    embedding_backend: Optional[str] = None  # "bedrock", "ollama", "hashing"; overrides use_bedrock
 
 # AWS Kendra query
 def query_kendra(query, index_id, top_k):
@@ -41,29 +43,51 @@ def query_kendra(query, index_id, top_k):
             docs.append(excerpt)
     return docs
 
+class BackendEmbeddings(Embeddings):
+    """
+    LangChain Embeddings over an embedding backend. FAISS only calls embed_query()
+    on an Embeddings instance; anything else it calls as a function.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.backend.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.backend.embed_query(text)
+
 # Get embeddings based on configuration
-def get_embeddings(use_bedrock=True):
+def get_embeddings(use_bedrock=True, backend=None):
     """
     Get the appropriate embeddings model based on configuration.
     
     Args:
         use_bedrock: Whether to use AWS Bedrock Titan Text Embeddings V2 (True) or Ollama (False)
+        backend: A backend of bakerydemo.chatbot.embedding_backends by name (default: from
+            environment variable EMBEDDING_BACKEND, else chosen by use_bedrock)
         
     Returns:
-        An embeddings model instance
+        A LangChain Embeddings instance
     """
-    if use_bedrock:
+    backend = backend or os.getenv("EMBEDDING_BACKEND") or ("bedrock" if use_bedrock else "ollama")
+    if backend == "bedrock":
         logger.info("Using AWS Bedrock Titan Text Embeddings V2 for RAG")
-        return LangChainBedrockEmbeddings(
+        # Cheap to build per query: it reuses the process-wide Bedrock client
+        return BackendEmbeddings(LangChainBedrockEmbeddings(
             model_id="amazon.titan-embed-text-v2",
             region_name=os.getenv("AWS_REGION", "ap-southeast-2")
-        )
-    else:
-        logger.info("Using Ollama embeddings for RAG")
-        return OllamaEmbeddings(model="tinyllama:latest")
+        ))
+    logger.info(f"Using {backend} embeddings for RAG")
+    kwargs = {}
+    if backend == "ollama":
+        kwargs["base_url"] = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+    # Their embed_documents() and embed_query() return lists of floats, as LangChain expects
+    return BackendEmbeddings(create_embedding_backend(backend, **kwargs))
 
 # RAG pipeline
-def rag_query(query: str, index_id: str, top_k: int = 5, use_bedrock: bool = True):
+def rag_query(query: str, index_id: str, top_k: int = 5, use_bedrock: bool = True, embedding_backend: Optional[str] = None):
     # Get documents from Kendra
     docs = query_kendra(query, index_id, top_k)
     documents = [Document(page_content=d) for d in docs]
@@ -73,7 +97,7 @@ def rag_query(query: str, index_id: str, top_k: int = 5, use_bedrock: bool = Tru
     split_docs = splitter.split_documents(documents)
 
     # Get embeddings based on configuration
-    embeddings = get_embeddings(use_bedrock)
+    embeddings = get_embeddings(use_bedrock, embedding_backend)
     
     # Create vector store
     vectorstore = FAISS.from_documents(split_docs, embeddings)
@@ -92,6 +116,7 @@ async def rag_handler(payload: QueryRequest):
         payload.query, 
         payload.index_id, 
         payload.top_k,
-        payload.use_bedrock
+        payload.use_bedrock,
+        payload.embedding_backend
     )
     return {"query": payload.query, "result": result}
@@ -102,6 +102,8 @@ MIDDLEWARE = [
     # Uncomment to enable django-debug-toolbar
     # "debug_toolbar.middleware.DebugToolbarMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    # Above SessionMiddleware so the chatbot's Server-Timing header includes the session save
+    "bakerydemo.chatbot.middleware.ServerTimingMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -134,6 +136,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "bakerydemo.wsgi.application"
+ASGI_APPLICATION = "bakerydemo.asgi.application"
 
 
 # Database
@@ -156,6 +159,150 @@ DATABASES = {
 # Force the correct Ollama API URL
 OLLAMA_API_URL = "http://ec2-54-252-174-64.ap-southeast-2.compute.amazonaws.com:11434/api/generate"
 
+# Ollama hosts requests are spread over (comma-separated), defaulting to OLLAMA_API_URL.
+# OLLAMA_ROUTING is "least_outstanding" or "latency" (EWMA latency x in-flight requests).
+OLLAMA_BACKENDS = env.list("OLLAMA_BACKENDS", default=[OLLAMA_API_URL])
+OLLAMA_ROUTING = env("OLLAMA_ROUTING", default="least_outstanding")
+
+# Backend health checks (seconds between probes of /api/version, 0 disables them) and
+# circuit breakers: consecutive failures that take a backend out, and for how long (seconds)
+OLLAMA_HEALTH_CHECK_INTERVAL = env.int("OLLAMA_HEALTH_CHECK_INTERVAL", default=15)
+OLLAMA_CIRCUIT_FAILURE_THRESHOLD = env.int("OLLAMA_CIRCUIT_FAILURE_THRESHOLD", default=3)
+OLLAMA_CIRCUIT_COOLDOWN = env.int("OLLAMA_CIRCUIT_COOLDOWN", default=30)
+
+# Model warm-up (see bakerydemo/chatbot/model_keeper.py): models preloaded on every backend at
+# startup and refreshed every OLLAMA_WARMUP_INTERVAL seconds (0 disables it), how long Ollama
+# keeps a model loaded after each request, and the load_duration counted as a cold start (seconds)
+OLLAMA_WARM_MODELS = env.list("OLLAMA_WARM_MODELS", default=["deepseek-bakery-expert"])
+OLLAMA_KEEP_ALIVE = env("OLLAMA_KEEP_ALIVE", default="30m")
+OLLAMA_WARMUP_INTERVAL = env.int("OLLAMA_WARMUP_INTERVAL", default=240)
+OLLAMA_COLD_START_THRESHOLD = env.float("OLLAMA_COLD_START_THRESHOLD", default=1.0)
+
+# Context window every generation (and every preload) asks for, 0 for the model's own. It is
+# the same for all requests because Ollama reloads the model whenever num_ctx changes.
+OLLAMA_NUM_CTX = env.int("OLLAMA_NUM_CTX", default=4096)
+
+# Hedged requests (see HedgePolicy in bakerydemo/chatbot/ollama_client.py): a chatbot_api generation
+# with no first token after the QUANTILE of recent first-token times is duplicated on another
+# backend and the slower copy cancelled. Hedges are capped at MAX_RATIO of generations and only
+# start after MIN_SAMPLES first-token times have been seen; they need two or more OLLAMA_BACKENDS.
+OLLAMA_HEDGING = env.bool("OLLAMA_HEDGING", default=False)
+OLLAMA_HEDGE_QUANTILE = env.float("OLLAMA_HEDGE_QUANTILE", default=0.95)
+OLLAMA_HEDGE_MAX_RATIO = env.float("OLLAMA_HEDGE_MAX_RATIO", default=0.05)
+OLLAMA_HEDGE_MIN_SAMPLES = env.int("OLLAMA_HEDGE_MIN_SAMPLES", default=20)
+
+# Shared Ollama client: keep-alive connections kept per host and request timeout (seconds)
+OLLAMA_POOL_SIZE = env.int("OLLAMA_POOL_SIZE", default=10)
+OLLAMA_TIMEOUT = env.int("OLLAMA_TIMEOUT", default=120)
+
+# Admission control in front of Ollama (see bakerydemo/chatbot/admission.py): generations
+# allowed at once across all backends, requests allowed to wait, and how long each may wait (seconds)
+OLLAMA_MAX_CONCURRENT = env.int("OLLAMA_MAX_CONCURRENT", default=4 * len(OLLAMA_BACKENDS))
+OLLAMA_MAX_QUEUE = env.int("OLLAMA_MAX_QUEUE", default=32)
+OLLAMA_QUEUE_TIMEOUT = env.int("OLLAMA_QUEUE_TIMEOUT", default=30)
+
+# Server-side caches. The "chatbot" cache holds exact-match chatbot answers; it is
+# bounded by MAX_ENTRIES here and backed by Redis in production.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "bakerydemo",
+    },
+    "chatbot": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "bakerydemo-chatbot",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
+    },
+}
+
+# Exact-match response cache in front of Ollama (see bakerydemo/chatbot/response_cache.py).
+# The "chatbot" alias is bounded by MAX_ENTRIES here and by Redis maxmemory in production.
+CHATBOT_RESPONSE_CACHE_ENABLED = env.bool("CHATBOT_RESPONSE_CACHE_ENABLED", default=True)
+CHATBOT_RESPONSE_CACHE_ALIAS = "chatbot"
+CHATBOT_RESPONSE_CACHE_TTL = env.int("CHATBOT_RESPONSE_CACHE_TTL", default=60 * 60 * 24)
+# Answers larger than this are not cached
+CHATBOT_RESPONSE_CACHE_MAX_ENTRY_BYTES = 64 * 1024
+
+# Semantic answer cache matching prompts by embedding similarity (see bakerydemo/chatbot/semantic_cache.py)
+CHATBOT_SEMANTIC_CACHE_ENABLED = env.bool("CHATBOT_SEMANTIC_CACHE_ENABLED", default=True)
+CHATBOT_SEMANTIC_CACHE_THRESHOLD = env.float("CHATBOT_SEMANTIC_CACHE_THRESHOLD", default=0.92)
+CHATBOT_SEMANTIC_CACHE_CAPACITY = env.int("CHATBOT_SEMANTIC_CACHE_CAPACITY", default=2000)
+# Mirror entries to the "chatbot" cache (Redis in production) so they survive restarts
+CHATBOT_SEMANTIC_CACHE_PERSIST = env.bool("CHATBOT_SEMANTIC_CACHE_PERSIST", default=False)
+
+# Prompt embeddings run on a thread pool alongside the Ollama generation (see
+# bakerydemo/chatbot/prompt_embeddings.py). A request waits at most SEMANTIC_LOOKUP_WAIT
+# seconds for its embedding before generating without a semantic cache lookup.
+# DIMENSIONS is Titan V2's 1024, 512 or 256; smaller vectors are cheaper to store and
+# compare at some cost in recall (see benchmarks/bench_embedding_recall.py).
+CHATBOT_EMBEDDING_WORKERS = env.int("CHATBOT_EMBEDDING_WORKERS", default=8)
+CHATBOT_SEMANTIC_LOOKUP_WAIT = env.float("CHATBOT_SEMANTIC_LOOKUP_WAIT", default=0.25)
+CHATBOT_EMBEDDING_DIMENSIONS = env.int("CHATBOT_EMBEDDING_DIMENSIONS", default=1024)
+
+# Embedding backend of the prompt embeddings (see bakerydemo/chatbot/embedding_backends.py):
+# "bedrock" (Titan V2), "ollama" (the model in OLLAMA_EMBEDDING_MODEL) or "hashing", a local CPU
+# backend with no network round-trip for latency-sensitive deployments and tests.
+# Its similarities are lexical, so CHATBOT_SEMANTIC_CACHE_THRESHOLD may need retuning;
+# compare the backends with benchmarks/bench_embedding_backends.py.
+CHATBOT_EMBEDDING_BACKEND = env("CHATBOT_EMBEDDING_BACKEND", default="bedrock")
+
+# Prompt embeddings are kept as binary blobs in the PromptEmbedding table (see
+# bakerydemo/chatbot/embedding_store.py); the session only holds their key.
+# DTYPE is "float32", "float16" or "int8".
+CHATBOT_EMBEDDING_STORE_ENABLED = env.bool("CHATBOT_EMBEDDING_STORE_ENABLED", default=True)
+CHATBOT_EMBEDDING_STORE_DTYPE = env("CHATBOT_EMBEDDING_STORE_DTYPE", default="float32")
+
+# Coalesce identical in-flight prompts into one Ollama generation (see bakerydemo/chatbot/singleflight.py).
+# DISTRIBUTED also coalesces across processes through a lock in the "chatbot" cache (Redis in production).
+CHATBOT_SINGLE_FLIGHT_ENABLED = env.bool("CHATBOT_SINGLE_FLIGHT_ENABLED", default=True)
+CHATBOT_SINGLE_FLIGHT_DISTRIBUTED = env.bool("CHATBOT_SINGLE_FLIGHT_DISTRIBUTED", default=False)
+
+# Write-behind ChatLog persistence (see bakerydemo/chatbot/chatlog_writer.py): logs are
+# inserted with bulk_create every FLUSH_INTERVAL seconds or BATCH_SIZE logs, whichever comes first
+CHATBOT_CHATLOG_WRITE_BEHIND = env.bool("CHATBOT_CHATLOG_WRITE_BEHIND", default=True)
+CHATBOT_CHATLOG_BATCH_SIZE = env.int("CHATBOT_CHATLOG_BATCH_SIZE", default=50)
+CHATBOT_CHATLOG_FLUSH_INTERVAL = env.float("CHATBOT_CHATLOG_FLUSH_INTERVAL", default=1.0)
+CHATBOT_CHATLOG_MAX_PENDING = env.int("CHATBOT_CHATLOG_MAX_PENDING", default=10000)
+
+# Multi-turn chat (see bakerydemo/chatbot/conversation.py): estimated tokens of earlier turns
+# sent with each prompt (oldest dropped first), most turns read back from ChatLog, and whether
+# dropped turns are folded into a rolling summary (kept in the chatbot cache for SUMMARY_TTL seconds)
+CHATBOT_HISTORY_TOKEN_BUDGET = env.int("CHATBOT_HISTORY_TOKEN_BUDGET", default=1024)
+CHATBOT_HISTORY_MAX_TURNS = env.int("CHATBOT_HISTORY_MAX_TURNS", default=20)
+CHATBOT_HISTORY_SUMMARY = env.bool("CHATBOT_HISTORY_SUMMARY", default=False)
+CHATBOT_HISTORY_SUMMARY_TTL = env.int("CHATBOT_HISTORY_SUMMARY_TTL", default=60 * 60 * 24)
+
+# KV context reuse (see bakerydemo/chatbot/context_store.py): chat turns go through /api/generate
+# and continue from the session's previous context while it is current. Off by default: contexts
+# live in one worker's memory, so with several workers most turns miss and are rebuilt from the
+# history window anyway. MAX_TOKENS should stay below the model's num_ctx and well above
+# CHATBOT_HISTORY_TOKEN_BUDGET, since a context that outgrows it is rebuilt from the history
+# window. The store is bounded by sessions and total tokens, and unused contexts expire after
+# CONTEXT_TTL seconds.
+CHATBOT_CONTEXT_REUSE = env.bool("CHATBOT_CONTEXT_REUSE", default=False)
+CHATBOT_CONTEXT_MAX_TOKENS = env.int("CHATBOT_CONTEXT_MAX_TOKENS", default=2048)
+CHATBOT_CONTEXT_MAX_SESSIONS = env.int("CHATBOT_CONTEXT_MAX_SESSIONS", default=1000)
+CHATBOT_CONTEXT_MAX_TOTAL_TOKENS = env.int("CHATBOT_CONTEXT_MAX_TOTAL_TOKENS", default=2_000_000)
+CHATBOT_CONTEXT_TTL = env.int("CHATBOT_CONTEXT_TTL", default=30 * 60)
+
+# Batch endpoint (see bakerydemo/chatbot/batch.py): most prompts per request, and prompts of one
+# batch worked on at once (default: half of OLLAMA_MAX_CONCURRENT, so a batch leaves the other
+# admission slots to interactive requests; each prompt still waits for a slot)
+CHATBOT_BATCH_MAX_ITEMS = env.int("CHATBOT_BATCH_MAX_ITEMS", default=500)
+CHATBOT_BATCH_CONCURRENCY = env.int("CHATBOT_BATCH_CONCURRENCY", default=0)
+
+# Request deadlines (see bakerydemo/chatbot/deadline.py): seconds a chat request may take, by
+# default and at most (clients can ask for less with "deadline"), and seconds kept back for
+# saving and answering. num_predict is what the backends can generate in the time left, at
+# their measured rate (DEFAULT_*_RATE tokens/s until one is measured), within MIN/MAX_PREDICT.
+CHATBOT_REQUEST_DEADLINE = env.float("CHATBOT_REQUEST_DEADLINE", default=60)
+CHATBOT_MAX_REQUEST_DEADLINE = env.float("CHATBOT_MAX_REQUEST_DEADLINE", default=120)
+CHATBOT_DEADLINE_RESERVE = env.float("CHATBOT_DEADLINE_RESERVE", default=0.5)
+CHATBOT_MIN_PREDICT = env.int("CHATBOT_MIN_PREDICT", default=32)
+CHATBOT_MAX_PREDICT = env.int("CHATBOT_MAX_PREDICT", default=1024)
+CHATBOT_DEFAULT_EVAL_RATE = env.float("CHATBOT_DEFAULT_EVAL_RATE", default=20.0)
+CHATBOT_DEFAULT_PROMPT_RATE = env.float("CHATBOT_DEFAULT_PROMPT_RATE", default=200.0)
+
 # Password validation
 # https://docs.djangoproject.com/en/stable/ref/settings/#auth-password-validators
 
@@ -0,0 +1,25 @@
+"""
+Settings for the offline load test (benchmarks/load_test.py).
+The dev settings on a local SQLite database, so no RDS instance is needed. The
+Ollama backends and the Bedrock endpoint are the stub servers the load test
+starts and passes in through the environment.
+"""
+
+import os
+import tempfile
+
+from .dev import *  # noqa: F403, F401
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.getenv("LOADTEST_DATABASE", os.path.join(tempfile.gettempdir(), "bakerydemo-loadtest.sqlite3")),
+        # Concurrent requests queue for SQLite's single writer instead of failing
+        "OPTIONS": {"timeout": 30},
+    }
+}
+
+# Read again in case local.py pointed them elsewhere
+OLLAMA_BACKENDS = env.list("OLLAMA_BACKENDS", default=OLLAMA_BACKENDS)  # noqa: F405
+OLLAMA_API_URL = OLLAMA_BACKENDS[0]
+OLLAMA_WARMUP_INTERVAL = 0
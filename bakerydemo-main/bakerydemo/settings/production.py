@@ -78,6 +78,19 @@ if REDIS_URL:
             "LOCATION": REDIS_URL + "/1",
             "OPTIONS": redis_options,
         },
+        # Chatbot answers get their own database so they can be flushed
+        # independently of the page cache. Redis does not bound a database, only
+        # a whole instance: the instance must run with maxmemory and an LRU
+        # maxmemory-policy, or the answers grow until Redis refuses writes.
+        # volatile-lru suits a shared instance (every chatbot entry has a TTL);
+        # CHATBOT_REDIS_URL points the answers at a dedicated instance instead,
+        # e.g. one run with --maxmemory 256mb --maxmemory-policy allkeys-lru.
+        "chatbot": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": os.environ.get("CHATBOT_REDIS_URL", REDIS_URL + "/2"),
+            "TIMEOUT": CHATBOT_RESPONSE_CACHE_TTL,
+            "OPTIONS": redis_options,
+        },
     }
     DJANGO_REDIS_LOG_IGNORED_EXCEPTIONS = True
 else:
@@ -85,7 +98,13 @@ else:
         "default": {
             "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
             "LOCATION": "bakerydemo",
-        }
+        },
+        "chatbot": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "bakerydemo-chatbot",
+            "TIMEOUT": CHATBOT_RESPONSE_CACHE_TTL,
+            "OPTIONS": {"MAX_ENTRIES": 1000},
+        },
     }
 
 # Configure Elasticsearch, if present in os.environ
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Benchmark what BedrockEmbeddings costs to build, and an embedding request end to
+end, with a fresh boto3 Session and client per instance (as chatbot_api used to
+do) and with the shared client from get_bedrock_client().
+
+Runs against the local stub Bedrock server, so the numbers are client overhead:
+credential resolution, endpoint loading and connection setup.
+
+    python benchmarks/bench_bedrock_client.py --requests 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import FakeBedrockServer  # noqa: E402
+
+from bakerydemo.chatbot.bedrock_embeddings import (  # noqa: E402
+    BedrockEmbeddings,
+    create_bedrock_client,
+)
+
+REGION = "ap-southeast-2"
+PROMPT = "What time does the bakery open on Sundays?"
+
+
+def time_calls(func, count):
+    """Call func count times and return the per-call durations in milliseconds."""
+    durations = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def fresh_embeddings(endpoint_url):
+    """A BedrockEmbeddings with a client of its own, built the way it was before sharing."""
+    embeddings = BedrockEmbeddings.__new__(BedrockEmbeddings)
+    embeddings.model_id = "amazon.titan-embed-text-v2:0"
+    embeddings.region_name = REGION
+    embeddings.cache = None
+    embeddings.bedrock_client = boto3.Session().client(
+        service_name="bedrock-runtime", region_name=REGION, endpoint_url=endpoint_url
+    )
+    return embeddings
+
+
+def shared_embeddings(endpoint_url):
+    return BedrockEmbeddings(region_name=REGION, endpoint_url=endpoint_url, use_cache=False)
+
+
+def report(name, durations, baseline=None):
+    mean = statistics.mean(durations)
+    p50 = statistics.median(durations)
+    line = f"{name:<28} mean {mean:8.3f} ms   p50 {p50:8.3f} ms"
+    if baseline is not None:
+        line += f"   saved {baseline - mean:8.3f} ms/request"
+    print(line)  # noqa: T201
+    return mean
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Bedrock client construction against a local stub")
+    parser.add_argument("--requests", type=int, default=100, help="Iterations per method")
+    args = parser.parse_args()
+
+    # botocore signs every request, so it needs credentials even for the stub
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    server = FakeBedrockServer().start()
+    try:
+        print(f"Stub Bedrock at {server.url}, {args.requests} iterations per method")  # noqa: T201
+        # Load botocore's service models once, so neither side pays for the first import
+        create_bedrock_client(REGION, endpoint_url=server.url)
+
+        print("construction")  # noqa: T201
+        baseline = report("  fresh session + client", time_calls(lambda: fresh_embeddings(server.url), args.requests))
+        report("  shared client", time_calls(lambda: shared_embeddings(server.url), args.requests), baseline)
+
+        print("construction + embed_query")  # noqa: T201
+        baseline = report(
+            "  fresh session + client",
+            time_calls(lambda: fresh_embeddings(server.url).embed_query(PROMPT), args.requests),
+        )
+        report(
+            "  shared client",
+            time_calls(lambda: shared_embeddings(server.url).embed_query(PROMPT), args.requests),
+            baseline,
+        )
+    finally:
+        server.stop()
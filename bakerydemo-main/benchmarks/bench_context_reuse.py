@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Compare prompt evaluation across multi-turn conversations with and without KV
+context reuse.
+
+"history" sends the system prompt and every earlier turn to /api/chat on each
+turn, so Ollama evaluates the whole conversation again. "context" sends only the
+new prompt to /api/generate together with the context returned by the previous
+turn. Prompt-eval counts and durations are taken from Ollama's own timing fields.
+
+Runs against the stub server, which processes prompts at --prompt-rate tokens per
+second, or against a real Ollama host with --ollama-url:
+
+    python benchmarks/bench_context_reuse.py --conversations 5 --turns 10
+    python benchmarks/bench_context_reuse.py --ollama-url http://localhost:11434 --model deepseek-bakery-expert
+"""
+import argparse
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bakerydemo.settings.dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+from stub_servers import FakeOllamaServer  # noqa: E402
+
+from bakerydemo.chatbot.context_store import ContextStore  # noqa: E402
+from bakerydemo.chatbot.conversation import Turn, build_conversation  # noqa: E402
+from bakerydemo.chatbot.ollama_client import OllamaClient  # noqa: E402
+from bakerydemo.chatbot.views import SYSTEM_PROMPT  # noqa: E402
+
+QUESTIONS = [
+    "What breads do you bake every morning?",
+    "Which of those are made with sourdough?",
+    "How long do you ferment the sourdough?",
+    "Do you sell rye bread as well?",
+    "Is the rye loaf suitable for someone avoiding wheat?",
+    "What do you recommend with soup?",
+    "Can I order a large batch for Saturday?",
+    "How early do I need to place that order?",
+    "Do you deliver to the city centre?",
+    "What time do you close on Saturdays?",
+]
+
+
+def run_conversation(client, model, turns, reuse_context, session_key):
+    """Hold one conversation and return (prompt_eval_count, prompt_eval_ms) per turn."""
+    store = ContextStore()
+    history = []
+    results = []
+    for index in range(turns):
+        question = QUESTIONS[index % len(QUESTIONS)]
+        # An unlimited budget: every earlier turn is sent when the context is not reused
+        conversation = build_conversation(SYSTEM_PROMPT, history, question, token_budget=10**9)
+        if reuse_context:
+            conversation.use_context = True
+            conversation.context = store.get(session_key, model, conversation.last_turn)
+            result = client.generate(dict(conversation.payload(model), options={"num_predict": 64}))
+        else:
+            result = client.chat(dict(conversation.payload(model), options={"num_predict": 64}))
+        answer = conversation.answer(result)
+        if reuse_context and result.get("context"):
+            store.put(session_key, model, result["context"], (question, answer), index + 1)
+        history.append(Turn(question, answer))
+        results.append((result.get("prompt_eval_count", 0), result.get("prompt_eval_duration", 0) / 1e6))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prompt evaluation with and without KV context reuse")
+    parser.add_argument("--conversations", type=int, default=5, help="Conversations per mode")
+    parser.add_argument("--turns", type=int, default=10, help="Turns per conversation")
+    parser.add_argument("--prompt-rate", type=float, default=400.0, help="Stub prompt tokens per second")
+    parser.add_argument("--ollama-url", help="Benchmark a real Ollama host instead of the stub")
+    parser.add_argument("--model", default="deepseek-bakery-expert", help="Model to chat with")
+    args = parser.parse_args()
+
+    server = None
+    if args.ollama_url:
+        url = args.ollama_url
+    else:
+        server = FakeOllamaServer(prompt_rate=args.prompt_rate).start()
+        url = server.url
+    client = OllamaClient(url, pool_size=2, timeout=300)
+    try:
+        totals = {}
+        for mode, reuse_context in (("history", False), ("context", True)):
+            runs = [
+                run_conversation(client, args.model, args.turns, reuse_context, f"bench-{mode}-{n}")
+                for n in range(args.conversations)
+            ]
+            print(f"\n{mode}: per turn, mean over {args.conversations} conversations")  # noqa: T201
+            print(f"{'turn':>6}{'prompt tokens':>16}{'prompt eval ms':>18}")  # noqa: T201
+            for turn in range(args.turns):
+                counts = [run[turn][0] for run in runs]
+                durations = [run[turn][1] for run in runs]
+                print(f"{turn + 1:>6}{statistics.mean(counts):>16.0f}{statistics.mean(durations):>18.1f}")  # noqa: T201
+            totals[mode] = (
+                statistics.mean(sum(count for count, _ in run) for run in runs),
+                statistics.mean(sum(ms for _, ms in run) for run in runs),
+            )
+
+        print(f"\n{'mode':<10}{'prompt tokens':>16}{'prompt eval ms':>18}   per conversation")  # noqa: T201
+        for mode, (count, ms) in totals.items():
+            print(f"{mode:<10}{count:>16.0f}{ms:>18.1f}")  # noqa: T201
+    finally:
+        client.close()
+        if server is not None:
+            server.stop()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Benchmark BedrockEmbeddings.embed_documents: the old serial loop of embed_query
+calls against the concurrent, rate-limited implementation.
+
+Runs against the local stub Bedrock server with a per-request latency standing in
+for the network round-trip, and optionally a requests-per-second quota beyond
+which it answers ThrottlingException, to show the token bucket adapting to it.
+
+    python benchmarks/bench_embed_documents.py --documents 500 --latency 0.05 --max-rps 100
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import FakeBedrockServer, embedding_for  # noqa: E402
+
+from bakerydemo.chatbot.bedrock_embeddings import BedrockEmbeddings, TokenBucket  # noqa: E402
+
+
+def documents(count):
+    return [f"Chunk {n} of the bakery's pages: opening hours, breads and recipes." for n in range(count)]
+
+
+def run(name, func, texts, server):
+    requests_before, throttled_before = server.requests, server.throttled
+    start = time.perf_counter()
+    embeddings = func(texts)
+    elapsed = time.perf_counter() - start
+    in_order = all(embedding == embedding_for(text) for embedding, text in zip(embeddings, texts))
+    print(  # noqa: T201
+        f"{name:<28}{elapsed:>9.2f} s{len(texts) / elapsed:>11.1f} docs/s"
+        f"{server.requests - requests_before:>10}{server.throttled - throttled_before:>11}"
+        f"{'yes' if in_order and len(embeddings) == len(texts) else 'NO':>10}"
+    )
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark embed_documents against a local stub")
+    parser.add_argument("--documents", type=int, default=300, help="Documents to embed")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub seconds per request")
+    parser.add_argument("--max-rps", type=float, default=0, help="Stub quota in requests per second (0: none)")
+    parser.add_argument("--rate", type=float, default=200, help="Token bucket requests per second")
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 8, 16], help="Thread pool sizes to try")
+    parser.add_argument("--skip-serial", action="store_true", help="Skip the serial baseline")
+    args = parser.parse_args()
+
+    # botocore signs every request, so it needs credentials even for the stub
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("BEDROCK_MAX_POOL_CONNECTIONS", str(max(args.workers)))
+    server = FakeBedrockServer(latency=args.latency, max_rps=args.max_rps).start()
+    try:
+        # Uncached, so every run sends every document to the stub
+        embeddings = BedrockEmbeddings(endpoint_url=server.url, use_cache=False)
+        texts = documents(args.documents)
+        print(  # noqa: T201
+            f"Stub Bedrock at {server.url}: {args.latency * 1000:.0f} ms per request, "
+            f"quota {args.max_rps or 'none'} req/s, {args.documents} documents"
+        )
+        print(f"{'method':<28}{'elapsed':>11}{'throughput':>18}{'requests':>10}{'throttled':>11}{'in order':>10}")  # noqa: T201
+
+        if not args.skip_serial:
+            run("serial embed_query", lambda texts: [embeddings.embed_query(text) for text in texts], texts, server)
+        for workers in args.workers:
+            # A fresh bucket per run, so one run's backoff does not slow the next
+            bucket = TokenBucket(args.rate)
+            run(
+                f"embed_documents x{workers}",
+                lambda texts: embeddings.embed_documents(texts, max_workers=workers, rate_limiter=bucket),
+                texts,
+                server,
+            )
+            if bucket.throttles:
+                print(f"{'':<4}throttled {bucket.throttles} times, rate settled at {bucket.rate:.1f}/s")  # noqa: T201
+    finally:
+        server.stop()
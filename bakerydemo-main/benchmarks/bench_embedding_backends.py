@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Benchmark the embedding backends of bakerydemo/chatbot/embedding_backends.py on
+the same work: the latency of embedding one prompt (the chatbot's hot path), the
+throughput of embedding the bakery pages of the demo fixture, and retrieval
+quality as hit@k, the share of page titles whose k nearest passages include one
+of the page's own.
+
+The local "hashing" backend runs in-process. "bedrock" and "ollama" run against
+the local stub servers, with --latency standing in for the network round-trip;
+their vectors are random, so their hit@k only exercises the code. Use --live to
+call the real services instead (AWS credentials, OLLAMA_HOST).
+
+    python benchmarks/bench_embedding_backends.py --backends hashing bedrock ollama --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_embedding_recall import load_pages, top_k  # noqa: E402
+from stub_servers import FakeBedrockServer, FakeOllamaServer  # noqa: E402
+
+from bakerydemo.chatbot.embedding_backends import (  # noqa: E402
+    OUTPUT_FLOAT32,
+    create_embedding_backend,
+    get_backend_names,
+)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000
+
+
+def hit_rate(backend, pages, k, dimensions):
+    """Share of titles with a passage of their own page among the k nearest."""
+    corpus = [passage for _, chunks in pages for passage in chunks]
+    owners = np.array([page for page, (_, chunks) in enumerate(pages) for _ in chunks])
+    docs = backend.embed_documents(corpus, dimensions=dimensions, output=OUTPUT_FLOAT32)
+    queries = backend.embed_documents([title for title, _ in pages], dimensions=dimensions, output=OUTPUT_FLOAT32)
+    found = top_k(queries @ docs.T, k)
+    return float(np.mean([page in owners[row] for page, row in enumerate(found)])), len(corpus)
+
+
+def run(name, backend, pages, args):
+    # Distinct prompts, so no backend answers from a cache
+    prompts = [f"{pages[n % len(pages)][0]}? Request {n}" for n in range(args.queries)]
+    backend.embed_query("warm up", dimensions=args.dimensions)
+    latencies = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        backend.embed_query(prompt, dimensions=args.dimensions, output=OUTPUT_FLOAT32)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    hits, documents = hit_rate(backend, pages, args.k, args.dimensions)
+    elapsed = time.perf_counter() - start
+    print(  # noqa: T201
+        f"{name:<10}{backend.model_id:<32}{percentile(latencies, 50):>9.2f}{percentile(latencies, 95):>9.2f}"
+        f"{(documents + len(pages)) / elapsed:>12.1f}{hits:>9.3f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the embedding backends")
+    parser.add_argument("--backends", nargs="+", default=["hashing", "bedrock", "ollama"], choices=get_backend_names())
+    parser.add_argument("--queries", type=int, default=200, help="Single prompts embedded for the latency figures")
+    parser.add_argument("--dimensions", type=int, default=1024)
+    parser.add_argument("--k", type=int, default=5, help="Passages retrieved per title")
+    parser.add_argument("--latency", type=float, default=0.05, help="Per-request latency of the stub servers")
+    parser.add_argument("--live", action="store_true", help="Call Bedrock and Ollama instead of the stub servers")
+    args = parser.parse_args()
+
+    servers = []
+    options = {"hashing": {}, "bedrock": {"use_cache": False}, "ollama": {}}
+    if not args.live:
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+        bedrock, ollama = FakeBedrockServer(latency=args.latency).start(), FakeOllamaServer(latency=args.latency).start()
+        servers = [bedrock, ollama]
+        options["bedrock"]["endpoint_url"] = bedrock.url
+        options["ollama"]["base_url"] = ollama.url
+    elif "ollama" in args.backends:
+        options["ollama"]["base_url"] = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+    try:
+        pages = load_pages()
+        print(f"{len(pages)} pages, {args.dimensions} dimensions, {'live services' if args.live else f'stub servers at {args.latency * 1000:.0f} ms'}")  # noqa: T201
+        print(f"{'backend':<10}{'model':<32}{'p50 ms':>9}{'p95 ms':>9}{'texts/s':>12}{f'hit@{args.k}':>9}")  # noqa: T201
+        for name in args.backends:
+            run(name, create_embedding_backend(name, **options.get(name, {})), pages, args)
+    finally:
+        for server in servers:
+            server.stop()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+Benchmark the embedding output modes of BedrockEmbeddings: recall against memory.
+
+Embeds the text of the bakery pages in the demo fixture (breads, recipes, blog
+posts, locations) as passages, and the page titles and promoted search queries as
+queries. The top-k passages by cosine similarity of the 1024-dimension float
+embeddings are the reference; every other mode (512 and 256 dimensions, binary
+embeddings ranked by Hamming distance, binary candidates rescored with the float
+vectors) is scored by how many of them it finds. Memory is the size of one vector:
+a list of Python floats, a float32 array or packed bits.
+
+Needs Bedrock access (AWS credentials), or --stub to run against the local stub
+server; the stub's vectors are random, so its recall numbers only exercise the code.
+
+    python benchmarks/bench_embedding_recall.py --k 5
+"""
+import argparse
+import html
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import FakeBedrockServer  # noqa: E402
+
+from bakerydemo.chatbot.bedrock_embeddings import (  # noqa: E402
+    OUTPUT_BINARY,
+    OUTPUT_FLOAT32,
+    BedrockEmbeddings,
+)
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bakerydemo", "base", "fixtures", "bakerydemo.json")
+PAGE_MODELS = ("breads.breadpage", "blog.blogpage", "locations.locationpage", "recipes.recipepage", "base.standardpage")
+
+
+def strings(value):
+    """Every string inside a fixture field, including StreamField JSON."""
+    if isinstance(value, str):
+        if value.startswith("["):
+            try:
+                yield from strings(json.loads(value))
+                return
+            except ValueError:
+                pass
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from strings(item)
+
+
+def clean(text):
+    return re.sub(r"\s+", " ", html.unescape(re.sub(r"<[^>]+>", " ", text))).strip()
+
+
+def passages(text, size=400):
+    """Split text into passages of whole sentences, about size characters each."""
+    chunks, current = [], ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        if current and len(current) + len(sentence) > size:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def load_corpus():
+    """Passages of the bakery pages, and queries from page titles and search promotions."""
+    with open(FIXTURE) as fixture:
+        objects = json.load(fixture)
+    page_ids = {obj["pk"] for obj in objects if obj["model"] in PAGE_MODELS}
+    corpus, queries = [], []
+    for obj in objects:
+        if obj["model"] in PAGE_MODELS:
+            text = clean(" ".join(s for s in strings(obj["fields"]) if len(s) > 30 and not s.startswith("http")))
+            corpus.extend(passage for passage in passages(text) if len(passage) > 60)
+        elif obj["model"] == "wagtailcore.page" and obj["pk"] in page_ids:
+            queries.append(obj["fields"]["title"])
+        elif obj["model"] == "wagtailsearchpromotions.query":
+            queries.append(obj["fields"]["query_string"])
+    return list(dict.fromkeys(corpus)), list(dict.fromkeys(queries))
+
+
+def load_pages():
+    """The bakery pages as (title, passages), for benchmarks that need to know which passages a title finds."""
+    with open(FIXTURE) as fixture:
+        objects = json.load(fixture)
+    texts = {
+        obj["pk"]: clean(" ".join(s for s in strings(obj["fields"]) if len(s) > 30 and not s.startswith("http")))
+        for obj in objects if obj["model"] in PAGE_MODELS
+    }
+    titles = {obj["pk"]: obj["fields"]["title"] for obj in objects if obj["model"] == "wagtailcore.page" and obj["pk"] in texts}
+    pages = [(titles[pk], [passage for passage in passages(text) if len(passage) > 60]) for pk, text in texts.items() if pk in titles]
+    return [(title, chunks) for title, chunks in pages if chunks]
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores in every row."""
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def hamming_scores(queries, documents):
+    """Negative Hamming distances between rows of packed bits."""
+    distances = np.unpackbits(queries[:, None, :] ^ documents[None, :, :], axis=2).sum(axis=2)
+    return -distances.astype(np.float32)
+
+
+def recall(found, reference):
+    k = reference.shape[1]
+    return float(np.mean([len(set(f) & set(r)) / k for f, r in zip(found, reference)]))
+
+
+def list_bytes(dimensions):
+    """Size of an embedding as json.loads() returns it: a list of Python floats."""
+    vector = [float(n) / 3 for n in range(dimensions)]
+    return sys.getsizeof(vector) + sum(sys.getsizeof(value) for value in vector)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall against memory of the embedding output modes")
+    parser.add_argument("--k", type=int, default=5, help="Passages retrieved per query")
+    parser.add_argument("--rescore", type=int, default=4, help="Binary candidates per result rescored with floats")
+    parser.add_argument("--stub", action="store_true", help="Use the local stub Bedrock server")
+    args = parser.parse_args()
+
+    server = None
+    if args.stub:
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+        server = FakeBedrockServer().start()
+    try:
+        # Stub vectors must not end up in the persistent embedding cache
+        embeddings = BedrockEmbeddings(endpoint_url=server.url if server else None, use_cache=server is None)
+        corpus, queries = load_corpus()
+        print(f"{len(corpus)} passages, {len(queries)} queries, recall@{args.k} against 1024-dimension floats")  # noqa: T201
+
+        def embed(texts, dimensions, output):
+            return embeddings.embed_documents(texts, dimensions=dimensions, output=output)
+
+        reference_docs = embed(corpus, 1024, OUTPUT_FLOAT32)
+        reference_queries = embed(queries, 1024, OUTPUT_FLOAT32)
+        reference = top_k(reference_queries @ reference_docs.T, args.k)
+
+        baseline = list_bytes(1024)
+
+        def row(name, size, score):
+            print(f"{name:<30}{size:>14}{baseline / size:>9.0f}x{score:>9.3f}")  # noqa: T201
+
+        print(f"{'mode':<30}{'bytes/vector':>14}{'vs list':>10}{'recall':>9}")  # noqa: T201
+        row("1024 floats, list", baseline, 1.0)
+        row("1024 float32", reference_docs[0].nbytes, 1.0)
+        for dimensions in (512, 256):
+            docs, found_queries = embed(corpus, dimensions, OUTPUT_FLOAT32), embed(queries, dimensions, OUTPUT_FLOAT32)
+            row(f"{dimensions} float32", docs[0].nbytes, recall(top_k(found_queries @ docs.T, args.k), reference))
+        for dimensions in (1024, 512, 256):
+            docs, found_queries = embed(corpus, dimensions, OUTPUT_BINARY), embed(queries, dimensions, OUTPUT_BINARY)
+            scores = hamming_scores(found_queries, docs)
+            row(f"{dimensions} binary", docs[0].nbytes, recall(top_k(scores, args.k), reference))
+            if dimensions == 1024:
+                # Shortlist by Hamming distance, then order the shortlist by the float vectors
+                shortlist = top_k(scores, args.k * args.rescore)
+                rescored = [
+                    candidates[np.argsort(-(reference_docs[candidates] @ query))[:args.k]]
+                    for candidates, query in zip(shortlist, reference_queries)
+                ]
+                # The shortlist's float vectors are read from storage, so memory stays at the bits
+                row(f"1024 binary + rescore x{args.rescore}", docs[0].nbytes, recall(rescored, reference))
+    finally:
+        if server:
+            server.stop()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Measure what keeping the prompt embedding out of the session saves.
+
+Compares the encoded session written on every chat turn (signed JSON for the
+database backend, pickle for the cache/Redis backend) when it carries the full
+Titan vector against when it carries only an embedding store key, and reports
+the size and fidelity of each blob type in the embedding store.
+
+    python benchmarks/bench_embedding_store.py --dimensions 1024
+"""
+import argparse
+import os
+import pickle
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bakerydemo.settings.dev")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.sessions.backends.db import SessionStore  # noqa: E402
+
+from bakerydemo.chatbot import embedding_store  # noqa: E402
+from bakerydemo.chatbot.models import PromptEmbedding  # noqa: E402
+
+PROMPT = "What time does the bakery open on Sundays?"
+
+
+def titan_like_vector(dimensions, seed=0):
+    """A unit vector of Python floats, as json.loads() returns it from Bedrock."""
+    vector = np.random.default_rng(seed).normal(size=dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def session_sizes(session_dict):
+    """Bytes written for a session by the database and the cache backends."""
+    return len(SessionStore().encode(session_dict)), len(pickle.dumps(session_dict, pickle.HIGHEST_PROTOCOL))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Session size with and without the prompt embedding")
+    parser.add_argument("--dimensions", type=int, default=1024, help="Embedding dimensions")
+    args = parser.parse_args()
+
+    vector = titan_like_vector(args.dimensions)
+    # A typical session: auth plus the chatbot's own keys
+    base = {"_auth_user_id": "1", "_auth_user_backend": "django.contrib.auth.backends.ModelBackend"}
+    before = dict(base, **{embedding_store.LEGACY_SESSION_KEY: vector})
+    after = dict(base, **{embedding_store.SESSION_KEY: embedding_store.make_key(PROMPT, dimensions=args.dimensions)})
+
+    db_before, cache_before = session_sizes(before)
+    db_after, cache_after = session_sizes(after)
+    print(f"{'session':<22}{'db bytes':>12}{'cache bytes':>14}")  # noqa: T201
+    print(f"{'vector in session':<22}{db_before:>12}{cache_before:>14}")  # noqa: T201
+    print(f"{'key in session':<22}{db_after:>12}{cache_after:>14}")  # noqa: T201
+    print(f"{'saved per turn':<22}{db_before - db_after:>12}{cache_before - cache_after:>14}")  # noqa: T201
+
+    print(f"\n{'store dtype':<22}{'blob bytes':>12}{'cosine':>14}")  # noqa: T201
+    original = np.asarray(vector, dtype=np.float32)
+    for dtype, _ in PromptEmbedding.DTYPE_CHOICES:
+        blob, scale = embedding_store.encode_vector(vector, dtype)
+        restored = embedding_store.decode_vector(blob, dtype, scale)
+        cosine = float(original @ restored / (np.linalg.norm(original) * np.linalg.norm(restored)))
+        print(f"{dtype:<22}{len(blob):>12}{cosine:>14.6f}")  # noqa: T201
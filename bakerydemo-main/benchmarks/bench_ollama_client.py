@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Benchmark the per-request overhead of the ways chatbot_api has talked to Ollama:
+a curl subprocess, a fresh requests.post, and the shared pooled OllamaClient.
+
+Runs against a local stub server, so the numbers are pure client overhead.
+
+    python benchmarks/bench_ollama_client.py --requests 500
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import FakeOllamaServer  # noqa: E402
+
+from bakerydemo.chatbot.ollama_client import OllamaClient  # noqa: E402
+
+PAYLOAD = {"model": "deepseek-bakery-expert", "prompt": "What is sourdough?", "stream": False}
+
+
+def time_calls(func, count):
+    """Call func count times and return the per-call durations in milliseconds."""
+    durations = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def bench_curl(url, count):
+    body = json.dumps(PAYLOAD)
+
+    def call():
+        result = subprocess.run(
+            ["curl", "-s", "-X", "POST", url, "-H", "Content-Type: application/json", "-d", body],
+            capture_output=True, text=True,
+        )
+        json.loads(result.stdout)
+
+    return time_calls(call, count)
+
+
+def bench_requests(url, count):
+    def call():
+        requests.post(url, json=PAYLOAD, timeout=10).json()
+
+    return time_calls(call, count)
+
+
+def bench_pooled(base_url, count):
+    client = OllamaClient(base_url, pool_size=4, timeout=10)
+    try:
+        return time_calls(lambda: client.generate(PAYLOAD), count)
+    finally:
+        client.close()
+
+
+def report(name, durations, baseline=None):
+    mean = statistics.mean(durations)
+    p50 = statistics.median(durations)
+    line = f"{name:<16} mean {mean:8.3f} ms   p50 {p50:8.3f} ms"
+    if baseline is not None:
+        line += f"   saved {baseline - mean:8.3f} ms/request"
+    print(line)  # noqa: T201
+    return mean
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Ollama client overhead against a local stub")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per method")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer().start()
+    generate_url = f"{server.url}/api/generate"
+    try:
+        print(f"Stub Ollama at {server.url}, {args.requests} requests per method")  # noqa: T201
+        results = {}
+        if shutil.which("curl"):
+            results["curl subprocess"] = bench_curl(generate_url, args.requests)
+        results["requests.post"] = bench_requests(generate_url, args.requests)
+        results["pooled client"] = bench_pooled(server.url, args.requests)
+
+        baseline = None
+        for name, durations in results.items():
+            mean = report(name, durations, baseline)
+            if baseline is None:
+                baseline = mean
+    finally:
+        server.stop()
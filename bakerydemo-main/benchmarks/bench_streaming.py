@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Compare time-to-first-token of blocking and streaming generation.
+
+The stub produces tokens at a fixed rate, like a CPU-bound Ollama host, so the
+blocking call only returns once the whole answer exists while the streaming
+call can show the first token almost immediately.
+
+    python benchmarks/bench_streaming.py --token-rate 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import FakeOllamaServer  # noqa: E402
+
+from bakerydemo.chatbot.ollama_client import OllamaClient  # noqa: E402
+
+PAYLOAD = {"model": "deepseek-bakery-expert", "prompt": "What is sourdough?"}
+
+
+def blocking_ttft(client):
+    start = time.perf_counter()
+    client.generate(PAYLOAD)
+    return (time.perf_counter() - start) * 1000
+
+
+def streaming_ttft(client):
+    start = time.perf_counter()
+    stream = client.generate_stream(PAYLOAD)
+    next(stream)
+    elapsed = (time.perf_counter() - start) * 1000
+    # Drain the rest so the pooled connection can be reused
+    for _ in stream:
+        pass
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time-to-first-token: blocking vs streaming")
+    parser.add_argument("--requests", type=int, default=10, help="Requests per mode")
+    parser.add_argument("--token-rate", type=float, default=20.0, help="Stub tokens per second")
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(token_rate=args.token_rate).start()
+    client = OllamaClient(server.url, pool_size=2, timeout=30)
+    try:
+        for name, func in (("blocking", blocking_ttft), ("streaming", streaming_ttft)):
+            durations = [func(client) for _ in range(args.requests)]
+            print(f"{name:<10} time to first token p50 {statistics.median(durations):8.1f} ms")  # noqa: T201
+    finally:
+        client.close()
+        server.stop()
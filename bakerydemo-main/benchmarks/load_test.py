@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""
+Offline load test for the chatbot API.
+
+Starts stub Ollama servers and a stub Bedrock runtime endpoint, serves the Django
+app in-process over HTTP on a local SQLite database (bakerydemo.settings.loadtest),
+and drives a chatbot endpoint from --concurrency clients, each with its own session.
+Reports throughput, latency percentiles, status codes and the server-side stage
+timings, without any network access:
+
+    python benchmarks/load_test.py --concurrency 16 --requests 400 --token-rate 50
+    python benchmarks/load_test.py --path /api/chatbot/stream/ --ollama-error-rate 0.05
+    python benchmarks/load_test.py --bedrock-throttle-rate 0.2 --max-p99-ms 1500
+    python benchmarks/load_test.py --embedding-backend hashing
+    OLLAMA_HEDGING=true python benchmarks/load_test.py --backends 2 --ollama-slow-rate 0.03
+
+With --url the same load is sent to an already running server instead (its
+Ollama and Bedrock endpoints are whatever that server is configured with).
+--max-p99-ms, --min-throughput and --max-error-rate make the run exit non-zero
+when a threshold is missed, so it can gate a CI job.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import FakeBedrockServer, FakeOllamaServer  # noqa: E402
+
+# A small pool of repeated questions (exercising the caches) next to unique ones
+COMMON_PROMPTS = [
+    "What time do you open on Sundays?",
+    "Do you sell gluten free bread?",
+    "What is in the sourdough loaf?",
+    "Can I order a birthday cake?",
+    "Where is the bakery?",
+]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class LoadTest:
+    """
+    Sends requests from concurrent clients until --requests have been sent or
+    --duration seconds have passed, recording latency and status of each.
+    """
+
+    def __init__(self, base_url, path, concurrency, total, duration, repeat_ratio, multi_turn, bedrock, seed=0):
+        self.url = base_url.rstrip("/") + path
+        self.streaming = "stream" in path
+        self.concurrency = concurrency
+        self.total = total
+        self.duration = duration
+        self.repeat_ratio = repeat_ratio
+        self.multi_turn = multi_turn
+        self.bedrock = bedrock
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._sent = 0
+        self.latencies = []
+        self.first_byte = []
+        self.statuses = Counter()
+        self.errors = Counter()
+
+    def _next_index(self, deadline):
+        with self._lock:
+            if self._sent >= self.total or (deadline and time.monotonic() >= deadline):
+                return None
+            self._sent += 1
+            return self._sent
+
+    def prompt(self, index):
+        # Deterministic per index, so runs are comparable
+        if (index * 7919 + self.seed) % 100 < self.repeat_ratio * 100:
+            return COMMON_PROMPTS[index % len(COMMON_PROMPTS)]
+        return f"Tell me something about loaf number {index} from the bakery"
+
+    def request(self, session, index):
+        body = {
+            "message": self.prompt(index),
+            "use_bedrock_embeddings": self.bedrock,
+            "use_history": self.multi_turn,
+        }
+        started_at = time.perf_counter()
+        first_byte = None
+        try:
+            with session.post(self.url, json=body, stream=self.streaming, timeout=300) as response:
+                if self.streaming:
+                    # Read one byte first; a larger read would wait for more of the stream
+                    body = response.raw.read(1, decode_content=True)
+                    if body:
+                        first_byte = time.perf_counter() - started_at
+                    body += response.raw.read(decode_content=True)
+                    if b"event: error" in body:
+                        self.errors["stream error event"] += 1
+                else:
+                    response.content
+                status = response.status_code
+        except requests.exceptions.RequestException as e:
+            status = "connection error"
+            self.errors[type(e).__name__] += 1
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            self.statuses[status] += 1
+            self.latencies.append(elapsed)
+            if first_byte is not None:
+                self.first_byte.append(first_byte)
+
+    def worker(self, deadline):
+        # One client with its own cookies, so every worker is its own chat session
+        session = requests.Session()
+        while True:
+            index = self._next_index(deadline)
+            if index is None:
+                return
+            self.request(session, index)
+
+    def run(self):
+        deadline = time.monotonic() + self.duration if self.duration else None
+        threads = [threading.Thread(target=self.worker, args=(deadline,)) for _ in range(self.concurrency)]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - started_at
+        return self
+
+    def report(self):
+        ok = self.statuses.get(200, 0)
+        latencies_ms = [latency * 1000 for latency in self.latencies]
+        result = {
+            "url": self.url,
+            "concurrency": self.concurrency,
+            "requests": len(self.latencies),
+            "seconds": round(self.elapsed, 2),
+            "throughput_rps": round(ok / self.elapsed, 1) if self.elapsed else 0.0,
+            "error_rate": round(1 - ok / len(self.latencies), 4) if self.latencies else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(latencies_ms, 0.50), 1),
+                "p95": round(percentile(latencies_ms, 0.95), 1),
+                "p99": round(percentile(latencies_ms, 0.99), 1),
+                "max": round(max(latencies_ms, default=0.0), 1),
+                "mean": round(statistics.mean(latencies_ms), 1) if latencies_ms else 0.0,
+            },
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+            "errors": dict(self.errors),
+        }
+        if self.first_byte:
+            first_byte_ms = [latency * 1000 for latency in self.first_byte]
+            result["first_byte_ms"] = {
+                "p50": round(percentile(first_byte_ms, 0.50), 1),
+                "p99": round(percentile(first_byte_ms, 0.99), 1),
+            }
+        return result
+
+
+def start_stubs(args):
+    """Start the stub servers and point the Django settings at them through the environment."""
+    ollama = [
+        FakeOllamaServer(
+            latency=args.ollama_latency,
+            token_rate=args.token_rate,
+            prompt_rate=args.prompt_rate,
+            error_rate=args.ollama_error_rate,
+            slow_rate=args.ollama_slow_rate,
+            slow_latency=args.ollama_slow_latency,
+            seed=n,
+        ).start()
+        for n in range(args.backends)
+    ]
+    bedrock = FakeBedrockServer(
+        latency=args.bedrock_latency,
+        token_rate=args.bedrock_token_rate,
+        error_rate=args.bedrock_error_rate,
+        throttle_rate=args.bedrock_throttle_rate,
+    ).start()
+    os.environ["OLLAMA_BACKENDS"] = ",".join(server.url for server in ollama)
+    os.environ["BEDROCK_ENDPOINT_URL"] = bedrock.url
+    # botocore signs every request, so it needs credentials even for the stub
+    os.environ["AWS_ACCESS_KEY_ID"] = "loadtest"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "loadtest"
+    if args.embedding_backend:
+        os.environ["CHATBOT_EMBEDDING_BACKEND"] = args.embedding_backend
+    return ollama, bedrock
+
+
+def serve_django():
+    """Migrate the load test database and serve the WSGI app from a background thread."""
+    os.environ["DJANGO_SETTINGS_MODULE"] = "bakerydemo.settings.loadtest"
+    import django
+
+    django.setup()
+
+    from django.core.management import call_command
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+
+    # Only the first run on a database applies migrations
+    call_command("migrate", verbosity=0, interactive=False)
+    logging.getLogger("django.server").setLevel(logging.ERROR)
+
+    server = ThreadedWSGIServer(("127.0.0.1", 0), WSGIRequestHandler)
+    server.daemon_threads = True
+    server.set_app(get_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def server_side_report():
+    """Stage percentiles and component counters recorded inside the app."""
+    from bakerydemo.chatbot.admission import get_admission_controller
+    from bakerydemo.chatbot.chatlog_writer import get_chat_log_writer
+    from bakerydemo.chatbot.metrics import get_metrics
+    from bakerydemo.chatbot.ollama_client import get_ollama_client
+
+    writer = get_chat_log_writer()
+    if writer is not None:
+        writer.flush()
+    snapshot = get_metrics().snapshot()
+    hedge_policy = get_ollama_client().hedge_policy
+    return {
+        "stages": snapshot.get("stage", {}),
+        "admission": get_admission_controller().stats(),
+        "chat_log_writer": writer.stats() if writer else None,
+        "hedging": hedge_policy.stats() if hedge_policy else None,
+    }
+
+
+def print_report(result, stubs):
+    print(f"\n{result['requests']} requests to {result['url']} from {result['concurrency']} clients in {result['seconds']}s")  # noqa: T201
+    print(f"throughput {result['throughput_rps']} req/s, error rate {result['error_rate']:.2%}")  # noqa: T201
+    latency = result["latency_ms"]
+    print(f"latency ms  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")  # noqa: T201
+    if "first_byte_ms" in result:
+        print(f"first byte ms  p50 {result['first_byte_ms']['p50']}  p99 {result['first_byte_ms']['p99']}")  # noqa: T201
+    print(f"statuses {result['statuses']}  client errors {result['errors'] or 'none'}")  # noqa: T201
+    for name, stats in stubs.items():
+        print(f"{name:<8} {stats}")  # noqa: T201
+    hedging = result.get("server", {}).get("hedging")
+    if hedging:
+        print(f"hedging  {hedging}")  # noqa: T201
+    stages = result.get("server", {}).get("stages")
+    if stages:
+        print(f"\n{'stage':<20}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")  # noqa: T201
+        for name, stats in stages.items():
+            print(f"{name:<20}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")  # noqa: T201
+
+
+def check_thresholds(result, args):
+    failures = []
+    if args.max_p99_ms is not None and result["latency_ms"]["p99"] > args.max_p99_ms:
+        failures.append(f"p99 {result['latency_ms']['p99']} ms > {args.max_p99_ms} ms")
+    if args.min_throughput is not None and result["throughput_rps"] < args.min_throughput:
+        failures.append(f"throughput {result['throughput_rps']} req/s < {args.min_throughput} req/s")
+    if args.max_error_rate is not None and result["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {result['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test of the chatbot API")
+    parser.add_argument("--url", help="Load an already running server instead of the in-process app")
+    parser.add_argument("--path", default="/api/chatbot/", help="Endpoint to load (e.g. /api/chatbot/stream/)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="Total requests")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds (0: no limit)")
+    parser.add_argument("--repeat-ratio", type=float, default=0.3, help="Share of prompts from the repeated pool")
+    parser.add_argument("--multi-turn", action="store_true", help="Keep each client's conversation history")
+    parser.add_argument("--no-bedrock", action="store_true", help="Do not request prompt embeddings")
+    parser.add_argument("--embedding-backend", help="CHATBOT_EMBEDDING_BACKEND of the app (e.g. hashing: no Bedrock calls)")
+    parser.add_argument("--backends", type=int, default=1, help="Stub Ollama servers")
+    parser.add_argument("--ollama-latency", type=float, default=0.0, help="Stub Ollama fixed latency (seconds)")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Stub Ollama answer tokens per second")
+    parser.add_argument("--prompt-rate", type=float, default=0.0, help="Stub Ollama prompt tokens per second")
+    parser.add_argument("--ollama-error-rate", type=float, default=0.0, help="Share of Ollama requests failing with 500")
+    parser.add_argument("--ollama-slow-rate", type=float, default=0.0, help="Share of Ollama requests stalling first")
+    parser.add_argument("--ollama-slow-latency", type=float, default=2.0, help="Seconds a slow Ollama request stalls")
+    parser.add_argument("--bedrock-latency", type=float, default=0.05, help="Stub Bedrock fixed latency (seconds)")
+    parser.add_argument("--bedrock-token-rate", type=float, default=0.0, help="Stub Bedrock input tokens per second")
+    parser.add_argument("--bedrock-error-rate", type=float, default=0.0, help="Share of Bedrock calls failing with 500")
+    parser.add_argument("--bedrock-throttle-rate", type=float, default=0.0, help="Share of Bedrock calls throttled (429)")
+    parser.add_argument("--max-p99-ms", type=float, help="Fail if p99 latency exceeds this")
+    parser.add_argument("--min-throughput", type=float, help="Fail if successful requests/s fall below this")
+    parser.add_argument("--max-error-rate", type=float, help="Fail if the share of non-200 responses exceeds this")
+    parser.add_argument("--json", help="Also write the result as JSON to this file")
+    args = parser.parse_args()
+
+    ollama_servers, bedrock_server, app_server = [], None, None
+    if args.url:
+        base_url = args.url
+    else:
+        ollama_servers, bedrock_server = start_stubs(args)
+        app_server, base_url = serve_django()
+
+    try:
+        load_test = LoadTest(
+            base_url,
+            args.path,
+            args.concurrency,
+            args.requests if not args.duration else 10**9,
+            args.duration,
+            args.repeat_ratio,
+            args.multi_turn,
+            bedrock=not args.no_bedrock,
+        ).run()
+        result = load_test.report()
+        stubs = {}
+        if app_server is not None:
+            result["server"] = server_side_report()
+            stubs = {f"ollama{n}": server.stats() for n, server in enumerate(ollama_servers)}
+            stubs["bedrock"] = bedrock_server.stats()
+            result["stubs"] = stubs
+        print_report(result, stubs)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent=2)
+
+        failures = check_thresholds(result, args)
+        for failure in failures:
+            print(f"FAILED: {failure}")  # noqa: T201
+    finally:
+        if app_server is not None:
+            app_server.shutdown()
+        for server in ollama_servers + ([bedrock_server] if bedrock_server else []):
+            server.stop()
+    sys.exit(1 if failures else 0)
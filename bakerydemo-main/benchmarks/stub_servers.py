@@ -0,0 +1,444 @@
+"""
+Local stub servers used by the benchmark scripts and the load test.
+They speak just enough of the Ollama HTTP API and of the Bedrock runtime
+invoke_model API to exercise the chatbot without any network access. Both take a
+fixed latency, a token rate and an error rate to inject failures.
+"""
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_TOKENS = "Sourdough is leavened with a natural starter of wild yeast and lactobacilli .".split(" ")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_keep_alive(value, default=300):
+    """Seconds for an Ollama keep_alive value ("30m", "10s", 600, -1 for ever)."""
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    for unit in sorted(DURATION_UNITS, key=len, reverse=True):
+        if value.endswith(unit):
+            seconds = float(value[: -len(unit)]) * DURATION_UNITS[unit]
+            return float("inf") if seconds < 0 else seconds
+    return parse_keep_alive(float(value))
+
+
+def expires_at(seconds):
+    """Format an /api/ps expires_at timestamp seconds from now."""
+    if seconds == float("inf"):
+        return "2318-08-21T12:00:00Z"
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """
+    Answers /api/generate and /api/chat with a canned response after an optional
+    delay, and /api/version for health checks.
+    Prompts are processed at server.prompt_rate tokens per second and answer tokens
+    produced at server.token_rate per second (0 means instantly). A model
+    that is not loaded first takes server.load_time seconds to load and then stays
+    loaded for the request's keep_alive, as listed by /api/ps. A server.slow_rate
+    share of generations stalls for server.slow_latency seconds first, like a host
+    that is occasionally much slower than the rest.
+    """
+
+    # HTTP/1.1 so that clients can keep the connection alive between requests
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this Nagle + delayed ACK
+    # adds ~40 ms to every response on a kept-alive connection
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep benchmark output readable
+        pass
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self.send_json({"version": "0.0.0-stub"})
+            return
+        if self.path == "/api/ps":
+            self.send_json({"models": self.server.loaded_models()})
+            return
+        self.send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        payload = self.read_json()
+        if self.path == "/api/embed":
+            self.embed(payload)
+            return
+        if self.path not in ("/api/generate", "/api/chat"):
+            self.send_json({"error": "not found"}, status=404)
+            return
+        self.chat = self.path == "/api/chat"
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.inject_error():
+            self.send_json({"error": "injected failure"}, status=500)
+            return
+        if self.server.slow_rate and self.server.chance(self.server.slow_rate):
+            time.sleep(self.server.slow_latency)
+        self.load_duration = self.server.load_model(payload.get("model", ""), payload.get("keep_alive"))
+        if not payload.get("messages" if self.chat else "prompt"):
+            # A prompt-less request only loads the model
+            self.send_json(dict(
+                self.answer(""),
+                model=payload.get("model", ""),
+                done=True,
+                done_reason="load",
+                load_duration=self.load_duration,
+            ))
+            return
+        # num_predict caps the answer like it does in Ollama
+        num_predict = (payload.get("options") or {}).get("num_predict", -1)
+        self.tokens = ANSWER_TOKENS if num_predict < 0 else ANSWER_TOKENS[:num_predict]
+        self.done_reason = "length" if len(self.tokens) < len(ANSWER_TOKENS) else "stop"
+        self.evaluate_prompt(payload)
+        if payload.get("stream", True):
+            self.stream_tokens(payload)
+            return
+
+        started_at = time.perf_counter()
+        self.wait_for_tokens(len(self.tokens))
+        self.send_json(dict(
+            self.timing_fields(started_at),
+            **self.answer(" ".join(self.tokens)),
+            model=payload.get("model", ""),
+            done=True,
+            done_reason=self.done_reason,
+        ))
+
+    def embed(self, payload):
+        """/api/embed: a normalized vector per input, like Ollama returns them."""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.inject_error():
+            self.send_json({"error": "injected failure"}, status=500)
+            return
+        texts = payload.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        self.send_json({
+            "model": payload.get("model", ""),
+            "embeddings": [embedding_for(text) for text in texts],
+            "load_duration": self.server.load_model(payload.get("model", ""), payload.get("keep_alive")),
+        })
+
+    def answer(self, text):
+        """The answer field of a response or chunk: "response" for /api/generate, "message" for /api/chat."""
+        if self.chat:
+            return {"message": {"role": "assistant", "content": text}}
+        return {"response": text}
+
+    def evaluate_prompt(self, payload):
+        """
+        Spend the time processing the prompt would take; about four characters per token.
+        With a context from an earlier /api/generate only the new prompt is processed.
+        """
+        if self.chat:
+            text = "".join(message.get("content", "") for message in payload["messages"])
+        elif payload.get("context"):
+            text = payload["prompt"]
+        else:
+            text = payload.get("system", "") + payload["prompt"]
+        self.prompt_eval_count = max(1, len(text) // 4)
+        # Stand-in token ids for what the model has now seen, returned as "context"
+        self.context = None if self.chat else list(payload.get("context") or []) + [1] * (self.prompt_eval_count + len(self.tokens))
+        self.prompt_eval_duration = 0
+        if self.server.prompt_rate:
+            time.sleep(self.prompt_eval_count / self.server.prompt_rate)
+            self.prompt_eval_duration = int(self.prompt_eval_count / self.server.prompt_rate * 1e9)
+
+    def timing_fields(self, started_at):
+        """The nanosecond timing fields (and for /api/generate the context) Ollama adds to its final response."""
+        eval_duration = int((time.perf_counter() - started_at) * 1e9)
+        fields = {} if self.context is None else {"context": self.context}
+        return dict(fields, **{
+            "total_duration": eval_duration + self.load_duration + self.prompt_eval_duration,
+            "load_duration": self.load_duration,
+            "prompt_eval_count": self.prompt_eval_count,
+            "prompt_eval_duration": self.prompt_eval_duration,
+            "eval_count": len(self.tokens),
+            "eval_duration": eval_duration,
+        })
+
+    def wait_for_tokens(self, count):
+        if self.server.token_rate:
+            time.sleep(count / self.server.token_rate)
+
+    def stream_tokens(self, payload):
+        """Send one NDJSON line per token using chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        started_at = time.perf_counter()
+        chunks = [dict(self.answer(token + " "), done=False) for token in self.tokens]
+        chunks.append(dict(self.answer(""), done=True, done_reason=self.done_reason))
+        try:
+            for chunk in chunks:
+                self.wait_for_tokens(1)
+                if chunk["done"]:
+                    chunk.update(self.timing_fields(started_at))
+                line = (json.dumps(dict(chunk, model=payload.get("model", ""))) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, as Ollama's clients do at a deadline
+            self.close_connection = True
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server run from a daemon thread, with request counters and
+    error injection shared by the stubs.
+    """
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, handler, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, seed=None):
+        super().__init__((host, port), handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.counters_lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def inject_error(self, rate=None):
+        """Count a request and decide whether it fails, with probability rate (default error_rate)."""
+        rate = self.error_rate if rate is None else rate
+        with self.counters_lock:
+            self.requests += 1
+            failed = rate > 0 and self.random.random() < rate
+            if failed:
+                self.errors += 1
+        return failed
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-request (cancelled hedges, deadlines) are expected
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def chance(self, rate):
+        with self.counters_lock:
+            return self.random.random() < rate
+
+    def stats(self):
+        with self.counters_lock:
+            return {"requests": self.requests, "errors": self.errors}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeOllamaServer(StubServer):
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        token_rate=0.0,
+        load_time=0.0,
+        prompt_rate=0.0,
+        error_rate=0.0,
+        seed=None,
+        slow_rate=0.0,
+        slow_latency=2.0,
+    ):
+        super().__init__(FakeOllamaHandler, host, port, latency=latency, error_rate=error_rate, seed=seed)
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.token_rate = token_rate
+        self.prompt_rate = prompt_rate
+        self.load_time = load_time
+        # Model name -> time.monotonic() at which it is unloaded
+        self.models = {}
+        self.models_lock = threading.Lock()
+
+    def load_model(self, model, keep_alive=None):
+        """Load a model if needed and extend its keep-alive; returns the load_duration in ns."""
+        with self.models_lock:
+            now = time.monotonic()
+            cold = self.models.get(model, 0) <= now
+            self.models[model] = now + parse_keep_alive(keep_alive)
+        if cold and self.load_time:
+            time.sleep(self.load_time)
+            return int(self.load_time * 1e9)
+        return 0
+
+    def unload_model(self, model):
+        with self.models_lock:
+            self.models.pop(model, None)
+
+    def loaded_models(self):
+        with self.models_lock:
+            now = time.monotonic()
+            return [
+                {"name": model, "model": model, "size_vram": 1 << 30, "expires_at": expires_at(expires - now)}
+                for model, expires in self.models.items()
+                if expires > now
+            ]
+
+
+class FakeBedrockHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Bedrock runtime InvokeModel call (POST /model/{modelId}/invoke) for
+    Titan text embeddings with a deterministic unit vector per input text; the
+    binary embedding type (embeddingTypes) marks that vector's positive dimensions.
+    Input tokens are processed at server.token_rate per second (0 means instantly).
+    Injected failures are answered the way Bedrock does, so botocore raises the same
+    ClientError: ThrottlingException (429) or InternalServerException (500).
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    invoke_path = re.compile(r"^/model/(?P<model_id>[^/]+)/invoke$")
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_type(self, error_type, message, status):
+        self.send_json({"message": message}, status=status, headers={"x-amzn-ErrorType": f"{error_type}:http://internal.amazon.com/coral/com.amazon.bedrock/"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if not self.invoke_path.match(self.path):
+            self.send_error_type("UnknownOperationException", "Unknown operation", 404)
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.inject_throttle():
+            self.send_error_type("ThrottlingException", "Too many requests, please wait before trying again.", 429)
+            return
+        if self.server.inject_error():
+            self.send_error_type("InternalServerException", "Injected failure", 500)
+            return
+
+        payload = json.loads(body or b"{}")
+        text = payload.get("inputText", "")
+        tokens = max(1, len(text) // 4)
+        if self.server.token_rate:
+            time.sleep(tokens / self.server.token_rate)
+        embedding = embedding_for(text, payload.get("dimensions", 1024), payload.get("normalize", True))
+        response = {"inputTextTokenCount": tokens}
+        types = payload.get("embeddingTypes")
+        if types:
+            # Titan's binary embedding marks the positive dimensions
+            by_type = {"float": embedding, "binary": [1 if value > 0 else 0 for value in embedding]}
+            response["embeddingsByType"] = {name: by_type[name] for name in types}
+        if not types or "float" in types:
+            response["embedding"] = embedding
+        self.send_json(response)
+
+
+def embedding_for(text, dimensions=1024, normalize=True):
+    """A deterministic pseudo-random vector for a text, so equal prompts embed equally."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    if normalize:
+        norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        vector = [value / norm for value in vector]
+    return vector
+
+
+class FakeBedrockServer(StubServer):
+    """
+    A Bedrock runtime endpoint for BedrockEmbeddings; point it here with the
+    BEDROCK_ENDPOINT_URL environment variable.
+
+    Requests are throttled at random (throttle_rate) and, like an account quota,
+    beyond max_rps requests in any one second (0 means no quota).
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        token_rate=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        max_rps=0.0,
+        seed=None,
+    ):
+        super().__init__(FakeBedrockHandler, host, port, latency=latency, error_rate=error_rate, seed=seed)
+        self.token_rate = token_rate
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.accepted = deque()
+        self.throttled = 0
+
+    def over_quota(self):
+        """Whether a request now exceeds max_rps; call with counters_lock held."""
+        if not self.max_rps:
+            return False
+        now = time.monotonic()
+        while self.accepted and self.accepted[0] <= now - 1.0:
+            self.accepted.popleft()
+        if len(self.accepted) >= self.max_rps:
+            return True
+        self.accepted.append(now)
+        return False
+
+    def inject_throttle(self):
+        with self.counters_lock:
+            throttled = self.throttle_rate > 0 and self.random.random() < self.throttle_rate
+            throttled = throttled or self.over_quota()
+            if throttled:
+                self.throttled += 1
+                # Throttled calls are requests too; inject_error() counts the others
+                self.requests += 1
+        return throttled
+
+    def stats(self):
+        stats = super().stats()
+        with self.counters_lock:
+            stats["throttled"] = self.throttled
+        return stats
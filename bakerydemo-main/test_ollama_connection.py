@@ -8,12 +8,19 @@ import requests
 import subprocess
 import time
 
-# The Ollama API URL to test
-OLLAMA_API_URL = "http://ec2-3-106-117-22.ap-southeast-2.compute.amazonaws.com:11434/api/generate"
+# The Ollama API URLs to test: OLLAMA_BACKENDS (comma-separated) or the host from settings/base.py
+DEFAULT_OLLAMA_API_URL = "http://ec2-54-252-174-64.ap-southeast-2.compute.amazonaws.com:11434/api/generate"
+OLLAMA_BACKENDS = [url.strip() for url in os.environ.get("OLLAMA_BACKENDS", DEFAULT_OLLAMA_API_URL).split(",") if url.strip()]
 
-def test_with_requests():
+
+def generate_url(api_url):
+    """Accept either a server base URL or a full /api/generate URL"""
+    api_url = api_url.rstrip("/")
+    return api_url if "/api/" in api_url else f"{api_url}/api/generate"
+
+def test_with_requests(api_url):
     """Test connection using the requests library"""
-    print(f"\n=== Testing connection to {OLLAMA_API_URL} using requests ===")
+    print(f"\n=== Testing connection to {api_url} using requests ===")
     
     payload = {
         "model": "deepseek-r1:1.5b",
@@ -27,7 +34,7 @@ def test_with_requests():
         print("Sending request...")
         start_time = time.time()
         response = requests.post(
-            OLLAMA_API_URL,
+            api_url,
             json=payload,
             headers=headers,
             timeout=60
@@ -60,11 +67,11 @@ def test_with_requests():
         print(f"Unexpected error: {str(e)}")
         return False
 
-def test_with_curl():
+def test_with_curl(api_url):
     """Test connection using curl command"""
-    print(f"\n=== Testing connection to {OLLAMA_API_URL} using curl ===")
+    print(f"\n=== Testing connection to {api_url} using curl ===")
     
-    curl_cmd = f'curl -v -X POST "{OLLAMA_API_URL}" -H "Content-Type: application/json" -d "{{\\"model\\":\\"deepseek-r1:1.5b\\",\\"prompt\\":\\"Hello, testing the connection!\\",\\"stream\\":false}}"'
+    curl_cmd = f'curl -v -X POST "{api_url}" -H "Content-Type: application/json" -d "{{\\"model\\":\\"deepseek-r1:1.5b\\",\\"prompt\\":\\"Hello, testing the connection!\\",\\"stream\\":false}}"'
     
     print(f"Running command: {curl_cmd}")
     
@@ -95,15 +102,15 @@ def test_with_curl():
         print(f"Error running curl command: {str(e)}")
         return False
 
-def test_ping():
+def test_ping(api_url):
     """Test basic connectivity to the host with ping"""
     print("\n=== Testing basic connectivity with ping ===")
     
     # Extract hostname from URL
     import re
-    hostname_match = re.search(r'http://([^:/]+)', OLLAMA_API_URL)
+    hostname_match = re.search(r'http://([^:/]+)', api_url)
     if not hostname_match:
-        print(f"Could not extract hostname from URL: {OLLAMA_API_URL}")
+        print(f"Could not extract hostname from URL: {api_url}")
         return False
         
     hostname = hostname_match.group(1)
@@ -126,7 +133,7 @@ def test_ping():
         print(f"Error running ping command: {str(e)}")
         return False
 
-def test_telnet():
+def test_telnet(api_url):
     """Test if the port is open using telnet-like functionality"""
     print("\n=== Testing port connectivity ===")
     
@@ -134,9 +141,9 @@ def test_telnet():
     import socket
     
     # Extract hostname and port from URL
-    url_match = re.search(r'http://([^:]+):(\d+)', OLLAMA_API_URL)
+    url_match = re.search(r'http://([^:]+):(\d+)', api_url)
     if not url_match:
-        print(f"Could not extract hostname and port from URL: {OLLAMA_API_URL}")
+        print(f"Could not extract hostname and port from URL: {api_url}")
         return False
         
     hostname = url_match.group(1)
@@ -167,18 +174,19 @@ def test_telnet():
     finally:
         sock.close()
 
-if __name__ == "__main__":
-    print("=== Ollama API Connection Test ===")
-    print(f"Testing connection to: {OLLAMA_API_URL}")
+def run_tests(api_url):
+    """Run every check against one Ollama backend"""
+    api_url = generate_url(api_url)
+    print(f"\nTesting connection to: {api_url}")
     
     # Run all tests
-    ping_result = test_ping()
-    telnet_result = test_telnet()
-    curl_result = test_with_curl()
-    requests_result = test_with_requests()
+    ping_result = test_ping(api_url)
+    telnet_result = test_telnet(api_url)
+    curl_result = test_with_curl(api_url)
+    requests_result = test_with_requests(api_url)
     
     # Summary
-    print("\n=== Test Summary ===")
+    print(f"\n=== Test Summary for {api_url} ===")
     print(f"Ping test: {'PASSED' if ping_result else 'FAILED'}")
     print(f"Port connectivity test: {'PASSED' if telnet_result else 'FAILED'}")
     print(f"Curl test: {'PASSED' if curl_result else 'FAILED'}")
@@ -192,4 +200,15 @@ if __name__ == "__main__":
         print("SOLUTION: Check if the EC2 instance is running and has a public IP address.")
     elif telnet_result and not (curl_result or requests_result):
         print("\nDIAGNOSIS: The port is open but the Ollama API is not responding correctly.")
-        print("SOLUTION: Check if the Ollama service is running properly on the EC2 instance.")
\ No newline at end of file
+        print("SOLUTION: Check if the Ollama service is running properly on the EC2 instance.")
+    
+    return curl_result or requests_result
+
+if __name__ == "__main__":
+    print("=== Ollama API Connection Test ===")
+    
+    results = {url: run_tests(url) for url in OLLAMA_BACKENDS}
+    
+    print("\n=== Backends ===")
+    for url, ok in results.items():
+        print(f"{url}: {'REACHABLE' if ok else 'UNREACHABLE'}")